@@ -300,6 +300,21 @@ def run_cast():
 
 # -------------------Run mhw analysis on E01 mooring data----------------------
 
+def detect_mooring_mhws(df_daily_means: pd.DataFrame, bin_depths: list) -> dict:
+    """
+    Run the MHW detection on the daily mean temperature at each bin depth
+    :param df_daily_means: daily mean data with Ordinal_time and Temperature_{depth}m columns
+    :param bin_depths: bin depths to run the detection for
+    :return: dict of depth: (mhws, clim) from mhw.detect()
+    """
+    mhw_results = {}
+    for d in bin_depths:
+        # t: Time vector, in datetime format (e.g., date(1982,1,1).toordinal())
+        mhw_results[d] = mhw.detect(t=df_daily_means['Ordinal_time'].values,
+                                    temp=df_daily_means[f'Temperature_{d}m'].values)
+    return mhw_results
+
+
 def run_mooring():
     bin_depths = [35, 75, 92]
 
@@ -317,12 +332,10 @@ def run_mooring():
     print_ge_3C_dates = False
     take_90p_diff = True
 
-    for d in bin_depths[:2]:
-        # Run the analysis
-        # t: Time vector, in datetime format (e.g., date(1982,1,1).toordinal())
-        mhws_d, clim_d = mhw.detect(t=df_daily_means['Ordinal_time'].values,
-                                    temp=df_daily_means[f'Temperature_{d}m'].values)
+    # Run the analysis
+    mhw_results = detect_mooring_mhws(df_daily_means, bin_depths[:2])
 
+    for d, (mhws_d, clim_d) in mhw_results.items():
         # get start month-year for all big events for E01 at 35m and 75m
 
         if do_plot1:
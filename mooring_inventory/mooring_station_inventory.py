@@ -1,11 +1,17 @@
 import numpy as np
 # import xarray as xr
 import os
+import sys
 import glob
-import ios_shell
-from tqdm import trange
+import json
+from concurrent.futures import ProcessPoolExecutor
+from tqdm import tqdm
 import pandas as pd
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+from shell_header import get_shell_metadata
+from file_catalog import get_file_entries
+
 # ----------------------------osd_data_archive/Mooring_Data--------------------------
 
 # Output a csv file containing the lat, lon, water depth, and years active for every
@@ -27,101 +33,189 @@ mooring_dir = 'Y:\\Mooring_Data\\'
 #                   'mooring_station_inventory_all.csv')
 output_df_name = 'mooring_station_inventory_all.csv'
 
-# subdirs don't exist for 2016 and 2017
-subdirs_new = [mooring_dir + f'{x}-recoveries\\' for x in np.arange(2015, 2024)]
-
-subdirs_all = glob.glob(mooring_dir + '*\\')
-
-# key: value, where value={latitude: a, longitude: b, water_depth:c, years_active:d}
-station_dict = {}
-# station_df = pd.DataFrame(
-#     columns=['station', "latitude", 'longitude', 'qater_depth', 'years_active']
-# )
-
-# for subdir in subdirs:
-#     if os.path.exists(subdir):
-for subdir in subdirs_all:
-    print(subdir)
+# Header metadata of each file scanned so far, keyed on the file path and checked against its size and
+# modification time, so that a re-run only reads the headers of new or changed files
+cache_file_name = 'mooring_station_inventory_cache.json'
+
+# Catalog of the archive's file names, see scripts/file_catalog.py
+catalog_file_name = 'mooring_station_inventory_catalog.sqlite'
+
+# Number of processes to scan the year subdirectories with
+num_workers = 4
+
+
+def get_file_years(f: str, df_entry: pd.Series):
+    """
+    Get start year, end year from the catalog entry of a file, which is parsed from the file name,
+    or from the file name itself if the catalog couldn't parse it, e.g. if it has no depth
+    Assume name format STN_YYYYMMDD_YYYYMMDD_DEPTHm.suffix
+    :param f: full path to the file
+    :param df_entry: row of file_catalog.get_file_entries() for the file
+    :return: list of the start year and, if different, the end year, or None if the file name is invalid
+    """
+    if not pd.isna(df_entry['start_date']):
+        year_st = int(df_entry['start_date'][:4])
+        year_en = int(df_entry['end_date'][:4])
+    else:
+        try:
+            year_st = int(os.path.basename(f).split('_')[1][:4])
+            year_en = int(os.path.basename(f).split('_')[2][:4])
+        except (IndexError, ValueError):
+            return None
+    return [year_st, year_en] if year_st < year_en else [year_st]
+
+
+def scan_subdir(subdir: str, cache: dict) -> list:
+    """
+    Read the header metadata of the current meter and CTD files in a year subdirectory of the archive.
+    Top-level function so that it can be run in a worker process
+    :param subdir: full path to the subdirectory
+    :param cache: cache entries of the files in the subdirectory, keyed on the file path
+    :return: list of (file path, cache entry) in sorted order of the files, where the cache entry holds the size,
+    modification time, station, latitude, longitude and water depth of the file
+    """
     # search is not case-sensitive
     mctd_files = glob.glob(subdir + '*\\*.ctd')
     cur_files = glob.glob(subdir + '*\\*.cur')
-    adcp_files = glob.glob(subdir + '*\\*.adcp')
+    # adcp_files = glob.glob(subdir + '*\\*.adcp')
 
     all_files = cur_files + mctd_files
     all_files.sort()
 
-    # Open each file with a parser
-    # If station not in station_dict yet, add it
-    for i in trange(len(all_files)):
-        f = all_files[i]
-
+    results = []
+    for f in all_files:
         # Skip historical files
         if 'History' in f or 'HISTORY' in f:
             continue
 
-        # Get start year, end year from file name
-        # Assume name format STN_YYYYMMDD_YYYYMMDD_DEPTHm.suffix
-        try:
-            year_st = int(os.path.basename(f).split('_')[1][:4])
-            year_en = int(os.path.basename(f).split('_')[2][:4])
-            years_active = [year_st, year_en] if year_st < year_en else [year_st]
-        except IndexError:
-            print('Invalid filename for file', f, 'skipping !!')
-            continue
-
-        # Read in IOS Shell format file
-        try:
-            parsed = ios_shell.ShellFile.fromfile(all_files[i])
-        except ValueError:
-            print('Possible unknown time format: UTC, in file', f,
-                  '; skipping file for you to add later !!')
-            continue
-
-        station = parsed.location.station
-        water_depth = parsed.location.water_depth
-        latitude = parsed.location.latitude
-        longitude = parsed.location.longitude
-
-        # if station in station_df['station']:
-        if station in station_dict.keys():
-            # Add active years if not already present
-            for year in years_active:
-                if year not in station_dict[station]['years_active']:
-                    station_dict[station]['years_active'].append(year)
-        elif station.upper() in station_dict.keys():
-            # Add active years if not already present
-            for year in years_active:
-                if year not in station_dict[station]['years_active']:
-                    station_dict[station]['years_active'].append(year)
-        else:
-            station_dict[station] = {'latitude': latitude,
-                                     'longitude': longitude,
-                                     'water_depth': water_depth,
-                                     'years_active': years_active}
-
-# Sort the active years
-for station in station_dict.keys():
-    station_dict[station]['years_active'].sort()
-
-# Convert the dict to a pandas dataframe
-station_all = station_dict.keys()
-latitude_all = [station_dict[k]['latitude'] for k in station_all]
-longitude_all = [station_dict[k]['longitude'] for k in station_all]
-water_depth_all = [station_dict[k]['water_depth'] for k in station_all]
-years_active_all = [
-    '|'.join([str(x) for x in station_dict[k]['years_active']]) for k in station_all
-]
-
-df_out = pd.DataFrame({'station': station_all,
-                       'latitude': latitude_all,
-                       'longitude': longitude_all,
-                       'water_depth': water_depth_all,
-                       'years_active': years_active_all})
-
-# Sort the dataframe based on the station name
-df_out.sort_values(by=['station'], inplace=True)
-
-df_out.to_csv(output_df_name, index=False)
+        stat = os.stat(f)
+        entry = cache.get(f)
+        if entry is None or entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime:
+            # Read the *LOCATION section of the IOS Shell format file header; the data records aren't needed
+            metadata = get_shell_metadata(f)
+            entry = {'size': stat.st_size, 'mtime': stat.st_mtime}
+            for key in ['station', 'latitude', 'longitude', 'water_depth']:
+                entry[key] = metadata[key]
+        results.append((f, entry))
+    return results
+
+
+def load_cache(cache_file: str) -> dict:
+    """
+    :param cache_file: full path to the cache json file
+    :return: dict of file path: cache entry, empty if there is no cache yet
+    """
+    if not os.path.exists(cache_file):
+        return {}
+    with open(cache_file, 'r') as f:
+        return json.load(f)
+
+
+def save_cache(cache: dict, cache_file: str):
+    """
+    Save the cache, replacing any previous one only once it is fully written
+    :param cache: dict of file path: cache entry
+    :param cache_file: full path to the cache json file
+    :return:
+    """
+    with open(cache_file + '.tmp', 'w') as f:
+        json.dump(cache, f)
+    os.replace(cache_file + '.tmp', cache_file)
+    return
+
+
+def scan_archive(subdirs: list, cache_file: str, catalog_file: str, num_workers: int = 1) -> dict:
+    """
+    Scan the year subdirectories of the archive, in parallel if num_workers > 1, and collect the
+    location and active years of each station. Stations get the location of the first file found for them,
+    going through the subdirectories in the order given and the files in sorted order
+    :param subdirs: full paths to the subdirectories
+    :param cache_file: full path to the cache of file header metadata, see cache_file_name
+    :param catalog_file: full path to the catalog of file names, see catalog_file_name
+    :param num_workers: number of processes to scan subdirectories with
+    :return: dict of station: dict of latitude, longitude, water_depth and set of years_active
+    """
+    cache = load_cache(cache_file)
+    subdir_caches = [{f: entry for f, entry in cache.items() if f.startswith(subdir)} for subdir in subdirs]
+
+    if num_workers > 1:
+        executor = ProcessPoolExecutor(max_workers=num_workers)
+        # Results come back in the order of subdirs, so the inventory is the same as a serial scan
+        subdir_results = executor.map(scan_subdir, subdirs, subdir_caches)
+    else:
+        executor = None
+        subdir_results = map(scan_subdir, subdirs, subdir_caches)
+
+    # key: value, where value={latitude: a, longitude: b, water_depth:c, years_active:d}
+    station_dict = {}
+    # Keep the entries of subdirectories that weren't scanned; entries of files that no longer exist are dropped
+    new_cache = {f: entry for f, entry in cache.items() if not f.startswith(tuple(subdirs))}
+    for subdir, results in tqdm(zip(subdirs, subdir_results), total=len(subdirs)):
+        df_entries = get_file_entries([f for f, _ in results], catalog_file)
+        for (f, entry), (_, df_entry) in zip(results, df_entries.iterrows()):
+            new_cache[f] = entry
+
+            years_active = get_file_years(f, df_entry)
+            if years_active is None:
+                print('Invalid filename for file', f, 'skipping !!')
+                continue
+            if entry['station'] is None:
+                print('No station in the header of file', f, '; skipping file for you to add later !!')
+                continue
+
+            # Files may give the station name in upper or lower case
+            station = entry['station']
+            if station not in station_dict and station.upper() in station_dict:
+                station = station.upper()
+
+            # If station not in station_dict yet, add it
+            if station not in station_dict:
+                station_dict[station] = {'latitude': entry['latitude'],
+                                         'longitude': entry['longitude'],
+                                         'water_depth': entry['water_depth'],
+                                         'years_active': set()}
+            station_dict[station]['years_active'].update(years_active)
+
+    if executor is not None:
+        executor.shutdown()
+
+    save_cache(new_cache, cache_file)
+    return station_dict
+
+
+def make_inventory(station_dict: dict) -> pd.DataFrame:
+    """
+    Convert the stations found by scan_archive() to a dataframe sorted by station name
+    :param station_dict: dict of station: dict of latitude, longitude, water_depth and set of years_active
+    :return: dataframe with one row per station
+    """
+    station_all = list(station_dict.keys())
+    df_out = pd.DataFrame({
+        'station': station_all,
+        'latitude': [station_dict[k]['latitude'] for k in station_all],
+        'longitude': [station_dict[k]['longitude'] for k in station_all],
+        'water_depth': [station_dict[k]['water_depth'] for k in station_all],
+        # Sort the active years
+        'years_active': ['|'.join([str(x) for x in sorted(station_dict[k]['years_active'])]) for k in station_all]
+    })
+
+    # Sort the dataframe based on the station name
+    df_out.sort_values(by=['station'], inplace=True)
+    return df_out
+
+
+if __name__ == '__main__':
+    # subdirs don't exist for 2016 and 2017
+    subdirs_new = [mooring_dir + f'{x}-recoveries\\' for x in np.arange(2015, 2024)]
+
+    subdirs_all = glob.glob(mooring_dir + '*\\')
+
+    # for subdir in subdirs_new:
+    #     if os.path.exists(subdir):
+    station_dict = scan_archive(subdirs_all, cache_file_name, catalog_file_name, num_workers)
+
+    df_out = make_inventory(station_dict)
+    df_out.to_csv(output_df_name, index=False)
 
 # ----------------------------osd_data_archive/netCDF_Data------------------------------
 
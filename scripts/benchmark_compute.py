@@ -0,0 +1,325 @@
+import argparse
+import datetime
+import json
+import os
+import glob
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import plot_moored_data as pmd
+from synthetic_mooring_data import make_deployments, make_station_data
+
+try:
+    import convert_cur_ctd_from_shell as conversion
+except ImportError:
+    # The conversion script needs ios_shell and gsw, so its benchmarks are skipped without them
+    conversion = None
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'e01', 'mhw_analysis'))
+try:
+    import mhw_analysis
+except ImportError:
+    # The MHW analysis needs marineHeatWaves and scipy, so its benchmark is skipped without them
+    mhw_analysis = None
+
+"""
+Time the processing functions on synthetic station data at several scales, and save the timings as
+baselines to compare later runs against, e.g.:
+python benchmark_compute.py --scales small medium --save-baseline before_change
+python benchmark_compute.py --scales small medium --compare before_change
+Parsing IOS Shell files is timed on real files, e.g. a station's ios_shell_data directory:
+python benchmark_compute.py --shell-dir E:\\charles\\mooring_data_page\\e01\\ios_shell_data
+"""
+
+# Years and sampling intervals in minutes of the synthetic data at each scale. The years end in 2020 so that
+# the climatology years of the stations are covered
+SCALES = {
+    'small': {'start_year': 2016, 'end_year': 2020},
+    'medium': {'start_year': 2001, 'end_year': 2020},
+    'large': {'start_year': 1981, 'end_year': 2020, 'cur_interval': 15, 'ctd_interval': 5}
+}
+
+# Directory in the repository that baselines are saved to, as {name}.json
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks', 'baselines')
+
+# Slowdown relative to the baseline above which a benchmark is reported as a regression
+DEFAULT_TOLERANCE = 1.25
+
+
+def time_function(func, make_args, repeat: int) -> dict:
+    """
+    Time a function, making its arguments before each call so that the setup is not timed and each call gets
+    its own copy of any data it changes
+    :param func: function to time
+    :param make_args: function without arguments returning the tuple of arguments of func
+    :param repeat: number of times to call func
+    :return: dict of the minimum and median time in seconds
+    """
+    times = []
+    for _ in range(repeat):
+        args = make_args()
+        start_time = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start_time)
+    return {'min_s': round(min(times), 4), 'median_s': round(statistics.median(times), 4)}
+
+
+def benchmark_conversion(station: str, scale: dict, repeat: int, output_dir: str) -> dict:
+    """
+    Time the conversion of parsed IOS shell files: replacing pad values and writing the station csv file,
+    and the parquet station data store if pyarrow is available. Parsing the files with ios_shell is timed
+    separately on real files by benchmark_shell_parsing(), because the synthetic data are not written as shell files
+    :param station: name of station
+    :param scale: keyword arguments for make_deployments() from the global variable SCALES
+    :param repeat: number of times to run each benchmark
+    :param output_dir: directory to write the converted files to
+    :return: dict of benchmark name: timings and rows
+    """
+    if conversion is None:
+        print('Skipping the conversion benchmarks, convert_cur_ctd_from_shell.py could not be imported')
+        return {}
+
+    deployments = make_deployments(station, **scale)
+    num_rows = sum(len(obs_df) for _, obs_df in deployments)
+
+    def convert(writer):
+        for filename, obs_df in deployments:
+            obs_df = conversion.replace_pad_values(obs_df.copy())
+            obs_df['Filename'] = filename
+            writer.write(filename, obs_df)
+        writer.close()
+
+    results = {'convert_csv': time_function(
+        convert, lambda: (conversion.AppendCsvWriter(os.path.join(output_dir, 'benchmark_data.csv')),), repeat
+    )}
+    if conversion.pq is not None:
+        results['convert_parquet'] = time_function(
+            convert, lambda: (conversion.ParquetStoreWriter(os.path.join(output_dir, 'benchmark_store')),), repeat
+        )
+    for result in results.values():
+        result['rows'] = num_rows
+    return results
+
+
+def benchmark_mhw_detection(df_daily_means: pd.DataFrame, station: str, repeat: int) -> dict:
+    """
+    Time the marine heatwave detection of the MHW analysis on daily mean data, as in mhw_analysis.run_mooring()
+    :param df_daily_means: daily means from read_daily_means()
+    :param station: name of station
+    :param repeat: number of times to run the benchmark
+    :return: dict of benchmark name: timings and rows
+    """
+    if mhw_analysis is None:
+        print('Skipping the MHW detection benchmark, mhw_analysis.py could not be imported')
+        return {}
+
+    df_daily_means = df_daily_means.copy()
+    df_daily_means['Ordinal_time'] = [x.toordinal() for x in df_daily_means['Datetime']]
+    result = time_function(mhw_analysis.detect_mooring_mhws,
+                           lambda: (df_daily_means, pmd.BIN_INFO[station]['bin_depths']), repeat)
+    result['rows'] = len(df_daily_means)
+    return {'detect_mhws': result}
+
+
+def benchmark_shell_parsing(shell_dir: str, repeat: int) -> dict:
+    """
+    Time parsing and cleaning IOS Shell files with convert_shell_file(). Real files are used because the
+    synthetic data are not written in IOS Shell format
+    :param shell_dir: directory containing IOS Shell files, e.g. a station's ios_shell_data directory
+    :param repeat: number of times to parse all the files
+    :return: dict of benchmark name: timings and rows
+    """
+    if conversion is None:
+        print('Skipping the IOS Shell parsing benchmark, convert_cur_ctd_from_shell.py could not be imported')
+        return {}
+
+    files = sorted(x for x in glob.glob(os.path.join(shell_dir, '*.*')) if x.lower().endswith(('.cur', '.ctd')))
+    if len(files) == 0:
+        print('No IOS Shell files found in', shell_dir)
+        return {}
+
+    def parse_files():
+        for f in files:
+            conversion.convert_shell_file(f)
+
+    result = time_function(parse_files, lambda: (), repeat)
+    result['rows'] = sum(len(obs_df) for obs_df, _ in map(conversion.convert_shell_file, files)
+                         if obs_df is not None)
+    return {'convert_shell_files': result}
+
+
+def benchmark_scale(station: str, scale: dict, repeat: int) -> dict:
+    """
+    Time the processing functions on synthetic data of a station at one scale. Each function is given the
+    output of the ones before it, as in run_plot()
+    :param station: name of station
+    :param scale: keyword arguments for make_deployments() from the global variable SCALES
+    :param repeat: number of times to run each benchmark
+    :return: dict of benchmark name: timings and rows
+    """
+    cur_data, ctd_data = make_station_data(station, **scale)
+    is_cur = np.concatenate((np.ones(len(cur_data), dtype=bool), np.zeros(len(ctd_data), dtype=bool)))
+    df_all = pd.concat((cur_data, ctd_data), ignore_index=True)
+    del cur_data, ctd_data
+
+    results = {}
+    with tempfile.TemporaryDirectory() as output_dir:
+        results['add_datetime'] = time_function(pmd.add_datetime, lambda: (df_all.copy(),), repeat)
+        df_all = pmd.add_datetime(df_all)
+        df_all['Depth_static'] = pmd.get_static_depths(df_all['Filename'],
+                                                       os.path.join(output_dir, 'file_catalog.sqlite'))
+
+        results['quality_control'] = time_function(pmd.quality_control, lambda: (df_all.copy(),), repeat)
+        df_all_qc = pmd.add_bin_index(pmd.quality_control(df_all), station)
+        df_qc = df_all_qc.loc[pmd.get_merge_mask(station, df_all_qc, is_cur), :].reset_index(drop=True)
+
+        results['compute_coverage_cube'] = time_function(
+            pmd.compute_coverage_cube, lambda: (df_all_qc, station), repeat
+        )
+        results['compute_daily_means'] = time_function(
+            pmd.compute_daily_means, lambda: (df_qc, output_dir, station), repeat
+        )
+        for name in ['add_datetime', 'quality_control', 'compute_coverage_cube']:
+            results[name]['rows'] = len(df_all_qc)
+        results['compute_daily_means']['rows'] = len(df_qc)
+
+        df_daily_means = pmd.read_daily_means(os.path.join(output_dir, f'{station.lower()}_daily_mean_TS_data.csv'))
+
+        def make_clim_args():
+            # Clear the climatology cache so that the products computed within each function, e.g. the daily
+            # climatology within compute_daily_anom(), are computed again too
+            pmd.CLIM_CACHE.clear()
+            return df_daily_means.copy(), station
+
+        for product in ['daily_clim', 'daily_anom', 'monthly_means', 'monthly_clim', 'monthly_anom']:
+            # Time the computation itself rather than the climatology cache
+            compute_func = getattr(pmd, f'compute_{product}').__wrapped__
+            results[f'compute_{product}'] = time_function(compute_func, make_clim_args, repeat)
+            results[f'compute_{product}']['rows'] = len(df_daily_means)
+
+        results.update(benchmark_mhw_detection(df_daily_means, station, repeat))
+
+        results.update(benchmark_conversion(station, scale, repeat, output_dir))
+    return results
+
+
+def run_benchmarks(station: str, scales: list, repeat: int, shell_dir: str = None) -> dict:
+    """
+    Run the benchmarks at each scale
+    :param station: name of station; must be in CLIM_YEARS for the climatology benchmarks
+    :param scales: names of scales from the global variable SCALES
+    :param repeat: number of times to run each benchmark
+    :param shell_dir: directory of IOS Shell files to time parsing on, reported as the shell_files scale;
+    not timed if None
+    :return: dict of the benchmark results by scale and benchmark name, and the machine they were run on
+    """
+    # quality_control() reads the QC range tables relative to the scripts directory
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    results = {}
+    for scale in scales:
+        print(f'Running the {scale} benchmarks ...')
+        results[scale] = benchmark_scale(station, SCALES[scale], repeat)
+        print_results(results[scale])
+    if shell_dir is not None:
+        print(f'Running the IOS Shell parsing benchmark on {shell_dir} ...')
+        results['shell_files'] = benchmark_shell_parsing(shell_dir, repeat)
+        print_results(results['shell_files'])
+    return {
+        'station': station,
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'machine': {'platform': platform.platform(), 'processor': platform.processor(),
+                    'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__},
+        'results': results
+    }
+
+
+def print_results(results: dict, baseline: dict = None, tolerance: float = DEFAULT_TOLERANCE) -> list:
+    """
+    Print a table of benchmark timings, compared to a baseline if given
+    :param results: dict of benchmark name: timings and rows for one scale
+    :param baseline: results of the baseline for the same scale
+    :param tolerance: slowdown relative to the baseline above which a benchmark is a regression
+    :return: names of the benchmarks that are regressions
+    """
+    regressions = []
+    print(f'{"Benchmark":<28}{"Rows":>12}{"Min (s)":>10}{"Median (s)":>12}' +
+          ('' if baseline is None else f'{"Baseline (s)":>14}{"Ratio":>8}'))
+    for name, result in results.items():
+        line = f'{name:<28}{result["rows"]:>12}{result["min_s"]:>10.4f}{result["median_s"]:>12.4f}'
+        if baseline is not None and name in baseline:
+            ratio = result['min_s'] / max(baseline[name]['min_s'], 1e-6)
+            line += f'{baseline[name]["min_s"]:>14.4f}{ratio:>8.2f}'
+            if ratio > tolerance:
+                line += '  SLOWER'
+                regressions.append(name)
+        print(line)
+    return regressions
+
+
+def save_baseline(benchmarks: dict, name: str) -> str:
+    """
+    Save benchmark results as a baseline
+    :param benchmarks: output of run_benchmarks()
+    :param name: name of the baseline
+    :return: full path of the baseline file
+    """
+    os.makedirs(BASELINE_DIR, exist_ok=True)
+    baseline_file = os.path.join(BASELINE_DIR, f'{name}.json')
+    with open(baseline_file, 'w') as f:
+        json.dump(benchmarks, f, indent=1)
+    return baseline_file
+
+
+def load_baseline(name: str) -> dict:
+    """
+    :param name: name of the baseline
+    :return: benchmark results saved by save_baseline()
+    """
+    with open(os.path.join(BASELINE_DIR, f'{name}.json'), 'r') as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the processing functions on synthetic station data.')
+    parser.add_argument('--station', default='E01', choices=list(pmd.CLIM_YEARS.keys()),
+                        help='station to make the synthetic data for (default: E01)')
+    parser.add_argument('--scales', nargs='+', default=['small', 'medium'], choices=list(SCALES.keys()),
+                        help='scales of synthetic data to run the benchmarks at (default: small medium)')
+    parser.add_argument('--shell-dir', help='directory of IOS Shell files to time parsing on')
+    parser.add_argument('--repeat', type=int, default=3, help='number of times to run each benchmark')
+    parser.add_argument('--save-baseline', metavar='NAME', help='save the results as a baseline with this name')
+    parser.add_argument('--compare', metavar='NAME', help='compare the results with the baseline with this name')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='slowdown relative to the baseline above which a benchmark is a regression')
+    args = parser.parse_args()
+
+    benchmarks = run_benchmarks(args.station, args.scales, args.repeat, args.shell_dir)
+
+    if args.save_baseline is not None:
+        print('Saved baseline to', save_baseline(benchmarks, args.save_baseline))
+
+    regressions = []
+    if args.compare is not None:
+        baseline = load_baseline(args.compare)
+        if baseline['station'] != args.station:
+            print(f'Warning: the baseline was run for {baseline["station"]}, not {args.station}')
+        for scale, results in benchmarks['results'].items():
+            if scale not in baseline['results']:
+                print(f'No {scale} results in baseline {args.compare}')
+                continue
+            print(f'\nThe {scale} benchmarks compared with baseline {args.compare} from {baseline["date"]}:')
+            regressions += [f'{scale} {name}' for name in
+                            print_results(results, baseline['results'][scale], args.tolerance)]
+
+    if len(regressions) > 0:
+        print('\nSlower than the baseline:', ', '.join(regressions))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -2,19 +2,487 @@ import ios_shell
 import glob
 import pandas as pd
 import numpy as np
-from tqdm import trange
+from tqdm import tqdm
 from gsw import z_from_p
 import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+import hashlib
+import json
+import shutil
+from wget_data_from_wp import get_download_list, start_downloads, print_download_summary
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    # pyarrow is only needed to write the parquet station data store
+    pa = pq = None
 
 """
 Convert IOS shell format files to csv files using ios_shell and pandas
 """
 
 
-def do_conversion(station: str):
+# Vars to keep
+# Can't convert Time:Code to Date and Time vars - calculate from start time and increment instead
+# No Oxygen in current meter files
+DF_VARS = ['Record_Number', 'Date', 'Time', 'Temperature', 'Salinity', 'Depth',
+           'Oxygen:Dissolved:SBE']
+
+# Name of the directory in csv_data/ holding the columnar station data store
+STORE_DIR_NAME = 'parquet_store'
+
+if pa is not None:
+    # Column types in the station data store
+    STORE_SCHEMA = pa.schema([
+        ('Record_Number', pa.float64()),
+        ('Date', pa.string()),
+        ('Time', pa.string()),
+        ('Temperature', pa.float64()),
+        ('Salinity', pa.float64()),
+        ('Depth', pa.float64()),
+        ('Oxygen:Dissolved:SBE', pa.float64()),
+        ('Filename', pa.dictionary(pa.int32(), pa.string())),
+        ('Datetime', pa.timestamp('ns')),
+    ])
+
+# Result of iter_conversions() for a file that is the same as when it was last converted
+UNCHANGED = 'unchanged'
+
+# Not-needed columns, such as current meter direction and speed
+VARS_TO_DROP = ['Direction: Geog(to)', 'Speed', 'Density', 'Speed:Sound',
+                'Speed:East', 'Speed:North', 'Speed:Up', 'Amplitude:Beam1',
+                'Amplitude:Beam2', 'Amplitude:Beam3', 'Heading', 'Pitch',
+                'Roll', 'Speed:Sound:1', 'Speed:Sound:2', 'Pressure:2',
+                'Speed:Current', 'Conductivity', 'Reference', 'Time:Code']
+
+
+def convert_shell_file(filename: str) -> tuple:
+    """
+    Parse one IOS shell file, clean it and replace pad values with nan.
+    Top-level function so that it can be run in a worker process.
+    :param filename: full path to the IOS shell file
+    :return: dataframe containing the cleaned observations or None if the file was skipped,
+    and a flag for whether depth is static (True), derived from pressure (False), or from a
+    depth sensor (None)
+    """
+    depth_is_static = None
+
+    # Read in IOS Shell format file
+    try:
+        parsed = ios_shell.ShellFile.fromfile(filename)
+    except ValueError:
+        print('Possible unknown time format: UTC, in file', filename,
+              '; skipping file for you to add later !!')
+        return None, depth_is_static
+
+    # Get current meter start time and increment from file header
+
+    # Convert the parsed file to pandas dataframe format
+    obs_df = ios_shell.ShellFile.to_pandas(parsed)
+
+    # Current meter data checks
+
+    # Only applies to current meter data
+    if 'Temperature:High_Res' in obs_df.columns and 'Temperature' not in obs_df.columns:
+        obs_df.rename(columns={'Temperature:High_Res': 'Temperature'}, inplace=True)
+
+    # Check if temperature or salinity are in current meter file
+    if not any([x in obs_df.columns for x in ['Temperature', 'Salinity']]):
+        print('Neither of temperature or salinity in file', filename)
+        return None, depth_is_static
+
+    # Check for time data; if none then calculate from start time and time increment
+    if not any([x in obs_df.columns for x in ['Date', 'Time']]):
+        # Create time data using ios_shell
+        obs_time = pd.DatetimeIndex(ios_shell.ShellFile.get_obs_time(parsed))
+        # Convert to string 'Date' and 'Time columns, formatting all times at once
+        obs_df['Date'] = obs_time.strftime('%Y-%m-%d')
+        obs_df['Time'] = obs_time.strftime('%H:%M:%S')
+
+    # Add static pressure data if no sensor
+    # e.g., E01_19790507_19791010_0089m_L2.CUR doesn't have pressure
+    if 'Depth' not in obs_df.columns:
+        if 'Pressure' not in obs_df.columns:
+            depth_static = parsed.instrument.depth
+            obs_df['Depth'] = np.repeat(depth_static, len(obs_df))
+            # Flag file as a static pressure file
+            depth_is_static = True
+        else:
+            # Calculate depth from time series pressure
+            # Get instrument depth, lat, lon
+            location = ios_shell.ShellFile.get_location(parsed)
+            lon, lat = location.values()
+            depth = -z_from_p(
+                p=obs_df.loc[:, 'Pressure'].to_numpy(),
+                lat=lat
+            )
+            obs_df['Depth'] = depth
+            # Flag file as a time series-depth-derived pressure file
+            depth_is_static = False
+
+    # Remove not-needed columns, such as current meter direction and speed
+    # Ignore error messages if any vars are not present in a file
+    obs_df.drop(columns=VARS_TO_DROP, inplace=True, errors='ignore')
+
+    # Reorder the columns to be the same order for every file
+    # Add nan variables if some required ones are missing
+    # No Oxygen in CUR files
+    for var in DF_VARS:
+        if var not in obs_df.columns:
+            obs_df[var] = np.repeat(np.nan, len(obs_df))
+    # Reorder the columns
+    obs_df = obs_df[DF_VARS]
+    # Use floats for the measurements in every file, so that rows appended to the
+    # station file one file at a time are formatted the same way
+    obs_df = obs_df.astype({var: 'float64' for var in ['Temperature', 'Salinity', 'Depth',
+                                                       'Oxygen:Dissolved:SBE']})
+
+    # Replace misc pad values with pandas nan
+    obs_df = replace_pad_values(obs_df)
+
+    # Add file name as a column to the dataframe
+    obs_df['Filename'] = np.repeat(filename, len(obs_df))
+
+    return obs_df, depth_is_static
+
+
+def replace_pad_values(obs_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Replace misc pad values with pandas nan
+    :param obs_df: dataframe of observations with the DF_VARS columns in float format
+    :return: the dataframe obs_df with pad values replaced
+    """
+    sal_pads = [2.233, -99]
+    temp_pads = [32.767, -99]
+    oxy_pads = [-99]
+    temp_mask = (
+        (obs_df['Temperature'].values == temp_pads[0]) |
+        (obs_df['Temperature'].values <= temp_pads[1])
+    )
+    sal_mask = (
+        (obs_df['Salinity'].values == sal_pads[0]) |
+        (obs_df['Salinity'].values <= sal_pads[1])
+    )
+    oxy_mask = (
+            obs_df['Oxygen:Dissolved:SBE'].values <= oxy_pads[0]
+    )
+    obs_df.loc[temp_mask, 'Temperature'] = pd.NA
+    obs_df.loc[sal_mask, 'Salinity'] = pd.NA
+    obs_df.loc[oxy_mask, 'Oxygen:Dissolved:SBE'] = pd.NA
+    return obs_df
+
+
+class AppendCsvWriter:
+    """
+    Append-only csv writer so that the station csv file can be built one file at a time.
+    Rows are written to a temporary file that replaces output_file on close(), so an
+    interrupted conversion does not leave a truncated station file behind.
+    """
+
+    def __init__(self, output_file: str, reuse_previous: bool = False):
+        """
+        :param output_file: full path to the station csv file
+        :param reuse_previous: copy rows of unchanged files from the existing output_file
+        """
+        self.output_file = output_file
+        self.tmp_file = output_file + '.tmp'
+        self.num_rows = 0
+        self.old_rows = CsvRowReader(output_file) if reuse_previous else None
+        # Start from a file containing only the column names
+        pd.DataFrame(columns=DF_VARS + ['Filename']).to_csv(self.tmp_file, index=False)
+
+    @staticmethod
+    def output_exists(output_file: str) -> bool:
+        return os.path.exists(output_file)
+
+    def write(self, filename: str, obs_df: pd.DataFrame):
+        """
+        Append the rows of one file
+        :param filename: full path to the source file
+        :param obs_df: dataframe of cleaned observations from the file
+        :return:
+        """
+        obs_df.to_csv(self.tmp_file, mode='a', header=False, index=False)
+        self.num_rows += len(obs_df)
+
+    def remove(self, filename: str):
+        """
+        Rows of changed files are never copied from the previous station file, so there is
+        nothing to remove
+        :param filename: full path to the source file
+        :return:
+        """
+        return
+
+    def keep(self, filename: str, entry: dict):
+        """
+        Copy the rows of an unchanged file from the previous station file
+        :param filename: full path to the source file
+        :param entry: manifest entry of the file from the previous conversion
+        :return:
+        """
+        lines = self.old_rows.read_rows(entry['first_row'], entry['num_rows'])
+        with open(self.tmp_file, 'a', newline='') as f:
+            f.writelines(lines)
+        self.num_rows += len(lines)
+
+    def close(self, deleted_files: list = None):
+        """
+        Move the finished file into place. Rows of deleted files were never copied over,
+        so nothing needs to be done for them.
+        :param deleted_files: source files that were converted previously but no longer exist
+        :return:
+        """
+        if self.old_rows is not None:
+            self.old_rows.close()
+        os.replace(self.tmp_file, self.output_file)
+        return
+
+
+class ParquetStoreWriter:
+    """
+    Writer for the columnar station data store, which is partitioned by station,
+    instrument and year as store_dir/station={station}/instrument={inst}/year={year}/.
+    Each source file is written to one parquet part per year named after the source file,
+    so the parts of a changed or deleted file can be replaced or removed on their own.
+    """
+
+    def __init__(self, output_dir: str, reuse_previous: bool = False):
+        """
+        :param output_dir: full path to the instrument partition of the store
+        :param reuse_previous: keep the parts of unchanged files. If False, the instrument
+        partition is cleared first
+        """
+        if pq is None:
+            raise ImportError('pyarrow is required to write the parquet station data store')
+        self.output_dir = output_dir
+        self.num_rows = 0
+        if not reuse_previous and os.path.exists(output_dir):
+            shutil.rmtree(output_dir)
+        os.makedirs(output_dir, exist_ok=True)
+
+    @staticmethod
+    def output_exists(output_dir: str) -> bool:
+        return os.path.isdir(output_dir)
+
+    def remove(self, filename: str):
+        """
+        Remove all parts written from a source file
+        :param filename: full path to the source file
+        :return:
+        """
+        for part in glob.glob(os.path.join(self.output_dir, 'year=*',
+                                           os.path.basename(filename) + '.parquet')):
+            os.remove(part)
+        return
+
+    def write(self, filename: str, obs_df: pd.DataFrame):
+        """
+        Write the rows of one file, split by year
+        :param filename: full path to the source file
+        :param obs_df: dataframe of cleaned observations from the file
+        :return:
+        """
+        self.remove(filename)
+        # Store typed observation times so that they don't need to be parsed when reading
+        # Dates may be in YYYY/mm/dd or YYYY-mm-dd format
+        obs_df = obs_df.assign(Datetime=pd.to_datetime(
+            obs_df['Date'].str.replace('/', '-', regex=False) + ' ' + obs_df['Time'], format='ISO8601'
+        ))
+        years = obs_df['Datetime'].dt.year.to_numpy()
+        for year in np.unique(years):
+            year_dir = os.path.join(self.output_dir, f'year={year}')
+            os.makedirs(year_dir, exist_ok=True)
+            table = pa.Table.from_pandas(obs_df.loc[years == year, :], schema=STORE_SCHEMA,
+                                         preserve_index=False)
+            pq.write_table(table, os.path.join(year_dir, os.path.basename(filename) + '.parquet'))
+        self.num_rows += len(obs_df)
+
+    def keep(self, filename: str, entry: dict):
+        """
+        Parts of unchanged files stay where they are
+        :param filename: full path to the source file
+        :param entry: manifest entry of the file from the previous conversion
+        :return:
+        """
+        self.num_rows += entry['num_rows']
+
+    def close(self, deleted_files: list = None):
+        """
+        Remove the parts of source files that no longer exist
+        :param deleted_files: source files that were converted previously but no longer exist
+        :return:
+        """
+        for filename in deleted_files or []:
+            self.remove(filename)
+        # Remove any year partitions left empty
+        for year_dir in glob.glob(os.path.join(self.output_dir, 'year=*')):
+            if len(os.listdir(year_dir)) == 0:
+                os.rmdir(year_dir)
+        return
+
+
+class CsvRowReader:
     """
-    Convert CUR and CTD ios shell files to csv format and merge them
+    Read the data rows of an existing station csv file by row number, in increasing order
+    """
+
+    def __init__(self, csv_file: str):
+        # Keep line endings as they are so copied rows match the rest of the file
+        self.file = open(csv_file, 'r', newline='')
+        # Skip the column names
+        self.file.readline()
+        self.next_row = 0
+
+    def read_rows(self, first_row: int, num_rows: int) -> list:
+        """
+        Read num_rows rows starting at first_row, skipping any rows before first_row
+        :param first_row: number of the first data row to read, starting at zero
+        :param num_rows: number of rows to read
+        :return: list of csv lines
+        """
+        # Skip over rows belonging to deleted or changed files
+        for _ in range(first_row - self.next_row):
+            self.file.readline()
+        lines = [self.file.readline() for _ in range(num_rows)]
+        self.next_row = first_row + num_rows
+        return lines
+
+    def close(self):
+        self.file.close()
+        return
+
+
+def iter_conversions(files: list, old_entries: dict, executor: ProcessPoolExecutor = None,
+                     max_pending: int = 1, downloads: dict = None):
+    """
+    Parse the new or changed files among files, yielding the results in the same order as files so that the
+    merge is deterministic. Files that are still being downloaded are checked and parsed as soon as their
+    download finishes, so that parsing overlaps downloading. At most max_pending files are parsed ahead of
+    the file that is yielded next, so that finished results wait in memory only for a bounded number of files
+    :param files: sorted full paths of the source files
+    :param old_entries: manifest entries of the files from the previous conversion, by file name
+    :param executor: pool of worker processes to parse files with; files are parsed in this process if None
+    :param max_pending: maximum number of files submitted to the executor and not yet yielded
+    :param downloads: futures of the downloads of any files that are being downloaded, by file name,
+    from wget_data_from_wp.start_downloads()
+    :return: generator of (file name, result) where result is the (dataframe, depth_is_static) returned by
+    convert_shell_file(), UNCHANGED if the file is the same as in old_entries, or None if its download failed
+    """
+    downloads = {} if downloads is None else downloads
+    # Result or future of the result of each file that has been checked, and not yet yielded
+    checked = {}
+    not_checked = list(files)
+
+    def is_ready(filename: str) -> bool:
+        return filename not in downloads or downloads[filename].done()
+
+    def check(filename: str):
+        not_checked.remove(filename)
+        if not os.path.exists(filename):
+            # The download failed
+            checked[filename] = None
+        elif is_unchanged(filename, old_entries.get(filename)):
+            checked[filename] = UNCHANGED
+        elif executor is not None:
+            checked[filename] = executor.submit(convert_shell_file, filename)
+        else:
+            # Parsed when it is yielded
+            checked[filename] = filename
+
+    for filename in files:
+        while filename not in checked:
+            num_pending = sum(isinstance(x, Future) for x in checked.values())
+            for x in [x for x in not_checked if is_ready(x)]:
+                # Always leave room for the file that is yielded next
+                if num_pending < max_pending or x == filename:
+                    check(x)
+                    num_pending += isinstance(checked[x], Future)
+            if filename not in checked:
+                wait([downloads[x] for x in not_checked if not is_ready(x)], return_when=FIRST_COMPLETED)
+
+        result = checked.pop(filename)
+        if isinstance(result, Future):
+            result = result.result()
+        elif result == filename:
+            result = convert_shell_file(filename)
+        yield filename, result
+
+
+def hash_file(filename: str) -> str:
+    """
+    Compute the sha256 hash of the contents of a file
+    :param filename: full path to the file
+    :return: hex digest
+    """
+    file_hash = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def is_unchanged(filename: str, entry: dict) -> bool:
+    """
+    Check whether a source file is the same as when it was recorded in the conversion manifest.
+    The contents are only hashed if the size matches but the modification time does not.
+    :param filename: full path to the source file
+    :param entry: manifest entry for the file, or None if the file is new
+    :return: True if the file has not changed
+    """
+    if entry is None:
+        return False
+    stat = os.stat(filename)
+    if stat.st_size != entry['size']:
+        return False
+    if stat.st_mtime == entry['mtime']:
+        return True
+    return hash_file(filename) == entry['sha256']
+
+
+def load_manifest(manifest_file: str) -> dict:
+    """
+    Load the conversion manifest, which records the size, modification time, content hash and
+    output row range of each converted source file, keyed by instrument and then by file name
+    :param manifest_file: full path to the manifest json file
+    :return: manifest dictionary, empty if there is no manifest yet
+    """
+    if not os.path.exists(manifest_file):
+        return {}
+    with open(manifest_file, 'r') as f:
+        return json.load(f)
+
+
+def save_manifest(manifest: dict, manifest_file: str):
+    """
+    Save the conversion manifest, replacing any previous one only once it is fully written
+    :param manifest: manifest dictionary
+    :param manifest_file: full path to the manifest json file
+    :return:
+    """
+    with open(manifest_file + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(manifest_file + '.tmp', manifest_file)
+    return
+
+
+def do_conversion(station: str, num_workers: int = 1, incremental: bool = True,
+                  output_format: str = 'csv', downloads: dict = None):
+    """
+    Convert CUR and CTD ios shell files to csv format and merge them.
+    A conversion manifest is kept next to the csv files so that later runs only parse new or
+    changed files; rows of unchanged files are copied from the previous csv files and rows of
+    deleted files are dropped.
     :param station:
+    :param num_workers: number of worker processes to parse files with; files are
+    parsed one after another in this process if num_workers is 1
+    :param incremental: reuse rows of unchanged files from the previous conversion. If False,
+    all files are parsed again
+    :param output_format: "csv" to write {station}_{inst}_data.csv files, or "parquet" to write
+    the typed columnar station data store in csv_data/parquet_store/ (requires pyarrow)
+    :param downloads: futures of files that are still being downloaded, by full path, from
+    wget_data_from_wp.start_downloads(). They are converted as they land, see download_and_convert()
     :return:
     """
     station = station.lower()
@@ -29,149 +497,119 @@ def do_conversion(station: str):
     # location = ios_shell.ShellFile.get_location(par)
     # lon, lat = location.values()
 
-    # Vars to keep
-    # Can't convert Time:Code to Date and Time vars - calculate from start time and increment instead
-    # No Oxygen in current meter files
-    df_vars = ['Record_Number', 'Date', 'Time', 'Temperature', 'Salinity', 'Depth',
-               'Oxygen:Dissolved:SBE']
-
-    # unique_vars = []
+    manifest_file = output_dir + f'{station}_conversion_manifest.json'
+    manifest = load_manifest(manifest_file) if incremental else {}
+    if manifest.get('output_format', 'csv') != output_format:
+        # Previous conversion was written to the other format
+        manifest = {}
+    new_manifest = {'output_format': output_format}
 
     derived_depth_files = pd.DataFrame(columns=['Filename', 'Depth_is_static'], dtype='object')
 
-    # old_dir = os.getcwd()
-    # new_dir = os.path.dirname(old_dir)
-    # os.chdir(new_dir)
-
     # Get both current meter and CTD data
     # Iterate through instruments
     for inst in ['cur', 'ctd']:
         # Don't add files in /definitely_wrong folder
         inst_file_list = glob.glob(data_dir + f'*.{inst}', recursive=False)
+        if downloads is not None:
+            # Add the files that haven't landed yet
+            inst_file_list = list(set(inst_file_list) | {
+                f for f in downloads if f.lower().endswith(f'.{inst}')
+            })
         inst_file_list.sort()
 
-        # Initialize a dataframe to contain all instrument data
-        inst_df = pd.DataFrame()
-
-        for i in trange(len(inst_file_list)):
-            # Read in IOS Shell format file
-            try:
-                parsed = ios_shell.ShellFile.fromfile(inst_file_list[i])
-            except ValueError:
-                print('Possible unknown time format: UTC, in file', inst_file_list[i],
-                      '; skipping file for you to add later !!')
-                continue
-
-            # Get current meter start time and increment from file header
+        if output_format == 'parquet':
+            writer_class = ParquetStoreWriter
+            output_file = os.path.join(output_dir, STORE_DIR_NAME, f'station={station}',
+                                       f'instrument={inst}')
+        else:
+            writer_class = AppendCsvWriter
+            output_file = output_dir + f'{station}_{inst}_data.csv'
 
-            # Convert the parsed file to pandas dataframe format
-            obs_df = ios_shell.ShellFile.to_pandas(parsed)
+        # Previous rows can only be reused if the previous output is still there
+        old_entries = manifest.get(inst, {}) if writer_class.output_exists(output_file) else {}
+        inst_entries = {}
 
-            # Current meter data checks
+        # Stream each cleaned file to the output file instead of accumulating
+        # all instrument data in one dataframe
+        writer = writer_class(output_file, reuse_previous=len(old_entries) > 0)
 
-            # Only applies to current meter data
-            if 'Temperature:High_Res' in obs_df.columns and 'Temperature' not in obs_df.columns:
-                obs_df.rename(columns={'Temperature:High_Res': 'Temperature'}, inplace=True)
+        executor = ProcessPoolExecutor(max_workers=num_workers) if num_workers > 1 else None
+        # Results are yielded in the order of the sorted file list regardless of
+        # which worker finishes first, so the merge is deterministic
+        results = iter_conversions(inst_file_list, old_entries, executor, 2 * num_workers, downloads)
+        num_converted = 0
 
-            # Check if temperature or salinity are in current meter file
-            if not any([x in obs_df.columns for x in ['Temperature', 'Salinity']]):
-                print('Neither of temperature or salinity in file', inst_file_list[i])
+        for filename, result in tqdm(results, total=len(inst_file_list)):
+            if result is None:
+                # Rows of a previous version of the file are dropped as for deleted files
+                print('Skipping', filename, 'which could not be downloaded')
                 continue
-
-            # Check for time data; if none then calculate from start time and time increment
-            if not any([x in obs_df.columns for x in ['Date', 'Time']]):
-                # Create time data using ios_shell
-                obs_time = ios_shell.ShellFile.get_obs_time(parsed)
-                # Convert to string 'Date' and 'Time columns
-                obs_df['Date'] = [dt.strftime('%Y-%m-%d') for dt in obs_time]
-                obs_df['Time'] = [dt.strftime('%H:%M:%S') for dt in obs_time]
-
-            # Add static pressure data if no sensor
-            # e.g., E01_19790507_19791010_0089m_L2.CUR doesn't have pressure
-            if 'Depth' not in obs_df.columns:
-                if 'Pressure' not in obs_df.columns:
-                    depth_static = parsed.instrument.depth
-                    obs_df['Depth'] = np.repeat(depth_static, len(obs_df))
-                    # Add file to list for static pressure files
-                    derived_depth_files.loc[len(derived_depth_files)] = [
-                        inst_file_list[i], True
-                    ]
+            elif result != UNCHANGED:
+                obs_df, depth_is_static = result
+                num_converted += 1
+                stat = os.stat(filename)
+                entry = {'size': stat.st_size,
+                         'mtime': stat.st_mtime,
+                         'sha256': hash_file(filename),
+                         'first_row': writer.num_rows,
+                         'num_rows': 0 if obs_df is None else len(obs_df),
+                         'depth_is_static': depth_is_static}
+                # Files that could not be used are recorded too so that they are not
+                # parsed again until they change
+                if obs_df is not None:
+                    writer.write(filename, obs_df)
                 else:
-                    # Calculate depth from time series pressure
-                    # Get instrument depth, lat, lon
-                    location = ios_shell.ShellFile.get_location(parsed)
-                    lon, lat = location.values()
-                    depth = -z_from_p(
-                        p=obs_df.loc[:, 'Pressure'].to_numpy(),
-                        lat=lat
-                    )
-                    obs_df['Depth'] = depth
-                    # Add file to list for time series-depth-derived pressure files
-                    derived_depth_files.loc[len(derived_depth_files)] = [
-                        inst_file_list[i], False
-                    ]
-
-            # # Add to list of unique vars
-            # for col in t.columns:
-            #     if col not in unique_vars:
-            #         unique_vars.append(col)
-
-            # if 'Time:Code' in t.columns:
-            #     print(inst_file_list[i])
-            #     print(t.loc[:5, 'Time:Code'])
-
-            # Remove not-needed columns, such as current meter direction and speed
-            vars_to_drop = ['Direction: Geog(to)', 'Speed', 'Density', 'Speed:Sound',
-                            'Speed:East', 'Speed:North', 'Speed:Up', 'Amplitude:Beam1',
-                            'Amplitude:Beam2', 'Amplitude:Beam3', 'Heading', 'Pitch',
-                            'Roll', 'Speed:Sound:1', 'Speed:Sound:2', 'Pressure:2',
-                            'Speed:Current', 'Conductivity', 'Reference', 'Time:Code']
-            # Ignore error messages if any vars are not present in a file
-            obs_df.drop(columns=vars_to_drop, inplace=True, errors='ignore')
-
-            # Reorder the columns to be the same order for every file
-            # Add nan variables if some required ones are missing
-            # No Oxygen in CUR files
-            for var in df_vars:
-                if var not in obs_df.columns:
-                    obs_df[var] = np.repeat(np.nan, len(obs_df))
-            # Reorder the columns
-            obs_df = obs_df[df_vars]
-
-            # Replace misc pad values with pandas nan
-            sal_pads = [2.233, -99]
-            temp_pads = [32.767, -99]
-            oxy_pads = [-99]
-            temp_mask = (
-                (obs_df['Temperature'].values == temp_pads[0]) |
-                (obs_df['Temperature'].values <= temp_pads[1])
-            )
-            sal_mask = (
-                (obs_df['Salinity'].values == sal_pads[0]) |
-                (obs_df['Salinity'].values <= sal_pads[1])
-            )
-            oxy_mask = (
-                    obs_df['Oxygen:Dissolved:SBE'].values <= oxy_pads[0]
-            )
-            obs_df.loc[temp_mask, 'Temperature'] = pd.NA
-            obs_df.loc[sal_mask, 'Salinity'] = pd.NA
-            obs_df.loc[oxy_mask, 'Oxygen:Dissolved:SBE'] = pd.NA
+                    writer.remove(filename)
+            else:
+                # Splice in the rows from the previous conversion
+                entry = dict(old_entries[filename])
+                entry['mtime'] = os.stat(filename).st_mtime
+                writer.keep(filename, entry)
+                entry['first_row'] = writer.num_rows - entry['num_rows']
 
-            # Add file name as a column to the dataframe
-            obs_df['Filename'] = np.repeat(inst_file_list[i], len(obs_df))
+            inst_entries[filename] = entry
 
-            # obs_df.to_csv(output_dir + os.path.basename(inst_file_list[i]) + '.csv', index=False)
+            # Add file to list for static or time series-derived pressure files
+            if entry['depth_is_static'] is not None:
+                derived_depth_files.loc[len(derived_depth_files)] = [
+                    filename, entry['depth_is_static']
+                ]
 
-            # Append the data to one big dataframe?
-            inst_df = pd.concat((inst_df, obs_df), ignore_index=True)
+        if executor is not None:
+            executor.shutdown()
 
-        # Save dataframe to csv file
-        inst_df.to_csv(output_dir + f'{station}_{inst}_data.csv', index=False)
-        print(f'{station}_{inst}_data.csv')
+        writer.close(deleted_files=[f for f in old_entries if f not in inst_entries])
+        print(f'Converted {num_converted} new or changed {inst} files out of {len(inst_file_list)} to', output_file)
+
+        new_manifest[inst] = inst_entries
 
     # save list of static pressure files to csv
     derived_depth_files.to_csv(output_dir + f'{station}_cur_ctd_derived_depth.csv', index=False)
+
+    # Save the manifest last so it only ever describes finished csv files
+    save_manifest(new_manifest, manifest_file)
     return
 
 
+def download_and_convert(station: str, num_download_workers: int = 8, num_workers: int = 1,
+                         incremental: bool = True, output_format: str = 'csv'):
+    """
+    Refresh a station: download the files in its Water Properties download list and convert them in one
+    pipeline, parsing each file as soon as it lands instead of after all the downloads, so that a refresh takes
+    about as long as the slower of downloading and parsing rather than both
+    :param station: name of station
+    :param num_download_workers: maximum number of files to download at once
+    :param num_workers: number of worker processes to parse files with, see do_conversion()
+    :param incremental: reuse the conversion of unchanged files, see do_conversion()
+    :param output_format: "csv" or "parquet", see do_conversion()
+    :return: list of (full path of file, error message) of the files that could not be downloaded
+    """
+    urls, download_dir = get_download_list(station)
+    with ThreadPoolExecutor(max_workers=num_download_workers) as download_executor:
+        downloads = start_downloads(urls, download_dir, download_executor)
+        do_conversion(station, num_workers, incremental, output_format, downloads)
+    return print_download_summary(downloads)
+
+
 # os.chdir(old_dir)
@@ -3,6 +3,7 @@ import xarray as xr
 import numpy as np
 from gsw import z_from_p
 import os
+from convert_cur_ctd_from_shell import ParquetStoreWriter, STORE_DIR_NAME
 
 """
 One CUR file could not be parsed by ios_shell python package, so we must use its netCDF data
@@ -39,4 +40,11 @@ df_cur = pd.read_csv(cur_file)
 df_cur = pd.concat((df_cur, dfout))
 df_cur.to_csv('.\\data\\e01_cur_data_all.csv', index=False)
 
+# Add to the columnar station data store too if the CUR data were converted to it
+store_cur_dir = f'.\\data\\{STORE_DIR_NAME}\\station=e01\\instrument=cur'
+if ParquetStoreWriter.output_exists(store_cur_dir):
+    writer = ParquetStoreWriter(store_cur_dir, reuse_previous=True)
+    writer.write(ncfile, dfout)
+    writer.close()
+
 os.chdir(old_dir)
@@ -1,5 +1,6 @@
 import os
 import pandas as pd
+from file_catalog import get_file_entries
 
 # Script to count the available current meter and moored CTD netCDF files
 # from Water Properties
@@ -7,22 +8,24 @@ import pandas as pd
 
 shell_list_file = 'E:\\charles\\e01_data_page\\wget_file_download_list.csv'
 nc_list_file = 'E:\\charles\\e01_data_page\\wget_netcdf_file_download_list.csv'
+# Catalog of the file names, see file_catalog.py
+catalog_file = 'E:\\charles\\e01_data_page\\file_catalog.sqlite'
 
 # Add name for column
 shell_df = pd.read_csv(shell_list_file, header=None, names=['File'])
 nc_df = pd.read_csv(nc_list_file, header=None, names=['File'])
 
-# Add columns to each df containing the basename without file suffix
+# Add columns to each df containing the basename without file suffix, from the file catalog
+# or from the name itself if the catalog can't parse it
 extract_basename = lambda x: os.path.basename(x).split('.')[0]
 
-shell_df['basename'] = list(map(extract_basename, shell_df['File']))
-nc_df['basename'] = list(map(extract_basename, nc_df['File']))
+shell_df['basename'] = get_file_entries(shell_df['File'], catalog_file)['stem'].fillna(
+    shell_df['File'].map(extract_basename)).values
+nc_df['basename'] = get_file_entries(nc_df['File'], catalog_file)['stem'].fillna(
+    nc_df['File'].map(extract_basename)).values
 
-# Initialize a list to hold ios shell file names without corresponding nc file
-missing_nc = []
-for i in range(len(shell_df)):
-    if shell_df.loc[i, 'basename'] not in nc_df.loc[:, 'basename'].tolist():
-        missing_nc.append(shell_df.loc[i, 'File'])
+# List the ios shell files without corresponding nc file
+missing_nc = shell_df.loc[~shell_df['basename'].isin(nc_df['basename']), 'File'].tolist()
 
 print(len(shell_df))
 print(len(nc_df))
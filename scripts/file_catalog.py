@@ -0,0 +1,221 @@
+import os
+import glob
+import datetime
+import sqlite3
+import argparse
+import numpy as np
+import pandas as pd
+
+"""
+Catalog of the deployment files of all stations, parsed once from their file names and kept in a SQLite
+database so that the station, dates, depth and instrument of a file can be looked up and queried, e.g.
+all CTD files at E01 between 70 and 80 m:
+query_files(station='E01', instrument='CTD', min_depth=70, max_depth=80)
+File names have the format STN_YYYYMMDD_YYYYMMDD_DEPTHm[_LEVEL].suffix, e.g. E01_19800507_19800913_0015m_L2.CUR,
+with netCDF versions named like the IOS Shell files plus .nc
+"""
+
+# Name of the catalog database, which is kept in the directory containing the station directories
+CATALOG_NAME = 'file_catalog.sqlite'
+
+# Default location of the catalog database
+CATALOG_FILE = 'E:\\charles\\mooring_data_page\\' + CATALOG_NAME
+
+# Columns of the catalog, in order
+CATALOG_COLUMNS = ['path', 'name', 'stem', 'station', 'start_date', 'end_date', 'depth', 'instrument', 'level',
+                   'format']
+
+# Number of paths to look up per SQL query, below SQLite's limit on query parameters
+QUERY_CHUNK_SIZE = 500
+
+
+def parse_deployment_filename(path: str):
+    """
+    Parse the name of a deployment file
+    :param path: full path, url, or name of the file
+    :return: dict of the CATALOG_COLUMNS, or None if the name doesn't have the format of a deployment file.
+    Station and instrument are upper case, dates are YYYY-mm-dd, depth is the nominal depth in m, level
+    is e.g. L2 or None if not in the name, and format is shell, netcdf, or the file suffix
+    """
+    name = os.path.basename(path.replace('\\', '/'))
+    stem, *suffixes = name.split('.')
+    parts = stem.split('_')
+    if len(parts) < 4 or len(suffixes) == 0:
+        return None
+    try:
+        start_date, end_date = [datetime.datetime.strptime(x, '%Y%m%d').strftime('%Y-%m-%d') for x in parts[1:3]]
+        depth = int(parts[3].lower().rstrip('m'))
+    except ValueError:
+        return None
+
+    if suffixes[-1].lower() == 'nc':
+        file_format = 'netcdf'
+    elif suffixes[0].lower() in ['cur', 'ctd']:
+        file_format = 'shell'
+    else:
+        file_format = suffixes[-1].lower()
+
+    return {
+        'path': path,
+        'name': name,
+        'stem': stem,
+        'station': parts[0].upper(),
+        'start_date': start_date,
+        'end_date': end_date,
+        'depth': depth,
+        'instrument': suffixes[0].upper(),
+        'level': parts[4].upper() if len(parts) > 4 else None,
+        'format': file_format
+    }
+
+
+def get_catalog_file(station_dir: str) -> str:
+    """
+    Get the catalog database of the stations in the directory containing station_dir
+    :param station_dir: a directory in a station's directory, e.g. its csv_data or ios_shell_data directory
+    :return: full path to the catalog database
+    """
+    return os.path.join(os.path.dirname(os.path.dirname(os.path.normpath(station_dir))), CATALOG_NAME)
+
+
+def connect_catalog(catalog_file: str = None) -> sqlite3.Connection:
+    """
+    Open the catalog database, creating it if it doesn't exist yet
+    :param catalog_file: full path to the catalog database; defaults to CATALOG_FILE
+    :return: connection to the database
+    """
+    connection = sqlite3.connect(CATALOG_FILE if catalog_file is None else catalog_file)
+    connection.execute(
+        'CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, name TEXT, stem TEXT, station TEXT, '
+        'start_date TEXT, end_date TEXT, depth INTEGER, instrument TEXT, level TEXT, format TEXT)'
+    )
+    connection.execute('CREATE INDEX IF NOT EXISTS files_by_station ON files (station, instrument, depth)')
+    connection.execute('CREATE INDEX IF NOT EXISTS files_by_stem ON files (stem)')
+    return connection
+
+
+def add_files(paths: list, catalog_file: str = None) -> int:
+    """
+    Add files to the catalog, replacing any entries they already have. Files whose names don't have the format
+    of a deployment file are left out
+    :param paths: full paths, urls, or names of the files
+    :param catalog_file: full path to the catalog database; defaults to CATALOG_FILE
+    :return: number of files added
+    """
+    entries = [entry for entry in map(parse_deployment_filename, paths) if entry is not None]
+    with connect_catalog(catalog_file) as connection:
+        connection.executemany(
+            f'INSERT OR REPLACE INTO files VALUES ({", ".join("?" * len(CATALOG_COLUMNS))})',
+            [tuple(entry[column] for column in CATALOG_COLUMNS) for entry in entries]
+        )
+    connection.close()
+    return len(entries)
+
+
+def get_file_entries(paths, catalog_file: str = None) -> pd.DataFrame:
+    """
+    Look up files in the catalog, adding any that aren't in it yet
+    :param paths: full paths, urls, or names of the files, e.g. the Filename column of the observations
+    :param catalog_file: full path to the catalog database; defaults to CATALOG_FILE
+    :return: dataframe of the CATALOG_COLUMNS with one row per path in the same order as paths, with nan for
+    files whose names don't have the format of a deployment file
+    """
+    unique_paths = list(pd.unique(np.asarray(paths, dtype=object)))
+    connection = connect_catalog(catalog_file)
+    df_found = pd.concat(
+        [pd.read_sql_query(f'SELECT * FROM files WHERE path IN ({", ".join("?" * len(chunk))})',
+                           connection, params=chunk)
+         for chunk in [unique_paths[i:i + QUERY_CHUNK_SIZE] for i in range(0, len(unique_paths), QUERY_CHUNK_SIZE)]]
+        + [pd.DataFrame(columns=CATALOG_COLUMNS)]
+    )
+    connection.close()
+
+    new_paths = sorted(set(unique_paths) - set(df_found['path']))
+    if len(new_paths) > 0:
+        add_files(new_paths, catalog_file)
+        df_new = pd.DataFrame([entry for entry in map(parse_deployment_filename, new_paths) if entry is not None],
+                              columns=CATALOG_COLUMNS)
+        df_found = pd.concat((df_found, df_new))
+
+    df_entries = df_found.set_index('path').reindex(paths)
+    df_entries.reset_index(inplace=True)
+    return df_entries
+
+
+def query_files(station: str = None, instrument: str = None, min_depth: float = None, max_depth: float = None,
+                start_date: str = None, end_date: str = None, file_format: str = None,
+                catalog_file: str = None) -> pd.DataFrame:
+    """
+    Find the files in the catalog that match all of the given conditions
+    :param station: name of station, e.g. E01
+    :param instrument: instrument type, e.g. CTD or CUR
+    :param min_depth: minimum nominal depth in m
+    :param max_depth: maximum nominal depth in m
+    :param start_date: only files ending on or after this date, in YYYY-mm-dd format
+    :param end_date: only files starting on or before this date, in YYYY-mm-dd format
+    :param file_format: shell or netcdf
+    :param catalog_file: full path to the catalog database; defaults to CATALOG_FILE
+    :return: dataframe of the CATALOG_COLUMNS of the matching files, sorted by path
+    """
+    conditions = {
+        'station = ?': None if station is None else station.upper(),
+        'instrument = ?': None if instrument is None else instrument.upper(),
+        'depth >= ?': min_depth,
+        'depth <= ?': max_depth,
+        'end_date >= ?': start_date,
+        'start_date <= ?': end_date,
+        'format = ?': file_format
+    }
+    conditions = {condition: value for condition, value in conditions.items() if value is not None}
+    where = '' if len(conditions) == 0 else ' WHERE ' + ' AND '.join(conditions)
+
+    connection = connect_catalog(catalog_file)
+    df_files = pd.read_sql_query(f'SELECT * FROM files{where} ORDER BY path', connection,
+                                 params=list(conditions.values()))
+    connection.close()
+    return df_files
+
+
+def build_catalog(data_root: str, catalog_file: str = None) -> int:
+    """
+    Add all the files of all stations to the catalog: the IOS Shell and netCDF files in each station's
+    ios_shell_data directory, and the files in each station's Water Properties download lists
+    :param data_root: directory containing one directory per station, e.g. E:\\charles\\mooring_data_page
+    :param catalog_file: full path to the catalog database; defaults to CATALOG_FILE
+    :return: number of files in the catalog
+    """
+    paths = glob.glob(os.path.join(data_root, '*', 'ios_shell_data', '*.*'))
+    for list_file in glob.glob(os.path.join(data_root, '*', 'wget_*download_list*.csv')):
+        paths += pd.read_csv(list_file, header=None, names=['File'])['File'].tolist()
+    add_files(paths, catalog_file)
+
+    connection = connect_catalog(catalog_file)
+    num_files = connection.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+    connection.close()
+    return num_files
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build or query the catalog of deployment files.')
+    parser.add_argument('--catalog', default=CATALOG_FILE, help='catalog database file')
+    parser.add_argument('--build', metavar='DATA_ROOT', help='add the files of all stations under DATA_ROOT')
+    parser.add_argument('--station')
+    parser.add_argument('--instrument')
+    parser.add_argument('--min-depth', type=float)
+    parser.add_argument('--max-depth', type=float)
+    parser.add_argument('--start-date', help='YYYY-mm-dd')
+    parser.add_argument('--end-date', help='YYYY-mm-dd')
+    parser.add_argument('--format', choices=['shell', 'netcdf'])
+    args = parser.parse_args()
+
+    if args.build is not None:
+        print(f'{build_catalog(args.build, args.catalog)} files in the catalog')
+    else:
+        df_files = query_files(args.station, args.instrument, args.min_depth, args.max_depth, args.start_date,
+                               args.end_date, args.format, args.catalog)
+        print(df_files.to_string(index=False))
+    return
+
+
+if __name__ == '__main__':
+    main()
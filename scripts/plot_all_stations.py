@@ -0,0 +1,185 @@
+import argparse
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from plot_moored_data import BIN_INFO, get_station_data_files, run_plot
+
+# Command line entry point to make the plots of many stations at once, e.g. for the nightly refresh:
+# python plot_all_stations.py --data-root E:\charles\mooring_data_page --workers 3 --memory-budget 16
+
+# Products that can be selected, by the run_plot() flag that makes them
+PRODUCTS = {
+    'instrument_depths': 'do_instrument_depths',
+    'monthly_avail': 'do_monthly_avail',
+    'annual_avail': 'do_annual_avail',
+    'raw_by_inst': 'do_raw_by_inst',
+    'daily_means': 'do_daily_means',
+    'daily_clim': 'do_daily_clim',
+    'daily_anom': 'do_daily_anom',
+    'monthly_means': 'do_monthly_means',
+    'monthly_clim': 'do_monthly_clim',
+    'monthly_anom': 'do_monthly_anom'
+}
+
+# Instrument depths need the IOS Shell files, which aren't kept after conversion, so skip them by default
+DEFAULT_PRODUCTS = [product for product in PRODUCTS if product != 'instrument_depths']
+
+# Rough peak memory of processing a station per byte of its raw data files: csv files are about
+# as big as their data in memory, while parquet files are compressed
+MEMORY_PER_FILE_BYTE = {'.csv': 3, '.parquet': 10}
+
+
+def get_raw_data_dir(data_root: str, station: str) -> str:
+    """
+    Get the directory of the csv-format current meter and CTD data of a station
+    :param data_root: directory containing one directory per station
+    :param station: name of station
+    :return: full path to the data directory, ending with a path separator like run_plot() expects
+    """
+    return os.path.join(data_root, station.lower(), 'csv_data', '')
+
+
+def estimate_station_memory(raw_data_dir: str, station: str) -> float:
+    """
+    Estimate the peak memory needed to make the plots of a station from the size of its raw data files
+    :param raw_data_dir: full path to where the csv-format current meter and CTD data are stored
+    :param station: name of station
+    :return: estimated memory in GB
+    """
+    num_bytes = sum(
+        os.path.getsize(f) * MEMORY_PER_FILE_BYTE.get(os.path.splitext(f)[1], 1)
+        for f in get_station_data_files(raw_data_dir, station)
+    )
+    return num_bytes / 1e9
+
+
+def plot_station(station: str, raw_data_dir: str, run_plot_kwargs: dict) -> tuple:
+    """
+    Make the plots of one station, catching any error so that the other stations still get done
+    :param station: name of station
+    :param raw_data_dir: full path to where the csv-format current meter and CTD data are stored
+    :param run_plot_kwargs: keyword arguments for run_plot(), e.g. the product flags
+    :return: station, wall time in seconds, error message or None if successful
+    """
+    start_time = time.perf_counter()
+    error = None
+    # run_plot() finds the station directories relative to the scripts directory
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        run_plot(station, raw_data_dir, **run_plot_kwargs)
+    except Exception:
+        error = traceback.format_exc()
+    return station, time.perf_counter() - start_time, error
+
+
+def plot_stations(stations: list, data_root: str, products: list, station_workers: int = 1,
+                  memory_budget: float = None, **run_plot_kwargs) -> list:
+    """
+    Make the plots of many stations, running up to station_workers stations at once while keeping the
+    estimated memory of the running stations within the memory budget. Stations with the largest estimated
+    memory are started first. A station estimated to need more than the whole budget runs on its own
+    :param stations: names of stations
+    :param data_root: directory containing one directory per station, see get_raw_data_dir()
+    :param products: names of products to make, from the global variable PRODUCTS
+    :param station_workers: number of stations to process at once
+    :param memory_budget: memory in GB that the running stations may use; no limit if None
+    :param run_plot_kwargs: other keyword arguments for run_plot(), e.g. num_workers to render figures with
+    :return: list of (station, wall time in seconds, error message or None) in order of completion
+    """
+    run_plot_kwargs.update({PRODUCTS[product]: True for product in products})
+
+    memory = {station: estimate_station_memory(get_raw_data_dir(data_root, station), station)
+              for station in stations}
+    waiting = sorted(stations, key=lambda x: memory[x], reverse=True)
+
+    results = []
+    if station_workers <= 1:
+        for station in waiting:
+            results.append(plot_station(station, get_raw_data_dir(data_root, station), run_plot_kwargs))
+            print_station_result(*results[-1])
+        return results
+
+    running = {}
+    with ProcessPoolExecutor(max_workers=station_workers) as executor:
+        while len(waiting) > 0 or len(running) > 0:
+            # Start every waiting station that fits in the free workers and memory
+            for station in list(waiting):
+                if len(running) == station_workers:
+                    break
+                memory_in_use = sum(memory[x] for x in running.values())
+                if memory_budget is None or len(running) == 0 or memory_in_use + memory[station] <= memory_budget:
+                    future = executor.submit(plot_station, station, get_raw_data_dir(data_root, station),
+                                             run_plot_kwargs)
+                    running[future] = station
+                    waiting.remove(station)
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                del running[future]
+                results.append(future.result())
+                print_station_result(*results[-1])
+    return results
+
+
+def print_station_result(station: str, wall_time: float, error: str):
+    """
+    Print the outcome of processing a station
+    :param station: name of station
+    :param wall_time: wall time in seconds
+    :param error: error message or None if successful
+    :return:
+    """
+    if error is None:
+        print(f'Finished {station} in {wall_time:.1f} s')
+    else:
+        print(f'Failed {station} after {wall_time:.1f} s:\n{error}')
+    return
+
+
+def print_timing_summary(results: list, total_time: float):
+    """
+    Print a table of the wall time and outcome of each station
+    :param results: list of (station, wall time in seconds, error message or None)
+    :param total_time: wall time of all stations in seconds
+    :return:
+    """
+    print(f'\n{"Station":<10}{"Status":<10}{"Time (s)":>10}')
+    for station, wall_time, error in sorted(results, key=lambda x: x[1], reverse=True):
+        print(f'{station:<10}{"ok" if error is None else "FAILED":<10}{wall_time:>10.1f}')
+    print(f'{"Total":<20}{total_time:>10.1f}')
+    return
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Make the mooring data plots of many stations.')
+    parser.add_argument('--stations', nargs='+', default=list(BIN_INFO.keys()), choices=list(BIN_INFO.keys()),
+                        metavar='STATION', help='stations to process (default: all stations in BIN_INFO)')
+    parser.add_argument('--products', nargs='+', default=DEFAULT_PRODUCTS, choices=list(PRODUCTS.keys()),
+                        metavar='PRODUCT', help=f'products to make, from {", ".join(PRODUCTS)} '
+                                                f'(default: all but instrument_depths)')
+    parser.add_argument('--data-root', default='E:\\charles\\mooring_data_page',
+                        help='directory containing a <station>/csv_data/ directory for each station')
+    parser.add_argument('--workers', type=int, default=1, help='number of stations to process at once')
+    parser.add_argument('--render-workers', type=int, default=1,
+                        help='number of processes each station renders its figures with')
+    parser.add_argument('--memory-budget', type=float, default=None,
+                        help='memory in GB that the stations being processed at once may use')
+    parser.add_argument('--recompute-daily-means', action='store_true',
+                        help='compute daily means even if they are up to date with the raw data')
+    parser.add_argument('--no-figure-cache', action='store_true',
+                        help='render all figures even if their inputs have not changed')
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    results = plot_stations(args.stations, args.data_root, args.products, args.workers, args.memory_budget,
+                            num_workers=args.render_workers, recompute_daily_means=args.recompute_daily_means,
+                            use_figure_cache=not args.no_figure_cache)
+    print_timing_summary(results, time.perf_counter() - start_time)
+
+    # Non-zero exit status for the nightly job if any station failed
+    return 1 if any(error is not None for _, _, error in results) else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -4,9 +4,33 @@ import os
 import pandas as pd
 import numpy as np
 import datetime
-from tqdm import trange
 import glob
 import xarray as xr
+import functools
+import hashlib
+import pickle
+import copy
+import inspect
+import json
+import contextlib
+import sys
+import time
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from shell_header import get_shell_metadata
+from file_catalog import get_catalog_file, get_file_entries
+
+try:
+    import resource
+except ImportError:
+    # resource is not available on Windows, where psutil is used for the peak memory instead
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    # psutil is only needed to record the memory use in run reports on Windows and macOS
+    psutil = None
 
 VARS = ['Temperature', 'Salinity', 'Oxygen:Dissolved:SBE']
 
@@ -59,27 +83,107 @@ CLIM_YEARS = {
     'JUAN2': (2019, 2022)
 }
 
+# Instrument types by file suffix, and all other files
+INSTRUMENTS = ['CUR', 'CTD', 'Other']
+
+# Columns of the converted current meter and CTD data
+RAW_COLUMNS = ['Record_Number', 'Date', 'Time', 'Temperature', 'Salinity', 'Depth',
+               'Oxygen:Dissolved:SBE', 'Filename']
+
+# Only the columns needed to compute daily means from the raw data
+DAILY_MEAN_COLUMNS = ['Date', 'Time', 'Temperature', 'Salinity', 'Depth', 'Filename']
+
+# Name of the directory in the csv data directory that holds the columnar station data store
+# written by convert_cur_ctd_from_shell.do_conversion(output_format='parquet')
+STORE_DIR_NAME = 'parquet_store'
+
+# WOD18 range tables in QC_ranges/ used by quality_control(), by variable
+QC_RANGE_FILES = {
+    'Temperature': 'wod18_ranges_TEMP_Coast_N_Pac.csv',
+    'Salinity': 'wod18_ranges_PSAL_Coast_N_Pac.csv'
+}
+
+# In-memory tier of the climatology cache used by the compute_* functions for daily
+# climatologies, monthly means and climatologies, and anomalies
+CLIM_CACHE = {}
+
+# Directory for the on-disk tier of the climatology cache; set by run_plot(), None to disable
+CLIM_CACHE_DIR = None
+
+# Increase whenever a cached compute_* function changes, so that old cached results are not used
+CLIM_CACHE_VERSION = 3
+
+# Name of the file in each figures directory that records the hash of the inputs of each figure,
+# so that render_figures() can skip figures whose inputs have not changed
+FIGURE_MANIFEST_NAME = 'figure_cache_manifest.json'
+
+# Increase whenever a change outside of this module's code and globals (e.g. a matplotlib style) changes figures
+FIGURE_CACHE_VERSION = 2
+
+# Series of raw data with at least this many points are drawn as a density raster instead of
+# a scatter plot in plot_raw_TS_by_inst()
+RASTER_MIN_POINTS = 100000
+
+# Leave the matplotlib version out of the png files so that the same figure is always the same file
+PNG_METADATA = {'Software': None}
+
+# Stages of the data products computed by StationStages, by name: the stages each one is computed from
+STAGE_INPUTS = {
+    'raw': [],
+    'qc': ['raw'],
+    'binned': ['qc'],
+    'coverage_cube': ['binned'],
+    'daily_means': ['binned'],
+    'daily_clim': ['daily_means'],
+    'daily_anom': ['daily_means'],
+    'monthly_means': ['daily_means'],
+    'monthly_clim': ['daily_means'],
+    'monthly_anom': ['daily_means']
+}
+
+# Outputs of the stages computed in this process, by (station, stage, fingerprint), plus the columns read for the
+# stages of OBSERVATION_STAGES
+STAGE_OUTPUTS = {}
+
+# Stages whose output is the observations; they are kept in memory only, and qc and binned are computed
+# in place on the observations of the stage before them
+OBSERVATION_STAGES = ['raw', 'qc', 'binned']
+
+# Increase whenever the code of a stage changes, so that saved stage outputs are computed again
+STAGE_CACHE_VERSION = 1
+
+# Name of the directory in the csv data directory that run_plot() saves its run reports to
+RUN_REPORT_DIR_NAME = 'run_reports'
+
+# Seconds between samples of the memory use of this process while a stage of a run report is measured
+RSS_SAMPLE_INTERVAL = 0.05
+
 # Strictly for cast netCDF files which use BODC codes to name variables
 # SSS (sea surface salinity) not used yet
 VAR_CODES = {'Temperature': {'codes': ['TEMPS901', 'TEMPS601'], 'units': 'C'},
              'Salinity': {'codes': [], 'units': 'PSS-78'}}
 
 
-def plot_instrument_depths(output_dir: str, station: str, shell_data_dir: str = None, wget_csv_file: str = None):
+def plot_instrument_depths(output_dir: str, station: str, shell_data_dir: str = None, wget_csv_file: str = None,
+                           catalog_file: str = None):
     """
     Visually inspect where the "standard" instrument depths are overall for each station.
     Plot the bin width around each standard depth as a greyed-out horizontal band.
 
     :param wget_csv_file: Use instrument depths from file names in the wget csv file downloaded from Water Properties
-    :param shell_data_dir: Directory for IOS shell-format data; alternate to using the wget csv files
+    :param shell_data_dir: Directory for IOS shell-format data; alternate to using the wget csv files. Instrument
+    depths and deployment years are read from the file headers, or from the file names if not in the headers
     :param output_dir: directory to save the plot to
     :param station: name of station
+    :param catalog_file: catalog of the file names, see file_catalog.py; defaults to the one in the directory
+    containing the station directory
     :return:
     """
     ybot = BIN_INFO[station]['max_depth']
 
     if shell_data_dir is not None:
-        files = glob.glob(shell_data_dir + '*.*')
+        # Only the data files, not e.g. the download manifest
+        files = [x for x in glob.glob(shell_data_dir + '*.*') if x.lower().endswith(('.cur', '.ctd'))]
     elif wget_csv_file is not None:
         df_wget = pd.read_csv(wget_csv_file, names=['filename'])
         files = df_wget['filename'].values
@@ -87,16 +191,24 @@ def plot_instrument_depths(output_dir: str, station: str, shell_data_dir: str =
         print('Must provide one of shell_data_dir or wget_csv_file; neither were given')
         return
 
-    depths = np.array(
-        [int(os.path.basename(x).split('_')[3].split('.')[0][:-1]) for x in files]
-    )
-    dep_years = np.array(
-        [int(os.path.basename(x).split('_')[1][:4]) for x in files]
-    )
+    if catalog_file is None:
+        catalog_file = get_catalog_file(shell_data_dir if shell_data_dir is not None else wget_csv_file)
+    df_files = get_file_entries(files, catalog_file).dropna(subset=['depth'])
+    files = df_files['path'].values
+    depths = df_files['depth'].to_numpy(dtype=int)
+    dep_years = np.array([int(x[:4]) for x in df_files['start_date']])
+
+    if shell_data_dir is not None:
+        # Use the instrument depth and start time in each file's header, which only needs the header to be read
+        for i, metadata in enumerate(get_shell_metadata(x) for x in files):
+            if metadata['instrument_depth'] is not None:
+                depths[i] = round(metadata['instrument_depth'])
+            if metadata['start_time'] is not None:
+                dep_years[i] = metadata['start_time'].year
 
     # Make masks for CUR vs CTD data
-    # Capture both .ctd and .CTD if existing
-    is_CTD = np.array([x.lower().endswith('.ctd') for x in files])
+    # The catalog has the instrument in upper case, so both .ctd and .CTD are captured
+    is_CTD = (df_files['instrument'] == 'CTD').to_numpy()
 
     fig, ax = plt.subplots()
     ax.scatter(dep_years[is_CTD], depths[is_CTD], label='CTD', c='blue',
@@ -131,7 +243,8 @@ def plot_instrument_depths(output_dir: str, station: str, shell_data_dir: str =
     ax.tick_params(which='major', direction='in', bottom=True, top=True, left=True, right=True)
     plt.title(station.upper(), loc='left')
     plt.tight_layout()
-    plt.savefig(os.path.join(output_dir, f'{station.lower()}_cur_ctd_depths.png'), dpi=300)
+    plt.savefig(os.path.join(output_dir, f'{station.lower()}_cur_ctd_depths.png'), dpi=300,
+                metadata=PNG_METADATA)
     plt.close()
 
     return
@@ -141,56 +254,133 @@ def add_datetime(df: pd.DataFrame):
     """
     Add column containing datetime-format dates to pandas dataframe containing the observations
     :param df: pandas dataframe containing the observations
-    :return: the dataframe df with a column added containing observation times in datetime format
+    :return: the dataframe df with a column added containing observation times in datetime64 format
     """
     # Need to replace the slash in YYYY/mm/dd format with a dash to comply with ISO format
     # so YYYY-mm-dd
-    df['Date'] = [x.replace('/', '-') for x in df['Date']]
-    df['Datetime'] = [
-        datetime.datetime.fromisoformat(d + ' ' + t)
-        for d, t in zip(df['Date'], df['Time'])
-    ]
+    df['Date'] = df['Date'].str.replace('/', '-', regex=False)
+    # Data read from the station data store already have typed observation times
+    if 'Datetime' not in df.columns or not pd.api.types.is_datetime64_any_dtype(df['Datetime']):
+        # Parse all the dates and times in one vectorized call
+        df['Datetime'] = pd.to_datetime(df['Date'] + ' ' + df['Time'], format='ISO8601')
     return df
 
 
-def plot_annual_samp_freq(df: pd.DataFrame, var: str, output_dir: str, station: str):
+def get_instrument_index(filenames: pd.Series) -> np.ndarray:
+    """
+    Get the index in the global variable INSTRUMENTS of the instrument type of each observation from its
+    file name, checking the suffix of each file only once. Files have both .CUR and .cur, and .CTD and .ctd
+    file suffixes. Files with any other suffix get the index of 'Other'
+    :param filenames: file name of each observation
+    :return: instrument index of each observation
+    """
+    file_codes, unique_files = pd.factorize(filenames)
+    file_instruments = np.repeat(INSTRUMENTS.index('Other'), len(unique_files))
+    for k, inst in enumerate(INSTRUMENTS[:-1]):
+        file_instruments[
+            np.array([x.lower().endswith(f'.{inst.lower()}') for x in unique_files], dtype=bool)
+        ] = k
+    return file_instruments[file_codes]
+
+
+def compute_coverage_cube(df: pd.DataFrame, station: str) -> dict:
+    """
+    Count the observations of each variable by instrument type, year, month, and bin depth, and the
+    number of files with observations of each variable by instrument type
+    :param df: pandas dataframe containing the observations
+    :param station: name of station
+    :return: dict of 'counts' with shape (variable, instrument, year, month, bin) where the last bin holds
+    observations outside of all the bins, 'num_files' with shape (variable, instrument), and the
+    'variables', 'instruments', 'years' and 'bin_depths' the axes correspond to
+    """
+    if 'Bin_index' not in df.columns:
+        df = add_bin_index(df, station)
+
+    bin_depths = BIN_INFO[station]['bin_depths']
+    # Observations outside of all bins go in an extra last bin
+    bin_index = df['Bin_index'].to_numpy().astype(int)
+    bin_index[bin_index == -1] = len(bin_depths)
+    num_bins = len(bin_depths) + 1
+
+    datetimes = pd.DatetimeIndex(df['Datetime'])
+    years = np.arange(datetimes.year.min(), datetimes.year.max() + 1)
+    num_keys = len(INSTRUMENTS) * len(years) * 12 * num_bins
+
+    file_codes = pd.factorize(df['Filename'])[0]
+    instrument_index = get_instrument_index(df['Filename'])
+
+    # Combine instrument, year, month and bin into a single integer key so that all the
+    # counts of a variable are computed in one pass with bincount
+    key = (((instrument_index * len(years) + datetimes.year.to_numpy() - years[0]) * 12
+            + datetimes.month.to_numpy() - 1) * num_bins + bin_index)
+
+    counts = np.zeros((len(VARS), len(INSTRUMENTS), len(years), 12, num_bins), dtype=int)
+    num_files = np.zeros((len(VARS), len(INSTRUMENTS)), dtype=int)
+    for v, var in enumerate(VARS):
+        has_obs = df[var].notna().to_numpy()
+        counts[v] = np.bincount(key[has_obs], minlength=num_keys).reshape(counts.shape[1:])
+        for k in range(len(INSTRUMENTS)):
+            num_files[v, k] = len(np.unique(file_codes[has_obs & (instrument_index == k)]))
+
+    return {'counts': counts, 'num_files': num_files, 'variables': np.array(VARS),
+            'instruments': np.array(INSTRUMENTS), 'years': years, 'bin_depths': np.array(bin_depths)}
+
+
+def save_coverage_cube(coverage_cube: dict, output_dir: str, station: str):
+    """
+    Save the coverage cube to {station}_coverage_cube.npz
+    :param coverage_cube: dict from compute_coverage_cube()
+    :param output_dir: directory to save the file to, e.g., the directory of the daily means
+    :param station: name of station
+    :return:
+    """
+    np.savez_compressed(os.path.join(output_dir, f'{station.lower()}_coverage_cube.npz'), **coverage_cube)
+    return
+
+
+def load_coverage_cube(data_dir: str, station: str) -> dict:
+    """
+    Load the coverage cube saved by save_coverage_cube()
+    :param data_dir: directory containing the file
+    :param station: name of station
+    :return: dict like from compute_coverage_cube()
+    """
+    with np.load(os.path.join(data_dir, f'{station.lower()}_coverage_cube.npz')) as npz:
+        return {name: npz[name] for name in npz.files}
+
+
+def plot_annual_samp_freq(coverage_cube: dict, var: str, output_dir: str, station: str):
     """
     Plot histogram of annual counts of observations
     :param station: name of station
     :param output_dir: directory to save plots to
-    :param df: pandas dataframe containing the observations
+    :param coverage_cube: dict of observation counts from compute_coverage_cube()
     :param var: name of variable being plotted which is one of those in the global variable VARS
     :return:
     """
-    # Make a mask for the specific variable and use data in it for the plot
-    var_mask = ~df.loc[:, var].isna()
-    # https://stackoverflow.com/questions/42379818/correct-way-to-set-new-column-in-pandas-dataframe-to-avoid-settingwithcopywarnin
-    df_masked = df.loc[var_mask, :].copy()
-    df_masked.reset_index(drop=True, inplace=True)
+    v = list(coverage_cube['variables']).index(var)
+    years = coverage_cube['years']
+    # Counts by instrument and year
+    annual_counts = coverage_cube['counts'][v].sum(axis=(2, 3))
+    cur_counts, ctd_counts = annual_counts[INSTRUMENTS.index('CUR')], annual_counts[INSTRUMENTS.index('CTD')]
 
-    # Get number of files - have both .CUR and .cur, and .CTD and .ctd file suffixes
-    ctd_mask = [x.lower().endswith('.ctd') for x in df_masked.loc[:, 'Filename']]
-    cur_mask = [x.lower().endswith('.cur') for x in df_masked.loc[:, 'Filename']]
+    num_ctd_files = coverage_cube['num_files'][v, INSTRUMENTS.index('CTD')]
+    num_cur_files = coverage_cube['num_files'][v, INSTRUMENTS.index('CUR')]
 
-    num_ctd_files = len(np.unique(df_masked.loc[ctd_mask, 'Filename']))
-    num_cur_files = len(np.unique(df_masked.loc[cur_mask, 'Filename']))
+    if annual_counts.sum() == 0:
+        print(f'No {var} data to plot annual sampling counts for')
+        return
 
-    # Access datetime.datetime properties
-    # df_masked['Month'] = [x.month for x in df_masked.loc[:, 'Datetime'].copy()]
-    df_masked['Year'] = [x.year for x in df_masked.loc[:, 'Datetime'].copy()]
-    min_year = df_masked['Year'].min()
-    max_year = df_masked['Year'].max()
+    obs_years = years[annual_counts.sum(axis=0) > 0]
+    min_year = obs_years.min()
+    max_year = obs_years.max()
     num_bins = max_year - min_year + 1
 
-    # Create a new 2d array to hold the data
-    # Need to pad whichever record is shorter to match the length of the other one
-    # between the current meter record and the ctd record
-    arr_length = sum(ctd_mask) if sum(ctd_mask) > sum(cur_mask) else sum(cur_mask)
-    padded_cur_arr = np.append(df_masked.loc[cur_mask, 'Year'].to_numpy(),
-                               np.repeat(np.nan, arr_length - sum(cur_mask)))
-    padded_ctd_arr = np.append(df_masked.loc[ctd_mask, 'Year'].to_numpy(),
-                               np.repeat(np.nan, arr_length - sum(ctd_mask)))
-    year_array = np.vstack((padded_cur_arr, padded_ctd_arr)).T  # Need transpose to get 2 columns for histogram
+    # The histogram spans the years with current meter or ctd data
+    inst_years = years[(cur_counts + ctd_counts) > 0]
+    if len(inst_years) == 0:
+        print(f'No current meter or CTD {var} data to plot annual sampling counts for')
+        return
 
     # # Manually assign y-axis ticks to have only whole number ticks
     # num_yticks = df_masked['Year'].max()
@@ -201,11 +391,9 @@ def plot_annual_samp_freq(df: pd.DataFrame, var: str, output_dir: str, station:
     plt.clf()  # Clear any active plots
     fig, ax = plt.subplots()  # Create a new figure and axis instance
 
-    # Plot ctd data on top of cur data in different colours
-    # ax.hist(df_masked.loc[:, 'Year'], bins=num_bins, align='left',
-    #         label='Number of CUR files: {}\nNumber of CTD files: {}'.format(num_cur_files,
-    #                                                                         num_ctd_files))
-    ax.hist(year_array, bins=num_bins, align='left', stacked=True, histtype='bar',
+    # Plot ctd data on top of cur data in different colours, weighting each year by its number of observations
+    ax.hist([years, years], bins=num_bins, range=(inst_years.min(), inst_years.max()),
+            weights=[cur_counts, ctd_counts], align='left', stacked=True, histtype='bar',
             label=[f'Number of CUR files: {num_cur_files}',
                    f'Number of CTD files: {num_ctd_files}'],
             color=['orange', 'b'])
@@ -217,18 +405,19 @@ def plot_annual_samp_freq(df: pd.DataFrame, var: str, output_dir: str, station:
     ax.set_title(var, loc='left')
     plt.legend()
     plt.tight_layout()
-    plt.savefig(os.path.join(output_dir, f'{station.lower()}_{var}_annual_sampling_counts.png'))
+    plt.savefig(os.path.join(output_dir, f'{station.lower()}_{var}_annual_sampling_counts.png'),
+                metadata=PNG_METADATA)
     plt.close(fig)
     return
 
 
-def plot_monthly_samp_freq(df: pd.DataFrame, var: str, output_dir: str, station: str):
+def plot_monthly_samp_freq(coverage_cube: dict, var: str, output_dir: str, station: str):
     """
     Plot monthly numbers of observations in a table with cell colour intensity determined by number of observations
     Credit: James Hannah
     :param station: station name
     :param output_dir: path to folder for outputs
-    :param df: pandas dataframe containing the raw data
+    :param coverage_cube: dict of observation counts from compute_coverage_cube()
     :param var: name of variable to use
     :return:
     """
@@ -247,30 +436,26 @@ def plot_monthly_samp_freq(df: pd.DataFrame, var: str, output_dir: str, station:
         "December",
     ]
 
-    # Make a mask for the specific variable and use data in it for the plot
-    var_mask = ~df.loc[:, var].isna()
-    # https://stackoverflow.com/questions/42379818/correct-way-to-set-new-column-in-pandas-dataframe-to-avoid-settingwithcopywarnin
-    df_masked = df.loc[var_mask, :].copy()
-    df_masked.reset_index(drop=True, inplace=True)
+    v = list(coverage_cube['variables']).index(var)
+    years = coverage_cube['years']
+    # Counts by year and month of all instruments and depths
+    year_month_counts = coverage_cube['counts'][v].sum(axis=(0, 3))
+
+    if year_month_counts.sum() == 0:
+        print(f'No {var} data to plot monthly sampling counts for')
+        return
 
-    # Access datetime.datetime properties
-    df_masked['Month'] = [x.month for x in df_masked.loc[:, 'Datetime'].copy()]
-    df_masked['Year'] = [x.year for x in df_masked.loc[:, 'Datetime'].copy()]
     min_year = 1979  # PLOT_DATES[station][0].year  # START_YEAR  # df_masked['Year'].min()
-    max_year = df_masked['Year'].max()
+    max_year = years[year_month_counts.sum(axis=1) > 0].max()
     year_range = max_year - min_year + 1
 
     # Initialize array to hold heatmap data
     monthly_counts = np.zeros(
         shape=(year_range, len(months)), dtype='int')
 
-    # Populate the above array
-    for i in range(year_range):
-        for j in range(len(months)):
-            monthly_counts[i, j] = sum(
-                (df_masked['Year'].values == min_year + i) &
-                (df_masked['Month'].values == j + 1)
-            )
+    # Fill in the table with the counts of its years
+    in_range = (years >= min_year) & (years <= max_year)
+    monthly_counts[years[in_range] - min_year, :] = year_month_counts[in_range, :]
 
     # Max counts for setting limit of plot colour bar
     max_counts = np.max(monthly_counts)
@@ -314,7 +499,7 @@ def plot_monthly_samp_freq(df: pd.DataFrame, var: str, output_dir: str, station:
     plt.colorbar()
 
     output_file = os.path.join(output_dir, f'{station.lower()}_{var}_monthly_sampling_counts.png')
-    plt.savefig(output_file)
+    plt.savefig(output_file, metadata=PNG_METADATA)
     plt.close()
 
     # Reset values
@@ -338,27 +523,263 @@ def standard_plot_title(station: str, depth: int):
     return
 
 
-def get_depth_mask(station: str, df: pd.DataFrame, depth: float, half_bin_size: float) -> np.ndarray:
+def init_render_worker():
     """
-    Use static instrument depth from data file names to derive the depth masks
-    so as to only plot data from one depth at a time.
-    :param station: name of station
-    :param df: pandas dataframe containing the observations
-    :param depth: bin depth as specified in the global variable BIN_DEPTHS
-    :param half_bin_size: half of the bin size for the station as specified in the global variable BIN_DEPTHS
-    :return: numpy array of a boolean mask indicating which data to use
+    Set up a figure rendering worker process to draw with the non-interactive Agg backend
+    :return:
     """
-    if station == 'A1' and depth == 450:
-        depth_mask = ((df.loc[:, 'Depth_static'].to_numpy() >= 450) &
-                      (df.loc[:, 'Depth_static'].to_numpy() <= 520))
+    matplotlib.use('Agg')
+    return
+
+
+def render_figure_job(job: tuple) -> str:
+    """
+    Render one figure job
+    :param job: tuple of (render function, dict of keyword arguments including output_file)
+    :return: the output file of the figure
+    """
+    render_func, kwargs = job
+    render_func(**kwargs)
+    return kwargs['output_file']
+
+
+def get_render_dependencies(func, dependencies: dict = None) -> dict:
+    """
+    Collect the source code of a function and of the functions of this module it uses, directly or through
+    other functions, e.g. standard_plot_title(), and the values of the globals of this module they read,
+    e.g. PLOT_DATES, which changes with the current year
+    :param func: function defined in this module, e.g. a render function
+    :param dependencies: dependencies collected so far, to add to
+    :return: dict of global name: source code of the function or repr of the value
+    """
+    if dependencies is None:
+        dependencies = {}
+    dependencies[func.__name__] = inspect.getsource(func)
+
+    # Names used by the function, including those in its nested functions and comprehensions
+    names = set()
+    code_objects = [func.__code__]
+    while len(code_objects) > 0:
+        code = code_objects.pop()
+        names.update(code.co_names)
+        code_objects += [const for const in code.co_consts if inspect.iscode(const)]
+
+    module_globals = globals()
+    for name in sorted(names):
+        if name in dependencies or name not in module_globals:
+            continue
+        value = module_globals[name]
+        if inspect.isfunction(value):
+            # Functions imported from other modules are left out, like the rest of their modules
+            if value.__module__ == __name__:
+                get_render_dependencies(inspect.unwrap(value), dependencies)
+        elif not (inspect.ismodule(value) or inspect.isclass(value)):
+            dependencies[name] = repr(value)
+    return dependencies
+
+
+def hash_figure_job(job: tuple) -> str:
+    """
+    Hash everything that determines what a figure job draws: the render function's source code and the
+    code and globals of this module it uses (see get_render_dependencies()), FIGURE_CACHE_VERSION,
+    the matplotlib version, and the keyword arguments including the input arrays
+    :param job: tuple of (render function, dict of keyword arguments)
+    :return: hex digest of the figure job
+    """
+    render_func, kwargs = job
+    hasher = hashlib.sha256()
+
+    def update(value):
+        if isinstance(value, np.ndarray):
+            if value.dtype == object:
+                # e.g. arrays of datetime.datetime
+                hasher.update(repr(value.tolist()).encode())
+            else:
+                hasher.update(f'{value.dtype.str}{value.shape}'.encode())
+                hasher.update(np.ascontiguousarray(value).tobytes())
+        elif isinstance(value, (list, tuple)):
+            hasher.update(f'{type(value).__name__}{len(value)}'.encode())
+            for item in value:
+                update(item)
+        else:
+            hasher.update(repr(value).encode())
+
+    update((render_func.__name__, FIGURE_CACHE_VERSION, matplotlib.__version__))
+    for name, dependency in sorted(get_render_dependencies(render_func).items()):
+        update((name, dependency))
+    for name in sorted(kwargs):
+        update(name)
+        update(kwargs[name])
+    return hasher.hexdigest()
+
+
+def load_figure_manifest(figures_dir: str) -> dict:
+    """
+    Load the figure cache manifest of a figures directory
+    :param figures_dir: directory containing the figures
+    :return: dict of figure file name: hash of the figure job that rendered it
+    """
+    manifest_file = os.path.join(figures_dir, FIGURE_MANIFEST_NAME)
+    if not os.path.exists(manifest_file):
+        return {}
+    with open(manifest_file, 'r') as f:
+        return json.load(f)
+
+
+def save_figure_manifest(figures_dir: str, manifest: dict):
+    """
+    Save the figure cache manifest of a figures directory, replacing the old one only once written
+    :param figures_dir: directory containing the figures
+    :param manifest: dict of figure file name: hash of the figure job that rendered it
+    :return:
+    """
+    manifest_file = os.path.join(figures_dir, FIGURE_MANIFEST_NAME)
+    with open(manifest_file + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(manifest_file + '.tmp', manifest_file)
+    return
+
+
+def render_figures(jobs: list, num_workers: int = 1, use_cache: bool = False) -> list:
+    """
+    Render independent figure jobs, in parallel if num_workers > 1.
+    A figure job is a tuple of (render function, dict of keyword arguments). The render function must be
+    defined at module level and the keyword arguments should only hold the small arrays needed for that one
+    figure, because they are sent to a worker process. The keyword arguments must include output_file
+    :param jobs: list of figure jobs, e.g. from daily_means_figure_jobs()
+    :param num_workers: number of processes to render figures with; 1 to render in this process
+    :param use_cache: skip figures whose job hash matches the one recorded in the figure cache manifest
+    of the figure's directory, and record the hashes of the figures that are rendered
+    :return: output files of the figures that were rendered
+    """
+    manifests = {}
+    if use_cache:
+        job_keys = [hash_figure_job(job) for job in jobs]
+        for render_func, kwargs in jobs:
+            figures_dir = os.path.dirname(kwargs['output_file'])
+            if figures_dir not in manifests:
+                manifests[figures_dir] = load_figure_manifest(figures_dir)
+
+        jobs_to_render = []
+        for job, key in zip(jobs, job_keys):
+            output_file = job[1]['output_file']
+            manifest = manifests[os.path.dirname(output_file)]
+            if manifest.get(os.path.basename(output_file)) != key or not os.path.exists(output_file):
+                jobs_to_render.append((job, key))
+        print(f'Skipping {len(jobs) - len(jobs_to_render)} unchanged figures')
+    else:
+        jobs_to_render = [(job, None) for job in jobs]
+
+    executor = None
+    if num_workers > 1 and len(jobs_to_render) > 1:
+        executor = ProcessPoolExecutor(max_workers=min(num_workers, len(jobs_to_render)),
+                                       initializer=init_render_worker)
+        output_files = executor.map(render_figure_job, [job for job, key in jobs_to_render])
     else:
-        # Make a mask to capture data within 5 or 10 vertical meters of each bin depth
-        depth_mask = ((df.loc[:, 'Depth_static'].to_numpy() >= depth - half_bin_size) &
-                      (df.loc[:, 'Depth_static'].to_numpy() <= depth + half_bin_size))
-    return depth_mask
+        output_files = (render_figure_job(job) for job, key in jobs_to_render)
+
+    rendered = []
+    try:
+        for (job, key), output_file in zip(jobs_to_render, output_files):
+            rendered.append(output_file)
+            if use_cache:
+                manifests[os.path.dirname(output_file)][os.path.basename(output_file)] = key
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        # Record the figures rendered so far even if one failed
+        for figures_dir, manifest in manifests.items():
+            save_figure_manifest(figures_dir, manifest)
+
+    return rendered
+
+
+def get_bin_edges(station: str) -> list:
+    """
+    Get the top and bottom depths of each of the station's bins from the global variable BIN_INFO,
+    including the special bottom bin for A1
+    :param station: name of station
+    :return: list of (top, bottom) depths of the bins in the order of BIN_INFO bin depths.
+    Both limits are included in the bin
+    """
+    half_bin_size = BIN_INFO[station]['bin_size'] / 2
+    bin_edges = []
+    for depth in BIN_INFO[station]['bin_depths']:
+        if station == 'A1' and depth == 450:
+            bin_edges.append((450, A1_BOTTOM_BIN_MAX))
+        else:
+            bin_edges.append((depth - half_bin_size, depth + half_bin_size))
+    return bin_edges
+
+
+def get_bin_index(station: str, depth_static: np.ndarray) -> np.ndarray:
+    """
+    Assign each observation to a bin using its static instrument depth, in one pass with np.digitize
+    :param station: name of station
+    :param depth_static: static instrument depths from the data file names
+    :return: numpy array of the index of the bin in BIN_INFO bin depths for each observation,
+    or -1 for observations outside of all the bins
+    """
+    # Alternate tops and bottoms of the bins; nudge each bottom up so that it is included in its bin
+    flat_edges = np.array(
+        [edge for top, bottom in get_bin_edges(station) for edge in (top, np.nextafter(bottom, np.inf))]
+    )
+    if any(np.diff(flat_edges) <= 0):
+        raise ValueError(f'Bins for station {station} overlap')
+
+    # Odd positions fall between the top and bottom of a bin, even positions between bins
+    position = np.digitize(np.asarray(depth_static, dtype=float), flat_edges)
+    return np.where(position % 2 == 1, (position - 1) // 2, -1).astype(np.int8)
+
+
+def add_bin_index(df: pd.DataFrame, station: str) -> pd.DataFrame:
+    """
+    Add a column containing the bin index of each observation, so that data from one depth
+    can be selected by integer equality or grouped by bin
+    :param df: pandas dataframe containing the observations with static instrument depths
+    :param station: name of station
+    :return: the dataframe df with a Bin_index column added
+    """
+    df['Bin_index'] = get_bin_index(station, df['Depth_static'].to_numpy())
+    return df
+
 
+def scatter_density_raster(ax: plt.Axes, x: np.ndarray, y: np.ndarray, x_limits: tuple, y_limits: tuple,
+                           color: str):
+    """
+    Draw a scatter plot of many points as a single image, by binning the points into a grid with one cell
+    per pixel of the axes and colouring the cells that contain any points. Cells are grown by one pixel to
+    match the size of the '.' markers (s=2) used for the exact scatter plots.
+    Call after plt.tight_layout() so that the grid matches the pixels of the saved figure
+    :param ax: axes to draw on
+    :param x: x values of the points, datetime64 or numeric
+    :param y: y values of the points
+    :param x_limits: x axis limits, which the image covers
+    :param y_limits: y axis limits, which the image covers
+    :param color: colour of the points
+    :return:
+    """
+    if np.issubdtype(np.asarray(x).dtype, np.datetime64) or isinstance(x_limits[0], datetime.datetime):
+        x = matplotlib.dates.date2num(x)
+        x_limits = tuple(matplotlib.dates.date2num(x_limits))
+
+    bbox = ax.get_window_extent()
+    num_x_pixels, num_y_pixels = int(np.ceil(bbox.width)), int(np.ceil(bbox.height))
+
+    counts, _, _ = np.histogram2d(x, y, bins=(num_x_pixels, num_y_pixels), range=(x_limits, y_limits))
+    # Rows of the image go up the y axis
+    occupied = counts.T > 0
+    occupied[1:, :] |= occupied[:-1, :]
+    occupied[:, 1:] |= occupied[:, :-1]
+
+    image = np.zeros(occupied.shape + (4,))
+    image[occupied] = matplotlib.colors.to_rgba(color)
+    ax.imshow(image, extent=(*x_limits, *y_limits), origin='lower', aspect='auto', interpolation='nearest')
+    return
 
-def plot_raw_TS_by_inst(df: pd.DataFrame, output_dir: str, station: str):
+
+def plot_raw_TS_by_inst(df: pd.DataFrame, output_dir: str, station: str,
+                        raster_min_points: int = RASTER_MIN_POINTS):
     """
     Plot raw temperature and salinity time series by instrument.
     Separate data from current meters and CTDs into different subplots with different coloured
@@ -366,12 +787,14 @@ def plot_raw_TS_by_inst(df: pd.DataFrame, output_dir: str, station: str):
     :param df: pandas dataframe containing the observations
     :param output_dir: directory to output the plots to
     :param station: name of station as specified in the global variable BIN_DEPTHS
+    :param raster_min_points: draw series with at least this many points as a density raster with
+    scatter_density_raster() instead of an exact scatter plot; None to always draw exact scatter plots
     :return:
     """
     # Create masks based on instrument type
-    # Get number of files - have both .CUR and .cur, and .CTD and .ctd file suffixes
-    ctd_mask = np.array([x.lower().endswith('.ctd') for x in df.loc[:, 'Filename']])
-    cur_mask = np.array([x.lower().endswith('.cur') for x in df.loc[:, 'Filename']])
+    instrument_index = get_instrument_index(df['Filename'])
+    ctd_mask = instrument_index == INSTRUMENTS.index('CTD')
+    cur_mask = instrument_index == INSTRUMENTS.index('CUR')
 
     # df['Datetime_UTC'] = np.repeat(pd.NaT, len(df))
     # for i in range(len(df)):
@@ -384,7 +807,9 @@ def plot_raw_TS_by_inst(df: pd.DataFrame, output_dir: str, station: str):
 
     y_axis_limits = [(0, 20), (26, 40), (0, 7.5)]  # for T, S, O
 
-    half_bin_size = BIN_INFO[station]['bin_size'] / 2
+    if 'Bin_index' not in df.columns:
+        df = add_bin_index(df, station)
+    bin_index = df['Bin_index'].to_numpy()
 
     # # Fix issue with some early data getting cut off
     # x_axis_buffer = (pd.Timedelta('90 days')
@@ -395,21 +820,26 @@ def plot_raw_TS_by_inst(df: pd.DataFrame, output_dir: str, station: str):
     #     df.loc[:, 'Datetime_UTC'].max() + pd.Timedelta('30 days')
     # )
 
-    for depth in BIN_INFO[station]['bin_depths']:
-        depth_mask = get_depth_mask(station, df, depth, half_bin_size)
+    for k, depth in enumerate(BIN_INFO[station]['bin_depths']):
+        depth_mask = bin_index == k
 
         # only do temp and sal not oxy
         for i, var in enumerate(VARS[:2]):
             # Make plot with 3 subplots
             fig, ax = plt.subplots(2, figsize=(10, 7), sharex=True)
 
-            ax[0].scatter(df.loc[cur_mask & depth_mask, 'Datetime'].to_numpy(),
-                          df.loc[cur_mask & depth_mask, var].to_numpy(),
-                          marker='.', s=2, c='orange', label=f'CUR {var}')
+            # Series to draw as density rasters once the layout is final
+            rasters = []
+            for j, (inst_mask, color, inst) in enumerate([(cur_mask, 'orange', 'CUR'), (ctd_mask, 'blue', 'CTD')]):
+                x = df.loc[inst_mask & depth_mask, 'Datetime'].to_numpy()
+                y = df.loc[inst_mask & depth_mask, var].to_numpy()
 
-            ax[1].scatter(df.loc[ctd_mask & depth_mask, 'Datetime'].to_numpy(),
-                          df.loc[ctd_mask & depth_mask, var].to_numpy(),
-                          marker='.', s=2, c='blue', label=f'CTD {var}')
+                if raster_min_points is not None and len(x) >= raster_min_points:
+                    # Empty scatter for the legend entry
+                    ax[j].scatter([], [], marker='.', s=2, c=color, label=f'{inst} {var}')
+                    rasters.append((ax[j], x, y, color))
+                else:
+                    ax[j].scatter(x, y, marker='.', s=2, c=color, label=f'{inst} {var}')
 
             for j in [0, 1]:
                 ax[j].set_ylabel(f'{var} ({units[i]})')
@@ -425,9 +855,13 @@ def plot_raw_TS_by_inst(df: pd.DataFrame, output_dir: str, station: str):
 
             standard_plot_title(station, depth)
             plt.tight_layout()
+            for ax_j, x, y, color in rasters:
+                scatter_density_raster(ax_j, x, y, (PLOT_DATES[station][0], PLOT_DATES[station][1]),
+                                       y_axis_limits[i], color)
             plt.savefig(
                 os.path.join(output_dir,
-                             f'{station.lower()}_raw_{var}_{depth}m_cur_vs_ctd.png'))
+                             f'{station.lower()}_raw_{var}_{depth}m_cur_vs_ctd.png'),
+                metadata=PNG_METADATA)
             plt.close(fig)
     return
 
@@ -449,10 +883,12 @@ def plot_raw_time_series_deprec(df: pd.DataFrame, output_dir: str, station: str)
 
     units = ['C', 'PSS-78', 'mL/L']
     y_axis_limits = [(4, 19), (26, 38), (0, 7.5)]
-    half_bin_size = BIN_INFO[station]['bin_size'] / 2
+    if 'Bin_index' not in df.columns:
+        df = add_bin_index(df, station)
+    bin_index = df['Bin_index'].to_numpy()
 
-    for depth in BIN_INFO[station]['bin_depths']:
-        depth_mask = get_depth_mask(station, df, depth, half_bin_size)
+    for k, depth in enumerate(BIN_INFO[station]['bin_depths']):
+        depth_mask = bin_index == k
 
         if depth == 75:  # No oxygen at this level for all time
             num_subplots = 2
@@ -485,7 +921,8 @@ def plot_raw_time_series_deprec(df: pd.DataFrame, output_dir: str, station: str)
 
         standard_plot_title(station, depth)
         plt.tight_layout()
-        plt.savefig(os.path.join(output_dir, f'{station.lower()}_raw_tso_{depth}m.png'))
+        plt.savefig(os.path.join(output_dir, f'{station.lower()}_raw_tso_{depth}m.png'),
+                    metadata=PNG_METADATA)
         plt.close(fig)
     return
 
@@ -500,40 +937,65 @@ def compute_daily_means(df: pd.DataFrame, output_dir: str, station: str) -> tupl
     :param df: pandas dataframe containing the observations
     :return: datetime days, daily mean temperature, daily mean salinity
     """
-    half_bin_size = BIN_INFO[station]['bin_size'] / 2
+    bin_depths = BIN_INFO[station]['bin_depths']
 
     # obs_dates will be string type
-    unique_dates, indices = np.unique(df['Date'], return_index=True)
+    # day_index gives the position of each observation's date in unique_dates
+    unique_dates, indices, day_index = np.unique(df['Date'], return_index=True, return_inverse=True)
     unique_datetimes = df.loc[indices, 'Datetime']
-    # obs_days_of_year = np.array([x.timetuple().tm_yday for x in df.loc[indices, 'Datetime']])
+    num_days = len(unique_dates)
 
-    # Initialize an array to hold the daily means for each of the three binned depths
-    daily_means_T = np.zeros((len(BIN_INFO[station]['bin_depths']), len(unique_dates)))
-    daily_means_S = np.zeros((len(BIN_INFO[station]['bin_depths']), len(unique_dates)))
+    # Bin index of each observation; -1 for observations outside of all the bins
+    if 'Bin_index' in df.columns:
+        bin_index = df['Bin_index'].to_numpy().astype(int)
+    else:
+        bin_index = get_bin_index(station, df['Depth_static'].to_numpy()).astype(int)
+
+    # Combine bin and day into a single integer key and sort the observations by it, so that
+    # each (bin, day) group is a contiguous slice. The stable sort keeps the observations of a group
+    # in their original order
+    in_bin = bin_index != -1
+    key = bin_index[in_bin] * num_days + day_index[in_bin]
+    num_keys = len(bin_depths) * num_days
+    order = np.argsort(key, kind='stable')
+    sorted_key = key[order]
+    starts = np.flatnonzero(np.diff(sorted_key, prepend=-1))
+    ends = np.append(starts[1:], len(sorted_key))
+    group_keys = sorted_key[starts]
+
+    daily_means = {}
+    for var in ['Temperature', 'Salinity']:
+        values = df[var].to_numpy()[in_bin][order]
+        if values.dtype.kind != 'f':
+            values = values.astype(float)
+        # Skip nans like pandas mean() does: sum each group with nans as zero and divide by the
+        # number of valid values. numpy sum() over each slice adds pairwise like pandas does, so
+        # the means are identical to those of the per-day Series.mean()
+        valid = ~np.isnan(values)
+        filled = np.where(valid, values, 0)
+        sums = np.array([filled[start:end].sum() for start, end in zip(starts, ends)], dtype=values.dtype)
+        counts = np.bincount(sorted_key[valid], minlength=num_keys)[group_keys]
+        # Days without any data in a bin get nan
+        means = np.full(num_keys, np.nan)
+        with np.errstate(invalid='ignore'):
+            means[group_keys] = sums / counts.astype(values.dtype)
+        daily_means[var] = means.reshape((len(bin_depths), num_days))
+
+    daily_means_T = daily_means['Temperature']
+    daily_means_S = daily_means['Salinity']
 
     # Initialize data dictionary to pass to a csv file later
     data_dict = {'Datetime': unique_datetimes}
 
-    # Iterate through the depths
-    for i in range(len(BIN_INFO[station]['bin_depths'])):
-        depth = BIN_INFO[station]['bin_depths'][i]
-        print(depth)
-        depth_mask = get_depth_mask(station, df, depth, half_bin_size)
-
-        # Iterate through all the unique dates of observation
-        for k in trange(len(unique_dates)):
-            date = unique_dates[k]
-            date_mask = df.loc[:, 'Date'].to_numpy() == date
-            # Populate the arrays for temperature and salinity
-            daily_means_T[i, k] = df.loc[depth_mask & date_mask, 'Temperature'].mean()
-            daily_means_S[i, k] = df.loc[depth_mask & date_mask, 'Salinity'].mean()
-
+    for i, depth in enumerate(bin_depths):
         data_dict[f'Temperature_{depth}m'] = daily_means_T[i, :]
         data_dict[f'Salinity_{depth}m'] = daily_means_S[i, :]
 
     # Save daily means to a file
     df_daily_mean = pd.DataFrame(data_dict)
-    df_daily_mean.to_csv(os.path.join(output_dir, f'{station.lower()}_daily_mean_TS_data.csv'), index=False)
+    # Write full times even if every day's first observation is at midnight
+    df_daily_mean.to_csv(os.path.join(output_dir, f'{station.lower()}_daily_mean_TS_data.csv'), index=False,
+                         date_format='%Y-%m-%d %H:%M:%S')
 
     return unique_datetimes, daily_means_T, daily_means_S
 
@@ -585,20 +1047,74 @@ def get_cast_sst(station: str) -> tuple:
     return cast_datetime[indices_sorted], sst[indices_sorted], depth[indices_sorted]
 
 
-def plot_daily_means(unique_datetimes: np.ndarray, daily_means_T: np.ndarray,
-                     daily_means_S: np.ndarray, output_dir: str,
-                     station: str, add_cast_sst: bool = False):
+def render_daily_means_figure(datetimes: np.ndarray, daily_means_T: np.ndarray, daily_means_S: np.ndarray,
+                              range_T: tuple, range_S: tuple, station: str, depth: int, output_file: str,
+                              datetime_sst: np.ndarray = None, sst: np.ndarray = None):
     """
-    Plot daily mean Temperature and Salinity data
+    Plot daily mean Temperature and Salinity data for one bin depth
+    :param datetimes: dates in datetime format
+    :param daily_means_T: daily mean temperature data of the bin
+    :param daily_means_S: daily mean salinity data of the bin
+    :param range_T: y axis limits for temperature
+    :param range_S: y axis limits for salinity
+    :param station: name of station
+    :param depth: bin depth
+    :param output_file: full path of the png file to save the plot to
+    :param datetime_sst: dates of cast SST data to add to the temperature plot, optional
+    :param sst: cast SST data to add to the temperature plot, optional
+    :return:
+    """
+    fig, ax = plt.subplots(2, figsize=(10, 7), sharex=True)
+
+    ax[0].scatter(datetimes, daily_means_T, c='tab:red', marker='.', s=2,
+                  label='Daily Mean Temperature')
+    # ax[0].set_title('Daily Mean Temperature')
+    ax[0].set_ylim(range_T)
+    ax[0].set_ylabel('Temperature (C)')
+
+    ax[1].scatter(datetimes, daily_means_S, c='tab:blue', marker='.', s=2,
+                  label='Daily Mean Salinity')
+    # ax[1].set_title('Salinity')
+    ax[1].set_ylim(range_S)
+    ax[1].set_xlim((PLOT_DATES[station][0], PLOT_DATES[station][1]))
+
+    ax[1].set_ylabel('Salinity (PSS-78)')
+
+    # Make ticks point inward and on all sides
+    for ax_j in [0, 1]:
+        ax[ax_j].tick_params(which='major', direction='in',
+                             bottom=True, top=True, left=True, right=True)
+        ax[ax_j].tick_params(which='minor', direction='in',
+                             bottom=True, top=True, left=True, right=True)
+
+    # Add cast SST to most upper mooring depth plot
+    if sst is not None:
+        ax[0].scatter(datetime_sst, sst, color='k', s=10, marker='+', label='Cast CTD SST')
+
+    ax[0].legend(loc='upper left', scatterpoints=3)
+    ax[1].legend(loc='upper left', scatterpoints=3)
+
+    standard_plot_title(station, depth)
+
+    plt.tight_layout()
+    plt.savefig(output_file, metadata=PNG_METADATA)
+    plt.close(fig)
+    return
+
+
+def daily_means_figure_jobs(unique_datetimes: np.ndarray, daily_means_T: np.ndarray,
+                            daily_means_S: np.ndarray, output_dir: str,
+                            station: str, add_cast_sst: bool = False) -> list:
+    """
+    Make the figure jobs for plotting daily mean Temperature and Salinity data, one per bin depth
     :param add_cast_sst: Add SST data from CTD casts to E01 35m temperature plot
     :param unique_datetimes: dates in datetime format
     :param daily_means_T: daily mean temperature data
     :param daily_means_S: daily mean salinity data
     :param output_dir: directory to save plots to
     :param station: name of station
-    :return:
+    :return: list of figure jobs for render_figures()
     """
-
     # Set up y axis limits for each of temperature and salinity
     if add_cast_sst:
         datetime_sst, sst, _ = get_cast_sst(station)
@@ -613,101 +1129,254 @@ def plot_daily_means(unique_datetimes: np.ndarray, daily_means_T: np.ndarray,
     range_T = (min_T - 0.5, max_T + 1)
     range_S = (np.nanmin(daily_means_S) - 0.5, np.nanmax(daily_means_S) + 0.5)
 
-    # Plot the data
+    datetimes = np.asarray(unique_datetimes)
+
+    jobs = []
     for i, depth in enumerate(BIN_INFO[station]['bin_depths']):
-        fig, ax = plt.subplots(2, figsize=(10, 7), sharex=True)
+        job = {'datetimes': datetimes, 'daily_means_T': daily_means_T[i], 'daily_means_S': daily_means_S[i],
+               'range_T': range_T, 'range_S': range_S, 'station': station, 'depth': depth}
 
-        ax[0].scatter(unique_datetimes, daily_means_T[i], c='tab:red', marker='.', s=2,
-                      label='Daily Mean Temperature')
-        # ax[0].set_title('Daily Mean Temperature')
-        ax[0].set_ylim(range_T)
-        ax[0].set_ylabel('Temperature (C)')
+        if add_cast_sst and i == 0:
+            image_name = f'{station.lower()}_daily_mean_ts_{depth}m_SST.png'
+            job.update({'datetime_sst': datetime_sst, 'sst': sst})
+        else:
+            image_name = f'{station.lower()}_daily_mean_ts_{depth}m.png'
+        job['output_file'] = os.path.join(output_dir, image_name)
 
-        ax[1].scatter(unique_datetimes, daily_means_S[i], c='tab:blue', marker='.', s=2,
-                      label='Daily Mean Salinity')
-        # ax[1].set_title('Salinity')
-        ax[1].set_ylim(range_S)
-        ax[1].set_xlim((PLOT_DATES[station][0], PLOT_DATES[station][1]))
+        jobs.append((render_daily_means_figure, job))
+    return jobs
 
-        ax[1].set_ylabel('Salinity (PSS-78)')
 
-        # Make ticks point inward and on all sides
-        for ax_j in [0, 1]:
-            ax[ax_j].tick_params(which='major', direction='in',
-                                 bottom=True, top=True, left=True, right=True)
-            ax[ax_j].tick_params(which='minor', direction='in',
-                                 bottom=True, top=True, left=True, right=True)
+def plot_daily_means(unique_datetimes: np.ndarray, daily_means_T: np.ndarray,
+                     daily_means_S: np.ndarray, output_dir: str,
+                     station: str, add_cast_sst: bool = False):
+    """
+    Plot daily mean Temperature and Salinity data
+    :param add_cast_sst: Add SST data from CTD casts to E01 35m temperature plot
+    :param unique_datetimes: dates in datetime format
+    :param daily_means_T: daily mean temperature data
+    :param daily_means_S: daily mean salinity data
+    :param output_dir: directory to save plots to
+    :param station: name of station
+    :return:
+    """
+    render_figures(
+        daily_means_figure_jobs(unique_datetimes, daily_means_T, daily_means_S, output_dir, station, add_cast_sst)
+    )
+    return
 
-        # Add cast SST to most upper mooring depth plot
-        if add_cast_sst and i == 0:
-            ax[0].scatter(datetime_sst, sst, color='k', s=10, marker='+', label='Cast CTD SST')
 
-        ax[0].legend(loc='upper left', scatterpoints=3)
-        ax[1].legend(loc='upper left', scatterpoints=3)
+def hash_daily_means(df_daily_mean: pd.DataFrame, station: str) -> str:
+    """
+    Hash the daily mean data that the climatology products are computed from
+    :param df_daily_mean: pandas dataframe containing daily mean data
+    :param station: name of station
+    :return: hex digest of the dates and the temperature and salinity daily means of each bin
+    """
+    columns = ['Datetime'] + [f'{var}_{d}m' for d in BIN_INFO[station]['bin_depths']
+                              for var in ['Temperature', 'Salinity']]
+    row_hashes = pd.util.hash_pandas_object(df_daily_mean.loc[:, columns], index=False)
+    return hashlib.sha256(row_hashes.to_numpy().tobytes()).hexdigest()
 
-        standard_plot_title(station, depth)
 
-        plt.tight_layout()
+def cache_climatology(product: str):
+    """
+    Decorator to memoize the climatology and anomaly products computed from daily means.
+    Results are keyed on the product, the station, the station's climatology years, the other arguments
+    with their defaults filled in and a hash of the daily mean data, and kept in memory in CLIM_CACHE and,
+    if CLIM_CACHE_DIR is set, on disk so that they are reused by later runs
+    :param product: name of the product computed by the decorated function
+    :return: decorator
+    """
+    def decorator(compute_func):
+        signature = inspect.signature(compute_func)
+
+        @functools.wraps(compute_func)
+        def wrapper(*args, **kwargs):
+            # Bind the arguments so that options passed by position, by keyword or left at their
+            # defaults give the same key
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            options = dict(bound.arguments)
+            df_daily_mean = options.pop('df_daily_mean')
+            station = options.pop('station')
+            # Monthly means don't need climatology years, so don't require them
+            start_year, end_year = CLIM_YEARS.get(station, (None, None))
+            options = ''.join(f'_{name}-{value}' for name, value in sorted(options.items()))
+            key = (f'{station.lower()}_{product}_{start_year}-{end_year}{options}_v{CLIM_CACHE_VERSION}_'
+                   f'{hash_daily_means(df_daily_mean, station)[:16]}')
+
+            if key not in CLIM_CACHE:
+                cache_file = None if CLIM_CACHE_DIR is None else os.path.join(CLIM_CACHE_DIR, key + '.pkl')
+                if cache_file is not None and os.path.exists(cache_file):
+                    try:
+                        with open(cache_file, 'rb') as f:
+                            CLIM_CACHE[key] = pickle.load(f)
+                    except (pickle.UnpicklingError, EOFError, AttributeError, ImportError, IndexError,
+                            TypeError, ValueError):
+                        # A damaged cache file is computed again and replaced below
+                        print(f'Could not read {os.path.basename(cache_file)}; computing it again')
+                if key not in CLIM_CACHE:
+                    CLIM_CACHE[key] = compute_func(*bound.args, **bound.kwargs)
+                    if cache_file is not None:
+                        os.makedirs(CLIM_CACHE_DIR, exist_ok=True)
+                        # Replace the cache file only once it is fully written, so that an interrupted
+                        # run doesn't leave a truncated one
+                        with open(cache_file + '.tmp', 'wb') as f:
+                            pickle.dump(CLIM_CACHE[key], f)
+                        os.replace(cache_file + '.tmp', cache_file)
+
+            # Return a copy so that callers can't change the cached result
+            return copy.deepcopy(CLIM_CACHE[key])
+        return wrapper
+    return decorator
+
+
+def get_day_of_year_index(datetimes: pd.Series, leap_policy: str = 'fold') -> tuple:
+    """
+    Get the zero-based day of year of each date for computing daily climatologies
+    :param datetimes: datetimes of the observations
+    :param leap_policy: how to handle leap years. 'fold' uses the day of year and folds day 366 of leap
+    years into day 365. 'month_day' keys each date by its month and day, so that dates after Feb 28 line up
+    between leap and non-leap years and Feb 29 gets its own day (day 60 of 366)
+    :return: zero-based day of year of each date, day numbers of the climatology
+    """
+    datetimes = pd.DatetimeIndex(datetimes)
+    day_of_year = datetimes.dayofyear.to_numpy()
+
+    if leap_policy == 'fold':
+        day_of_year = np.minimum(day_of_year, 365)
+        num_days = 365
+    elif leap_policy == 'month_day':
+        # Number days as in a leap year
+        day_of_year = day_of_year + (~datetimes.is_leap_year & (datetimes.month > 2))
+        num_days = 366
+    else:
+        raise ValueError(f'leap_policy {leap_policy} not in [fold, month_day]')
+
+    return day_of_year - 1, np.arange(1, num_days + 1)
 
-        if add_cast_sst and i == 0:
-            image_name = f'{station.lower()}_daily_mean_ts_{depth}m_SST.png'
-        else:
-            image_name = f'{station.lower()}_daily_mean_ts_{depth}m.png'
-        plt.savefig(os.path.join(output_dir, image_name))
-        plt.close(fig)
-    return
 
+def compute_clim_stats(df_daily_mean: pd.DataFrame, station: str, leap_policy: str = 'fold',
+                       compute_std: bool = False) -> tuple:
+    """
+    Compute the mean, number of observations and optionally standard deviation of the daily means in
+    the climatology years by variable, bin and day of year. All are reduced together with bincount
+    :param df_daily_mean: pandas dataframe containing daily mean data
+    :param station: name of station
+    :param leap_policy: how to handle leap years, see get_day_of_year_index()
+    :param compute_std: compute the standard deviation (ddof=1 like pandas) as well
+    :return: day of the year, dict of 'mean', 'count' and (if compute_std) 'std' arrays with
+    shape (variable [Temperature, Salinity], bin, day of year)
+    """
+    bin_depths = BIN_INFO[station]['bin_depths']
+    start_year, end_year = CLIM_YEARS[station]
 
-def compute_daily_clim(df_daily_mean: pd.DataFrame, station: str) -> tuple:
+    day_index, days_of_year = get_day_of_year_index(df_daily_mean['Datetime'], leap_policy)
+    num_keys = len(days_of_year)
+
+    years = pd.DatetimeIndex(df_daily_mean['Datetime']).year.to_numpy()
+    year_range_mask = (start_year <= years) & (years <= end_year)
+
+    # Offset the day of year key for each column so that all depths and both variables are reduced at once
+    columns = [f'{var}_{depth}m' for var in ['Temperature', 'Salinity'] for depth in bin_depths]
+    values = df_daily_mean.loc[year_range_mask, columns].to_numpy(dtype=float).ravel()
+    column_key = (day_index[year_range_mask, np.newaxis] + np.arange(len(columns)) * num_keys).ravel()
+    # Skip nans like pandas mean() does
+    valid = ~np.isnan(values)
+    values = values[valid]
+    column_key = column_key[valid]
+
+    shape = (2, len(bin_depths), num_keys)
+    counts = np.bincount(column_key, minlength=len(columns) * num_keys)
+    sums = np.bincount(column_key, weights=values, minlength=len(columns) * num_keys)
+    # Days without any data get nan
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts
+        clim_stats = {'mean': means.reshape(shape), 'count': counts.reshape(shape)}
+        if compute_std:
+            sq_dev = np.bincount(column_key, weights=(values - means[column_key]) ** 2,
+                                 minlength=len(columns) * num_keys)
+            # Need at least two observations for a standard deviation
+            clim_stats['std'] = np.sqrt(np.where(counts > 1, sq_dev, np.nan) / (counts - 1)).reshape(shape)
+
+    return days_of_year, clim_stats
+
+
+@cache_climatology('daily_clim')
+def compute_daily_clim(df_daily_mean: pd.DataFrame, station: str, leap_policy: str = 'fold') -> tuple:
     """
     Compute climatology for temperature and salinity using the climatology years specified for
     each station in the global variable CLIM_YEARS
     :param station: name of station
     :param df_daily_mean: pandas dataframe containing daily mean data
+    :param leap_policy: how to handle leap years, see get_day_of_year_index()
     :return: day of the year, daily temperature climatology, daily salinity climatology,
     start year of the climatology, end year of the climatology
     """
-    days_of_year = np.arange(1, 365 + 1)
-    df_daily_mean['Day_of_year'] = np.array(
-        [
-            x.timetuple().tm_yday for x in df_daily_mean.loc[:, 'Datetime']
-        ]
-    )
-
     start_year, end_year = CLIM_YEARS[station]
 
-    year_range_mask = np.array(
-        [
-            start_year <= x.year <= end_year for x in df_daily_mean.loc[:, 'Datetime']
-        ]
-    )
+    days_of_year, clim_stats = compute_clim_stats(df_daily_mean, station, leap_policy)
+    daily_clim_T, daily_clim_S = clim_stats['mean']
 
-    # Initialize arrays for containing temperature and salinity climatological values
-    daily_clim_T = np.zeros((len(BIN_INFO[station]['bin_depths']), len(days_of_year)))
-    daily_clim_S = np.zeros((len(BIN_INFO[station]['bin_depths']), len(days_of_year)))
+    return days_of_year, daily_clim_T, daily_clim_S, start_year, end_year
 
-    # Populate the daily climatology array
-    for i, depth in enumerate(BIN_INFO[station]['bin_depths']):
-        for day_num in days_of_year:
-            day_num_mask = df_daily_mean.loc[:, 'Day_of_year'].to_numpy() == day_num
 
-            daily_clim_T[i, day_num - 1] = df_daily_mean.loc[
-                day_num_mask & year_range_mask, f'Temperature_{depth}m'
-            ].mean()
-            daily_clim_S[i, day_num - 1] = df_daily_mean.loc[
-                day_num_mask & year_range_mask, f'Salinity_{depth}m'
-            ].mean()
+def render_daily_clim_figure(days_of_year: np.ndarray, daily_clim_T: np.ndarray, daily_clim_S: np.ndarray,
+                             range_T: tuple, range_S: tuple, station: str, depth: int, output_file: str):
+    """
+    Plot daily climatology for one bin depth
+    :param days_of_year: day of the year
+    :param daily_clim_T: daily temperature climatology of the bin
+    :param daily_clim_S: daily salinity climatology of the bin
+    :param range_T: y axis limits for temperature
+    :param range_S: y axis limits for salinity
+    :param station: name of station
+    :param depth: bin depth
+    :param output_file: full path of the png file to save the plot to
+    :return:
+    """
+    fig, ax = plt.subplots(2, figsize=(10, 7), sharex=True)
+
+    ax[0].plot(days_of_year, daily_clim_T, c='tab:red',
+               label='Temperature Climatology')
+    ax[1].plot(days_of_year, daily_clim_S, c='tab:blue',
+               label='Salinity Climatology')
 
-    return days_of_year, daily_clim_T, daily_clim_S, start_year, end_year
+    ax[0].legend(loc='upper left', scatterpoints=3)
+    ax[1].legend(loc='upper left', scatterpoints=3)
 
+    ax[0].set_ylabel('Temperature (C)')
+    ax[1].set_ylabel('Salinity (PSS-78)')
 
-def plot_daily_clim(df_daily_mean: pd.DataFrame, output_dir: str, station: str):
+    ax[0].set_ylim(range_T)
+    ax[1].set_ylim(range_S)
+
+    ax[1].set_xlabel('Day of Year')
+
+    # Make ticks point inward and on all sides
+    for ax_j in [0, 1]:
+        ax[ax_j].tick_params(which='major', direction='in',
+                             bottom=True, top=True, left=True, right=True)
+        ax[ax_j].tick_params(which='minor', direction='in',
+                             bottom=True, top=True, left=True, right=True)
+
+    # Save figure
+    standard_plot_title(station, depth)
+
+    plt.tight_layout()
+    plt.savefig(output_file, metadata=PNG_METADATA)
+    plt.close(fig)
+    return
+
+
+def daily_clim_figure_jobs(df_daily_mean: pd.DataFrame, output_dir: str, station: str) -> list:
     """
-    Plot daily climatology for 1990-2020
+    Make the figure jobs for plotting daily climatology, one per bin depth
     :param station: name of station
     :param df_daily_mean: pandas dataframe containing the daily mean observations
     :param output_dir: directory to save the plots to
-    :return:
+    :return: list of figure jobs for render_figures()
     """
     days_of_year, daily_clim_T, daily_clim_S, start_year, end_year = compute_daily_clim(
         df_daily_mean, station
@@ -716,101 +1385,126 @@ def plot_daily_clim(df_daily_mean: pd.DataFrame, output_dir: str, station: str):
     range_T = (np.nanmin(daily_clim_T) - 0.5, np.nanmax(daily_clim_T) + 0.5)
     range_S = (np.nanmin(daily_clim_S) - 0.5, np.nanmax(daily_clim_S) + 0.5)
 
-    for i, depth in enumerate(BIN_INFO[station]['bin_depths']):
-        fig, ax = plt.subplots(2, figsize=(10, 7), sharex=True)
-
-        ax[0].plot(days_of_year, daily_clim_T[i, :], c='tab:red',
-                   label='Temperature Climatology')
-        ax[1].plot(days_of_year, daily_clim_S[i, :], c='tab:blue',
-                   label='Salinity Climatology')
-
-        ax[0].legend(loc='upper left', scatterpoints=3)
-        ax[1].legend(loc='upper left', scatterpoints=3)
-
-        ax[0].set_ylabel('Temperature (C)')
-        ax[1].set_ylabel('Salinity (PSS-78)')
-
-        ax[0].set_ylim(range_T)
-        ax[1].set_ylim(range_S)
-
-        ax[1].set_xlabel('Day of Year')
-
-        # Make ticks point inward and on all sides
-        for ax_j in [0, 1]:
-            ax[ax_j].tick_params(which='major', direction='in',
-                                 bottom=True, top=True, left=True, right=True)
-            ax[ax_j].tick_params(which='minor', direction='in',
-                                 bottom=True, top=True, left=True, right=True)
-
-        # Save figure
-        standard_plot_title(station, depth)
+    return [
+        (render_daily_clim_figure,
+         {'days_of_year': days_of_year, 'daily_clim_T': daily_clim_T[i, :], 'daily_clim_S': daily_clim_S[i, :],
+          'range_T': range_T, 'range_S': range_S, 'station': station, 'depth': depth,
+          'output_file': os.path.join(
+              output_dir, f'{station.lower()}_daily_clim_{start_year}-{end_year}_ts_{depth}m.png'
+          )})
+        for i, depth in enumerate(BIN_INFO[station]['bin_depths'])
+    ]
 
-        plt.tight_layout()
-        plt.savefig(
-            os.path.join(
-                output_dir,
-                f'{station.lower()}_daily_clim_{start_year}-{end_year}_ts_{depth}m.png'
-            )
-        )
-        plt.close(fig)
 
+def plot_daily_clim(df_daily_mean: pd.DataFrame, output_dir: str, station: str):
+    """
+    Plot daily climatology for 1990-2020
+    :param station: name of station
+    :param df_daily_mean: pandas dataframe containing the daily mean observations
+    :param output_dir: directory to save the plots to
+    :return:
+    """
+    render_figures(daily_clim_figure_jobs(df_daily_mean, output_dir, station))
     return
 
 
-def compute_daily_anom(df_daily_mean: pd.DataFrame, station: str) -> pd.DataFrame:
+@cache_climatology('daily_anom')
+def compute_daily_anom(df_daily_mean: pd.DataFrame, station: str, leap_policy: str = 'fold') -> pd.DataFrame:
     """
     Compute daily mean anomalies from daily mean data and daily climatologies
     :param station: name of station
     :param df_daily_mean: pandas dataframe containing the daily mean observations
+    :param leap_policy: how to handle leap years, see get_day_of_year_index()
     :return: pandas dataframe containing the daily mean anomalies
     """
     # Compute daily climatologies
     days_of_year, daily_clim_T, daily_clim_S, start_year, end_year = compute_daily_clim(
-        df_daily_mean, station
+        df_daily_mean, station, leap_policy=leap_policy
     )
 
-    df_daily_mean['Day_of_year'] = np.array(
-        [
-            x.timetuple().tm_yday for x in df_daily_mean.loc[:, 'Datetime']
-        ]
-    )
+    day_index, _ = get_day_of_year_index(df_daily_mean['Datetime'], leap_policy)
 
     # Initialize dataframe to hold anomaly data
     df_anom = df_daily_mean.copy(deep=True)
     for col in df_anom.columns:
         if col != 'Datetime':
-            df_anom.loc[:, col] = np.repeat(np.nan, len(df_anom))
+            df_anom[col] = np.nan
 
-    # Subtract the daily climatologies from the daily mean data
+    # Subtract the daily climatologies from the daily mean data by looking up the
+    # climatology of each row's day of year
     for i, depth in enumerate(BIN_INFO[station]['bin_depths']):
-        # Iterate through the days of year in 1-365
-        for day_num in days_of_year:
-            # Create a mask for the day of year
-            day_mask = df_daily_mean.loc[:, 'Day_of_year'].to_numpy() == day_num
-            # Index day-1 because day starts at 1 and python indexing starts at zero
-            df_anom.loc[
-                day_mask, f'Temperature_{depth}m'
-            ] = df_daily_mean.loc[:, f'Temperature_{depth}m'] - daily_clim_T[i, day_num - 1]
-            df_anom.loc[
-                day_mask, f'Salinity_{depth}m'
-            ] = df_daily_mean.loc[:, f'Salinity_{depth}m'] - daily_clim_S[i, day_num - 1]
+        df_anom[f'Temperature_{depth}m'] = (
+                df_daily_mean[f'Temperature_{depth}m'].to_numpy(dtype=float) - daily_clim_T[i, day_index]
+        )
+        df_anom[f'Salinity_{depth}m'] = (
+                df_daily_mean[f'Salinity_{depth}m'].to_numpy(dtype=float) - daily_clim_S[i, day_index]
+        )
 
     return df_anom
 
 
-def plot_daily_anom(df_daily_mean: pd.DataFrame, output_dir: str, station: str):
+def render_daily_anom_figure(datetimes: np.ndarray, daily_anom_T: np.ndarray, daily_anom_S: np.ndarray,
+                             range_T: tuple, range_S: tuple, station: str, depth: int, output_file: str):
     """
-    Plot the daily mean anomalies
+    Plot the daily mean anomalies for one bin depth
+    :param datetimes: dates in datetime format
+    :param daily_anom_T: daily mean temperature anomalies of the bin
+    :param daily_anom_S: daily mean salinity anomalies of the bin
+    :param range_T: y axis limits for temperature
+    :param range_S: y axis limits for salinity
     :param station: name of station
-    :param df_daily_mean: pandas dataframe containing daily mean data
-    :param output_dir: directory to save the plots to
+    :param depth: bin depth
+    :param output_file: full path of the png file to save the plot to
     :return:
     """
-    df_anom = compute_daily_anom(df_daily_mean, station)
+    fig, ax = plt.subplots(2, figsize=(10, 7), sharex=True)
 
-    # Make plots for separate depths
+    ax[0].scatter(datetimes, daily_anom_T,
+                  c='tab:red', marker='.', s=2, label='Temperature Anomalies')
+    ax[1].scatter(datetimes, daily_anom_S,
+                  c='tab:blue', marker='.', s=2, label='Salinity Anomalies')
 
-    # Make the ranges centred on zero
+    ax[0].set_ylabel('Temperature (C)')
+    ax[1].set_ylabel('Salinity (PSS-78)')
+
+    ax[0].set_ylim(range_T)
+    ax[1].set_ylim(range_S)
+
+    # ax[0].set_title('Temperature Anomalies')
+    # ax[1].set_title('Salinity Anomalies')
+
+    ax[0].legend(loc='upper left', scatterpoints=3)
+    ax[1].legend(loc='upper left', scatterpoints=3)
+
+    # Make ticks point inward and on all sides
+    for ax_j in [0, 1]:
+        ax[ax_j].tick_params(which='major', direction='in',
+                             bottom=True, top=True, left=True, right=True)
+        ax[ax_j].tick_params(which='minor', direction='in',
+                             bottom=True, top=True, left=True, right=True)
+
+        ax[ax_j].set_xlim((PLOT_DATES[station][0], PLOT_DATES[station][1]))
+
+    # Save figure
+    standard_plot_title(station, depth)
+
+    plt.tight_layout()
+    plt.savefig(output_file, metadata=PNG_METADATA)
+    plt.close(fig)
+    return
+
+
+def daily_anom_figure_jobs(df_daily_mean: pd.DataFrame, output_dir: str, station: str) -> list:
+    """
+    Make the figure jobs for plotting the daily mean anomalies, one per bin depth
+    :param station: name of station
+    :param df_daily_mean: pandas dataframe containing daily mean data
+    :param output_dir: directory to save the plots to
+    :return: list of figure jobs for render_figures()
+    """
+    df_anom = compute_daily_anom(df_daily_mean, station)
+
+    # Make the ranges centred on zero
     T_columns = [f'Temperature_{d}m' for d in BIN_INFO[station]['bin_depths']]
     S_columns = [f'Salinity_{d}m' for d in BIN_INFO[station]['bin_depths']]
     abs_max_T = np.nanmax(
@@ -822,44 +1516,32 @@ def plot_daily_anom(df_daily_mean: pd.DataFrame, output_dir: str, station: str):
     range_T = (-abs_max_T - 0.5, abs_max_T + 0.5)
     range_S = (-abs_max_S - 0.5, abs_max_S + 0.5)
 
-    for i, depth in enumerate(BIN_INFO[station]['bin_depths']):
-        fig, ax = plt.subplots(2, figsize=(10, 7), sharex=True)
-
-        ax[0].scatter(df_anom.loc[:, 'Datetime'], df_anom.loc[:, f'Temperature_{depth}m'],
-                      c='tab:red', marker='.', s=2, label='Temperature Anomalies')
-        ax[1].scatter(df_anom.loc[:, 'Datetime'], df_anom.loc[:, f'Salinity_{depth}m'],
-                      c='tab:blue', marker='.', s=2, label='Salinity Anomalies')
-
-        ax[0].set_ylabel('Temperature (C)')
-        ax[1].set_ylabel('Salinity (PSS-78)')
-
-        ax[0].set_ylim(range_T)
-        ax[1].set_ylim(range_S)
-
-        # ax[0].set_title('Temperature Anomalies')
-        # ax[1].set_title('Salinity Anomalies')
-
-        ax[0].legend(loc='upper left', scatterpoints=3)
-        ax[1].legend(loc='upper left', scatterpoints=3)
+    datetimes = df_anom['Datetime'].to_numpy()
 
-        # Make ticks point inward and on all sides
-        for ax_j in [0, 1]:
-            ax[ax_j].tick_params(which='major', direction='in',
-                                 bottom=True, top=True, left=True, right=True)
-            ax[ax_j].tick_params(which='minor', direction='in',
-                                 bottom=True, top=True, left=True, right=True)
-
-            ax[ax_j].set_xlim((PLOT_DATES[station][0], PLOT_DATES[station][1]))
+    # Make plots for separate depths
+    return [
+        (render_daily_anom_figure,
+         {'datetimes': datetimes, 'daily_anom_T': df_anom[f'Temperature_{depth}m'].to_numpy(),
+          'daily_anom_S': df_anom[f'Salinity_{depth}m'].to_numpy(),
+          'range_T': range_T, 'range_S': range_S, 'station': station, 'depth': depth,
+          'output_file': os.path.join(output_dir, f'{station.lower()}_daily_anom_ts_{depth}m.png')})
+        for depth in BIN_INFO[station]['bin_depths']
+    ]
 
-        # Save figure
-        standard_plot_title(station, depth)
 
-        plt.tight_layout()
-        plt.savefig(os.path.join(output_dir, f'{station.lower()}_daily_anom_ts_{depth}m.png'))
-        plt.close(fig)
+def plot_daily_anom(df_daily_mean: pd.DataFrame, output_dir: str, station: str):
+    """
+    Plot the daily mean anomalies
+    :param station: name of station
+    :param df_daily_mean: pandas dataframe containing daily mean data
+    :param output_dir: directory to save the plots to
+    :return:
+    """
+    render_figures(daily_anom_figure_jobs(df_daily_mean, output_dir, station))
     return
 
 
+@cache_climatology('monthly_means')
 def compute_monthly_means(df_daily_mean: pd.DataFrame, station: str) -> tuple:
     """
     Compute monthly means from daily means
@@ -867,47 +1549,96 @@ def compute_monthly_means(df_daily_mean: pd.DataFrame, station: str) -> tuple:
     :param df_daily_mean: pandas dataframe containing daily mean observations
     :return: month numbers, monthly mean temperature data, monthly mean salinity data
     """
-    months = np.arange(1, 12 + 1)
-    num_months = len(months)
+    num_months = 12
+    bin_depths = BIN_INFO[station]['bin_depths']
 
     # Get all unique years
-    unique_years = np.unique([dt.year for dt in df_daily_mean.loc[:, 'Datetime']])
-    unique_years.sort()
+    datetimes = pd.DatetimeIndex(df_daily_mean['Datetime'])
+    unique_years = np.unique(datetimes.year)
+    num_keys = len(unique_years) * num_months
+
+    # Combine year and month into a single integer key so that all months
+    # are reduced together in one pass over the data with bincount
+    key = np.searchsorted(unique_years, datetimes.year) * num_months + datetimes.month.to_numpy() - 1
+
+    unique_months = pd.to_datetime(
+        {'year': np.repeat(unique_years, num_months), 'month': np.tile(np.arange(1, num_months + 1),
+                                                                        len(unique_years)), 'day': 1}
+    ).dt.to_pydatetime()
+
+    # Reduce all depths and both variables at once by offsetting the key for each column
+    columns = [f'{var}_{depth}m' for var in ['Temperature', 'Salinity'] for depth in bin_depths]
+    values = df_daily_mean[columns].to_numpy(dtype=float).ravel()
+    column_key = (key[:, np.newaxis] + np.arange(len(columns)) * num_keys).ravel()
+    # Skip nans like pandas mean() does
+    valid = ~np.isnan(values)
+    sums = np.bincount(column_key[valid], weights=values[valid], minlength=len(columns) * num_keys)
+    counts = np.bincount(column_key[valid], minlength=len(columns) * num_keys)
+    # Months without any data get nan
+    with np.errstate(invalid='ignore'):
+        monthly_means = (sums / counts).reshape((len(columns), num_keys))
+
+    monthly_mean_T = monthly_means[:len(bin_depths), :]
+    monthly_mean_S = monthly_means[len(bin_depths):, :]
 
-    # Initialize array to hold the monthly mean data
-    monthly_mean_T = np.zeros((len(BIN_INFO[station]['bin_depths']), len(unique_years) * len(months)))
-    monthly_mean_S = np.zeros((len(BIN_INFO[station]['bin_depths']), len(unique_years) * len(months)))
+    return unique_months, monthly_mean_T, monthly_mean_S
 
-    init_dt_value = df_daily_mean.loc[0, 'Datetime']
-    unique_months = np.repeat(init_dt_value, len(unique_years) * len(months))
 
-    for j, year in enumerate(unique_years):
-        for k, month in enumerate(months):
-            unique_months[j * num_months + k] = datetime.datetime.fromisoformat(
-                '{}-{:02d}-01'.format(year, month)
-            )
-            # Iterate through the set depths
-            for i, depth in enumerate(BIN_INFO[station]['bin_depths']):
-                month_mask = [
-                    (dt.year == year) & (dt.month == month) for dt in df_daily_mean.loc[:, 'Datetime']
-                ]
-                monthly_mean_T[i, j * num_months + k] = df_daily_mean.loc[
-                    month_mask, f'Temperature_{depth}m'
-                ].mean()
-                monthly_mean_S[i, j * num_months + k] = df_daily_mean.loc[
-                    month_mask, f'Salinity_{depth}m'
-                ].mean()
+def render_monthly_means_figure(unique_months: np.ndarray, monthly_mean_T: np.ndarray,
+                                monthly_mean_S: np.ndarray, range_T: tuple, range_S: tuple,
+                                station: str, depth: int, output_file: str):
+    """
+    Plot monthly means for one bin depth
+    :param unique_months: first day of each month in datetime format
+    :param monthly_mean_T: monthly mean temperature data of the bin
+    :param monthly_mean_S: monthly mean salinity data of the bin
+    :param range_T: y axis limits for temperature
+    :param range_S: y axis limits for salinity
+    :param station: name of station
+    :param depth: bin depth
+    :param output_file: full path of the png file to save the plot to
+    :return:
+    """
+    fig, ax = plt.subplots(2, figsize=(10, 7), sharex=True)
 
-    return unique_months, monthly_mean_T, monthly_mean_S
+    ax[0].plot(unique_months, monthly_mean_T, c='tab:red', marker='o', markersize=2,
+               label='Monthly Mean Temperature')
+    ax[1].plot(unique_months, monthly_mean_S, c='tab:blue', marker='o', markersize=2,
+               label='Monthly Mean Salinity')
 
+    ax[0].set_ylabel('Temperature (C)')
+    ax[1].set_ylabel('Salinity (PSS-78)')
 
-def plot_monthly_means(df_daily_mean: pd.DataFrame, output_dir: str, station: str):
+    ax[0].set_ylim(range_T)
+    ax[1].set_ylim(range_S)
+
+    for ax_j in [0, 1]:
+        # Add legend
+        ax[ax_j].legend(loc='upper left')
+        # Make ticks point inward and on all sides
+        ax[ax_j].tick_params(which='major', direction='in',
+                             bottom=True, top=True, left=True, right=True)
+        ax[ax_j].tick_params(which='minor', direction='in',
+                             bottom=True, top=True, left=True, right=True)
+
+        ax[ax_j].set_xlim((PLOT_DATES[station][0], PLOT_DATES[station][1]))
+
+    # Save figure
+    standard_plot_title(station, depth)
+
+    plt.tight_layout()
+    plt.savefig(output_file, metadata=PNG_METADATA)
+    plt.close(fig)
+    return
+
+
+def monthly_means_figure_jobs(df_daily_mean: pd.DataFrame, output_dir: str, station: str) -> list:
     """
-    Plot monthly means computed from daily means
+    Make the figure jobs for plotting monthly means computed from daily means, one per bin depth
     :param station: name of station
     :param df_daily_mean: pandas dataframe containing daily mean observations
     :param output_dir: directory to save the plots to
-    :return:
+    :return: list of figure jobs for render_figures()
     """
     unique_months, monthly_mean_T, monthly_mean_S = compute_monthly_means(df_daily_mean, station)
 
@@ -915,40 +1646,29 @@ def plot_monthly_means(df_daily_mean: pd.DataFrame, output_dir: str, station: st
     range_S = (np.nanmin(monthly_mean_S) - 0.5, np.nanmax(monthly_mean_S) + 0.5)
 
     # Iterate through the binned depths
-    for i, depth in enumerate(BIN_INFO[station]['bin_depths']):
-        fig, ax = plt.subplots(2, figsize=(10, 7), sharex=True)
-
-        ax[0].plot(unique_months, monthly_mean_T[i, :], c='tab:red', marker='o', markersize=2,
-                   label='Monthly Mean Temperature')
-        ax[1].plot(unique_months, monthly_mean_S[i, :], c='tab:blue', marker='o', markersize=2,
-                   label='Monthly Mean Salinity')
-
-        ax[0].set_ylabel('Temperature (C)')
-        ax[1].set_ylabel('Salinity (PSS-78)')
-
-        ax[0].set_ylim(range_T)
-        ax[1].set_ylim(range_S)
-
-        for ax_j in [0, 1]:
-            # Add legend
-            ax[ax_j].legend(loc='upper left')
-            # Make ticks point inward and on all sides
-            ax[ax_j].tick_params(which='major', direction='in',
-                                 bottom=True, top=True, left=True, right=True)
-            ax[ax_j].tick_params(which='minor', direction='in',
-                                 bottom=True, top=True, left=True, right=True)
+    return [
+        (render_monthly_means_figure,
+         {'unique_months': unique_months, 'monthly_mean_T': monthly_mean_T[i, :],
+          'monthly_mean_S': monthly_mean_S[i, :],
+          'range_T': range_T, 'range_S': range_S, 'station': station, 'depth': depth,
+          'output_file': os.path.join(output_dir, f'{station.lower()}_monthly_mean_ts_{depth}m.png')})
+        for i, depth in enumerate(BIN_INFO[station]['bin_depths'])
+    ]
 
-            ax[ax_j].set_xlim((PLOT_DATES[station][0], PLOT_DATES[station][1]))
 
-        # Save figure
-        standard_plot_title(station, depth)
-
-        plt.tight_layout()
-        plt.savefig(os.path.join(output_dir, f'{station.lower()}_monthly_mean_ts_{depth}m.png'))
-        plt.close(fig)
+def plot_monthly_means(df_daily_mean: pd.DataFrame, output_dir: str, station: str):
+    """
+    Plot monthly means computed from daily means
+    :param station: name of station
+    :param df_daily_mean: pandas dataframe containing daily mean observations
+    :param output_dir: directory to save the plots to
+    :return:
+    """
+    render_figures(monthly_means_figure_jobs(df_daily_mean, output_dir, station))
     return
 
 
+@cache_climatology('monthly_clim')
 def compute_monthly_clim(df_daily_mean: pd.DataFrame, station: str) -> tuple:
     """
     Compute monthly climatologies for temperature and salinity using daily mean data
@@ -971,23 +1691,74 @@ def compute_monthly_clim(df_daily_mean: pd.DataFrame, station: str) -> tuple:
     monthly_clim_S = np.zeros((len(BIN_INFO[station]['bin_depths']), len(months)))
 
     for i, month in enumerate(months):
-        for j, depth in enumerate(BIN_INFO[station]['bin_depths']):
-            monthly_clim_T[j, i] = np.nanmean(monthly_mean_T[j, (month_only == month) & year_range_mask])
-            monthly_clim_S[j, i] = np.nanmean(monthly_mean_S[j, (month_only == month) & year_range_mask])
+        in_month = (month_only == month) & year_range_mask
+        for monthly_mean, monthly_clim in [(monthly_mean_T, monthly_clim_T), (monthly_mean_S, monthly_clim_S)]:
+            values = monthly_mean[:, in_month]
+            # Skip nans like nanmean() does, from the counts and sums of all the bins at once
+            valid = ~np.isnan(values)
+            # Months without any data get nan
+            with np.errstate(invalid='ignore'):
+                monthly_clim[:, i] = np.where(valid, values, 0).sum(axis=1) / valid.sum(axis=1)
 
     return months, monthly_clim_T, monthly_clim_S, start_year, end_year
 
 
-def plot_monthly_clim(df_daily_mean: pd.DataFrame, output_dir: str, station: str):
+def render_monthly_clim_figure(months: np.ndarray, monthly_clim_T: np.ndarray, monthly_clim_S: np.ndarray,
+                               range_T: tuple, range_S: tuple, station: str, depth: int, output_file: str):
     """
-    Plot monthly climatologies
+    Plot monthly climatologies for one bin depth
+    :param months: month numbers
+    :param monthly_clim_T: monthly temperature climatology of the bin
+    :param monthly_clim_S: monthly salinity climatology of the bin
+    :param range_T: y axis limits for temperature
+    :param range_S: y axis limits for salinity
     :param station: name of station
-    :param df_daily_mean: pandas dataframe containing daily mean observations
-    :param output_dir: directory to save plots to
+    :param depth: bin depth
+    :param output_file: full path of the png file to save the plot to
     :return:
     """
     xtick_labels = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
 
+    fig, ax = plt.subplots(2, figsize=(10, 7), sharex=True)
+
+    ax[0].plot(months, monthly_clim_T, c='tab:red',
+               label='Monthly Temperature Climatology')
+    ax[1].plot(months, monthly_clim_S, c='tab:blue',
+               label='Monthly Salinity Climatology')
+
+    ax[0].set_ylabel('Temperature (C)')
+    ax[1].set_ylabel('Salinity (PSS-78)')
+
+    ax[0].set_ylim(range_T)
+    ax[1].set_ylim(range_S)
+
+    ax[1].set_xticks(ticks=months, labels=xtick_labels, rotation=45)
+
+    for ax_j in [0, 1]:
+        # Add legend
+        ax[ax_j].legend(loc='upper left')
+        # Make ticks point inward and on all sides
+        ax[ax_j].tick_params(which='major', direction='in',
+                             bottom=True, top=True, left=True, right=True)
+        ax[ax_j].tick_params(which='minor', direction='in',
+                             bottom=True, top=True, left=True, right=True)
+
+    # Save figure
+    standard_plot_title(station, depth)
+    plt.tight_layout()
+    plt.savefig(output_file, metadata=PNG_METADATA)
+    plt.close(fig)
+    return
+
+
+def monthly_clim_figure_jobs(df_daily_mean: pd.DataFrame, output_dir: str, station: str) -> list:
+    """
+    Make the figure jobs for plotting monthly climatologies, one per bin depth
+    :param station: name of station
+    :param df_daily_mean: pandas dataframe containing daily mean observations
+    :param output_dir: directory to save plots to
+    :return: list of figure jobs for render_figures()
+    """
     months, monthly_clim_T, monthly_clim_S, start_year, end_year = compute_monthly_clim(
         df_daily_mean, station
     )
@@ -996,41 +1767,30 @@ def plot_monthly_clim(df_daily_mean: pd.DataFrame, output_dir: str, station: str
     range_S = (np.nanmin(monthly_clim_S) - 0.5, np.nanmax(monthly_clim_S) + 0.5)
 
     # Iterate through the binned depths
-    for i, depth in enumerate(BIN_INFO[station]['bin_depths']):
-        fig, ax = plt.subplots(2, figsize=(10, 7), sharex=True)
-
-        ax[0].plot(months, monthly_clim_T[i, :], c='tab:red',
-                   label='Monthly Temperature Climatology')
-        ax[1].plot(months, monthly_clim_S[i, :], c='tab:blue',
-                   label='Monthly Salinity Climatology')
-
-        ax[0].set_ylabel('Temperature (C)')
-        ax[1].set_ylabel('Salinity (PSS-78)')
-
-        ax[0].set_ylim(range_T)
-        ax[1].set_ylim(range_S)
-
-        ax[1].set_xticks(ticks=months, labels=xtick_labels, rotation=45)
+    return [
+        (render_monthly_clim_figure,
+         {'months': months, 'monthly_clim_T': monthly_clim_T[i, :], 'monthly_clim_S': monthly_clim_S[i, :],
+          'range_T': range_T, 'range_S': range_S, 'station': station, 'depth': depth,
+          'output_file': os.path.join(
+              output_dir, f'{station.lower()}_monthly_clim_{start_year}-{end_year}_ts_{depth}m.png'
+          )})
+        for i, depth in enumerate(BIN_INFO[station]['bin_depths'])
+    ]
 
-        for ax_j in [0, 1]:
-            # Add legend
-            ax[ax_j].legend(loc='upper left')
-            # Make ticks point inward and on all sides
-            ax[ax_j].tick_params(which='major', direction='in',
-                                 bottom=True, top=True, left=True, right=True)
-            ax[ax_j].tick_params(which='minor', direction='in',
-                                 bottom=True, top=True, left=True, right=True)
 
-        # Save figure
-        standard_plot_title(station, depth)
-        plt.tight_layout()
-        plt.savefig(
-            os.path.join(output_dir, f'{station.lower()}_monthly_clim_{start_year}-{end_year}_ts_{depth}m.png')
-        )
-        plt.close(fig)
+def plot_monthly_clim(df_daily_mean: pd.DataFrame, output_dir: str, station: str):
+    """
+    Plot monthly climatologies
+    :param station: name of station
+    :param df_daily_mean: pandas dataframe containing daily mean observations
+    :param output_dir: directory to save plots to
+    :return:
+    """
+    render_figures(monthly_clim_figure_jobs(df_daily_mean, output_dir, station))
     return
 
 
+@cache_climatology('monthly_anom')
 def compute_monthly_anom(df_daily_mean: pd.DataFrame, station: str) -> tuple:
     """
     Compute monthly mean anomalies from daily mean data
@@ -1058,13 +1818,60 @@ def compute_monthly_anom(df_daily_mean: pd.DataFrame, station: str) -> tuple:
     return unique_months, monthly_anom_T, monthly_anom_S
 
 
-def plot_monthly_anom(df_daily_mean: pd.DataFrame, output_dir: str, station: str):
+def render_monthly_anom_figure(unique_months: np.ndarray, monthly_anom_T: np.ndarray,
+                               monthly_anom_S: np.ndarray, range_T: tuple, range_S: tuple,
+                               station: str, depth: int, output_file: str):
     """
-    Plot monthly mean anomalies by variable
+    Plot monthly mean anomalies for one bin depth
+    :param unique_months: first day of each month in datetime format
+    :param monthly_anom_T: monthly mean temperature anomalies of the bin
+    :param monthly_anom_S: monthly mean salinity anomalies of the bin
+    :param range_T: y axis limits for temperature
+    :param range_S: y axis limits for salinity
+    :param station: name of station
+    :param depth: bin depth
+    :param output_file: full path of the png file to save the plot to
+    :return:
+    """
+    fig, ax = plt.subplots(2, figsize=(10, 7), sharex=True)
+
+    ax[0].plot(unique_months, monthly_anom_T, c='tab:red', marker='o', markersize=2,
+               label='Monthly Mean Temperature')
+    ax[1].plot(unique_months, monthly_anom_S, c='tab:blue', marker='o', markersize=2,
+               label='Monthly Mean Salinity')
+
+    ax[0].set_ylabel('Temperature (C)')
+    ax[1].set_ylabel('Salinity (PSS-78)')
+
+    ax[0].set_ylim(range_T)
+    ax[1].set_ylim(range_S)
+
+    for ax_j in [0, 1]:
+        # Add legend
+        ax[ax_j].legend(loc='upper left')
+        # Make ticks point inward and on all sides
+        ax[ax_j].tick_params(which='major', direction='in',
+                             bottom=True, top=True, left=True, right=True)
+        ax[ax_j].tick_params(which='minor', direction='in',
+                             bottom=True, top=True, left=True, right=True)
+
+        ax[ax_j].set_xlim((PLOT_DATES[station][0], PLOT_DATES[station][1]))
+
+    # Save figure
+    standard_plot_title(station, depth)
+    plt.tight_layout()
+    plt.savefig(output_file, metadata=PNG_METADATA)
+    plt.close(fig)
+    return
+
+
+def monthly_anom_figure_jobs(df_daily_mean: pd.DataFrame, output_dir: str, station: str) -> list:
+    """
+    Make the figure jobs for plotting monthly mean anomalies by variable, one per bin depth
     :param station: name of station
     :param df_daily_mean: pandas dataframe containing daily mean observations
     :param output_dir: directory to save plots to
-    :return:
+    :return: list of figure jobs for render_figures()
     """
     unique_months, monthly_anom_T, monthly_anom_S = compute_monthly_anom(df_daily_mean, station)
 
@@ -1075,70 +1882,81 @@ def plot_monthly_anom(df_daily_mean: pd.DataFrame, output_dir: str, station: str
     range_S = (-abs_max_S - 0.5, abs_max_S + 0.5)
 
     # Iterate through the binned depths
-    for i, depth in enumerate(BIN_INFO[station]['bin_depths']):
-        fig, ax = plt.subplots(2, figsize=(10, 7), sharex=True)
+    return [
+        (render_monthly_anom_figure,
+         {'unique_months': unique_months, 'monthly_anom_T': monthly_anom_T[i, :],
+          'monthly_anom_S': monthly_anom_S[i, :],
+          'range_T': range_T, 'range_S': range_S, 'station': station, 'depth': depth,
+          'output_file': os.path.join(output_dir, f'{station.lower()}_monthly_anom_ts_{depth}m.png')})
+        for i, depth in enumerate(BIN_INFO[station]['bin_depths'])
+    ]
 
-        ax[0].plot(unique_months, monthly_anom_T[i, :], c='tab:red', marker='o', markersize=2,
-                   label='Monthly Mean Temperature')
-        ax[1].plot(unique_months, monthly_anom_S[i, :], c='tab:blue', marker='o', markersize=2,
-                   label='Monthly Mean Salinity')
 
-        ax[0].set_ylabel('Temperature (C)')
-        ax[1].set_ylabel('Salinity (PSS-78)')
+def plot_monthly_anom(df_daily_mean: pd.DataFrame, output_dir: str, station: str):
+    """
+    Plot monthly mean anomalies by variable
+    :param station: name of station
+    :param df_daily_mean: pandas dataframe containing daily mean observations
+    :param output_dir: directory to save plots to
+    :return:
+    """
+    render_figures(monthly_anom_figure_jobs(df_daily_mean, output_dir, station))
+    return
 
-        ax[0].set_ylim(range_T)
-        ax[1].set_ylim(range_S)
 
-        for ax_j in [0, 1]:
-            # Add legend
-            ax[ax_j].legend(loc='upper left')
-            # Make ticks point inward and on all sides
-            ax[ax_j].tick_params(which='major', direction='in',
-                                 bottom=True, top=True, left=True, right=True)
-            ax[ax_j].tick_params(which='minor', direction='in',
-                                 bottom=True, top=True, left=True, right=True)
+def get_range_mask(depth: np.ndarray, values: np.ndarray, df_range: pd.DataFrame) -> np.ndarray:
+    """
+    Check observations against a table of acceptable ranges by depth band.
+    Each observation is matched to its depth band with a single np.searchsorted, and the
+    band minimum and maximum are gathered for comparison
+    :param depth: observation depths
+    :param values: observation values
+    :param df_range: range table with columns Depth_min, Depth_max, Coast_N_Pacific_min and
+    Coast_N_Pacific_max, in which the depth bands do not overlap
+    :return: boolean mask that is True where the values are within range
+    """
+    df_range = df_range.sort_values(by='Depth_min')
+    depth_min = df_range['Depth_min'].to_numpy(dtype=float)
+    depth_max = df_range['Depth_max'].to_numpy(dtype=float)
+    if any(depth_min[1:] < depth_max[:-1]):
+        raise ValueError('Depth bands in QC range table overlap')
 
-            ax[ax_j].set_xlim((PLOT_DATES[station][0], PLOT_DATES[station][1]))
+    # Index of the last band starting at or above each depth; -1 if above the first band
+    band = np.searchsorted(depth_min, depth, side='right') - 1
+    # Depths in a gap between bands or below the last band are out of range,
+    # as are nan depths which are sorted to the end
+    band_clipped = np.clip(band, 0, None)
+    in_band = (band >= 0) & (depth < depth_max[band_clipped])
 
-        # Save figure
-        standard_plot_title(station, depth)
-        plt.tight_layout()
-        plt.savefig(os.path.join(output_dir, f'{station.lower()}_monthly_anom_ts_{depth}m.png'))
-        plt.close(fig)
-    return
+    value_min = df_range['Coast_N_Pacific_min'].to_numpy(dtype=float)[band_clipped]
+    value_max = df_range['Coast_N_Pacific_max'].to_numpy(dtype=float)[band_clipped]
+    return in_band & (values >= value_min) & (values <= value_max)
 
 
-def quality_control(df: pd.DataFrame) -> pd.DataFrame:
+def quality_control(df: pd.DataFrame, range_files: dict = None) -> pd.DataFrame:
     """
     Apply quality control on acceptable data ranges from WOD18 surface
     :param df: pandas dataframe containing the raw observations
+    :param range_files: dictionary of variable name and name of the range table file in QC_ranges/
+    to check it against; defaults to QC_RANGE_FILES. Any number of variables can be checked,
+    e.g., oxygen once a range table is added for it
     :return: pandas dataframe containing the quality-controlled data
     """
+    if range_files is None:
+        range_files = QC_RANGE_FILES
+
     parent_dir = os.path.dirname(os.getcwd())
-    df_range_T = pd.read_csv(parent_dir + '\\QC_ranges\\wod18_ranges_TEMP_Coast_N_Pac.csv')
-    df_range_S = pd.read_csv(parent_dir + '\\QC_ranges\\wod18_ranges_PSAL_Coast_N_Pac.csv')
-
-    mask_range_T = np.array([False] * len(df))
-    mask_range_S = np.array([False] * len(df))
-
-    for i in range(len(df_range_T)):
-        mask = ((df['Depth'].values >= df_range_T.loc[i, 'Depth_min']) &
-                (df['Depth'].values < df_range_T.loc[i, 'Depth_max']) &
-                (df['Temperature'].values >= df_range_T.loc[i, 'Coast_N_Pacific_min']) &
-                (df['Temperature'].values <= df_range_T.loc[i, 'Coast_N_Pacific_max']))
-        mask_range_T = mask_range_T | mask
-
-    for i in range(len(df_range_S)):
-        mask = ((df['Depth'].values >= df_range_S.loc[i, 'Depth_min']) &
-                (df['Depth'].values < df_range_S.loc[i, 'Depth_max']) &
-                (df['Salinity'].values >= df_range_S.loc[i, 'Coast_N_Pacific_min']) &
-                (df['Salinity'].values <= df_range_S.loc[i, 'Coast_N_Pacific_max']))
-        mask_range_S = mask_range_S | mask
-
-    # Apply the masks
-    df.loc[~mask_range_T, 'Temperature'] = np.nan
-    df.loc[~mask_range_S, 'Salinity'] = np.nan
-    df_qc = df.reset_index(drop=True)
+    depth = df['Depth'].to_numpy(dtype=float)
+
+    for var, range_file in range_files.items():
+        df_range = pd.read_csv(os.path.join(parent_dir, 'QC_ranges', range_file))
+        mask_range = get_range_mask(depth, df[var].to_numpy(dtype=float), df_range)
+        # Apply the mask
+        df.loc[~mask_range, var] = np.nan
+
+    # In place so that the observations aren't copied
+    df.reset_index(drop=True, inplace=True)
+    df_qc = df
 
     # range_T = (-2.1, 35)
     # range_S = (0, 40)
@@ -1150,82 +1968,567 @@ def quality_control(df: pd.DataFrame) -> pd.DataFrame:
     return df_qc
 
 
-def get_raw_data(data_dir: str, station: str):
+def read_station_data(data_dir: str, station: str, inst: str, columns: list = None,
+                      csv_file: str = None) -> pd.DataFrame:
+    """
+    Read the converted current meter or CTD data for a station. Data are read from the columnar
+    station data store if it exists in data_dir, otherwise from the csv file.
+    :param data_dir: local directory in which the ctd and current meter data are kept
+    :param station: name of station
+    :param inst: instrument type, "cur" or "ctd"
+    :param columns: only read these columns; all columns are read if None
+    :param csv_file: name of the csv file in data_dir if not {station}_{inst}_data.csv
+    :return: pandas dataframe containing the observations
+    """
+    inst_dir = os.path.join(data_dir, STORE_DIR_NAME, f'station={station.lower()}', f'instrument={inst}')
+    if os.path.isdir(inst_dir):
+        if columns is None:
+            columns = RAW_COLUMNS
+        # The store also holds typed observation times, so that they don't need to be parsed
+        if 'Date' in columns:
+            columns = columns + ['Datetime']
+        df = pd.read_parquet(inst_dir, columns=columns)
+        # Parts are read back by year partition, then by file name within each year
+        df.reset_index(drop=True, inplace=True)
+        return df
+
+    if csv_file is None:
+        csv_file = f'{station.lower()}_{inst}_data.csv'
+    return pd.read_csv(data_dir + csv_file, usecols=columns)
+
+
+def get_merge_mask(station: str, df: pd.DataFrame, is_cur: np.ndarray) -> np.ndarray:
+    """
+    Select the observations that make up the merged dataset for a station, in which
+    current meter and CTD data don't overlap in depth and time
+    :param station: name of station
+    :param df: pandas dataframe containing all current meter and CTD observations, with dates
+    in YYYY-mm-dd format
+    :param is_cur: boolean mask that is True for current meter observations
+    :return: boolean mask that is True for observations in the merged dataset
+    """
+    if station == 'E01':
+        # Only keep current meter data before 2007 since 2008 is when CTD data start
+        return ~is_cur | (df['Date'].to_numpy() < '2007')
+    elif station == 'A1':
+        # 2008-04-29 is when the next deployment starts containing the first CTD
+        return ~is_cur | (df['Date'].to_numpy() <= '2008-04-03')
+    elif station in ['SCOTT2', 'HAK1', 'SRN1', 'CHAT3', 'JUAN2', 'SCOTT3']:
+        # Don't use any of the current meter data, as it covers the same time and
+        # depths as the CTD data
+        return ~is_cur
+    else:
+        # Use all cur and ctd data since they don't overlap, e.g., BP1 and E03
+        return np.ones(len(df), dtype=bool)
+
+
+def get_station_data_files(data_dir: str, station: str) -> list:
+    """
+    List the files that load_raw_data() reads the current meter and CTD data of a station from
+    :param data_dir: local directory in which the ctd and current meter data are kept
+    :param station: name of station
+    :return: paths of the existing data files
+    """
+    data_files = []
+    for inst in ['cur', 'ctd']:
+        inst_dir = os.path.join(data_dir, STORE_DIR_NAME, f'station={station.lower()}', f'instrument={inst}')
+        if os.path.isdir(inst_dir):
+            data_files += glob.glob(os.path.join(inst_dir, '**', '*.parquet'), recursive=True)
+        elif station == 'E01' and inst == 'cur':
+            data_files.append(data_dir + f'{station.lower()}_cur_data_all.csv')
+        else:
+            data_files.append(data_dir + f'{station.lower()}_{inst}_data.csv')
+    return sorted(f for f in data_files if os.path.exists(f))
+
+
+def get_static_depths(filenames: pd.Series, catalog_file: str = None) -> np.ndarray:
+    """
+    Get the nominal instrument depth of each observation from the catalog entry of its file, looking up
+    each file once rather than parsing the file name of every row
+    :param filenames: Filename column of the observations
+    :param catalog_file: catalog of the file names, see file_catalog.py
+    :return: array of the depths in m
+    """
+    file_codes, unique_files = pd.factorize(filenames)
+    depths = get_file_entries(unique_files, catalog_file)['depth'].to_numpy(dtype=float)
+    for i in np.flatnonzero(np.isnan(depths)):
+        # Names that the catalog can't parse, e.g. with an invalid date, still have the depth in the 4th part
+        try:
+            depths[i] = int(os.path.basename(unique_files[i]).split('_')[3][:4])
+        except (IndexError, ValueError):
+            raise ValueError(f'Could not get the instrument depth of file {unique_files[i]} from its name')
+    return depths.astype(int)[file_codes]
+
+
+def load_raw_data(data_dir: str, station: str, columns: list = None, report: 'RunReport' = None) -> tuple:
+    """
+    Load all the current meter and CTD data of a station, with datetimes and static instrument depths added
+    :param data_dir: local directory in which the ctd and current meter data are kept in csv format
+    :param station: name of station
+    :param columns: only read these columns from the data files, e.g., DAILY_MEAN_COLUMNS;
+    all columns are read if None
+    :param report: RunReport to measure reading the files and adding the datetimes in; not measured if None
+    :return: dataframe containing all available current meter and CTD data, boolean mask that is True
+    for current meter observations. If station has not been added here then the function will return nothing
+    """
+    if station == 'E01':
+        # Special case: includes the current meter file converted from netCDF
+        cur_csv_file = f'{station.lower()}_cur_data_all.csv'
+    elif station in ['A1', 'SCOTT2', 'HAK1', 'SRN1', 'CHAT3', 'JUAN2', 'SCOTT3', 'BP1', 'E03']:
+        cur_csv_file = None
+    else:
+        print('Station', station, 'not supported in get_raw_data() ! Exiting')
+        return
+
+    def measure(stage):
+        return contextlib.nullcontext({}) if report is None else report.measure(stage)
+
+    with measure('read_data_files') as record:
+        cur_data_all = read_station_data(data_dir, station, 'cur', columns, csv_file=cur_csv_file)
+        ctd_data = read_station_data(data_dir, station, 'ctd', columns)
+        record['rows'] = len(cur_data_all) + len(ctd_data)
+    is_cur = np.concatenate((np.ones(len(cur_data_all), dtype=bool), np.zeros(len(ctd_data), dtype=bool)))
+
+    df_all = pd.concat((cur_data_all, ctd_data))
+    df_all.reset_index(drop=True, inplace=True)
+    # Free the per-instrument copies before the rest of the processing
+    del cur_data_all, ctd_data
+
+    with measure('add_datetime') as record:
+        # Add datetime-format date for plotting ease
+        df_all_dt = add_datetime(df_all)
+
+        # Add static instrument depth column
+        df_all_dt['Depth_static'] = get_static_depths(df_all_dt['Filename'], get_catalog_file(data_dir))
+        record['rows'] = len(df_all_dt)
+
+    return df_all_dt, is_cur
+
+
+def get_raw_data(data_dir: str, station: str, columns: list = None):
     """
     Get dataframes of raw data for the selected station.
     Also return a flag to plot cast sst data if station==E01.
     Apply a quick quality check on the temperature and salinity ranges.
+    The current meter and CTD data are loaded and checked once, and the merged dataset is
+    selected from them with the station's merge rule in get_merge_mask()
     :param data_dir: local directory in which the ctd and current meter data are kept in csv format
     :param station: name of station
+    :param columns: only read these columns from the data files, e.g., DAILY_MEAN_COLUMNS;
+    all columns are read if None
     :return: dataframe containing merged dataset (no overlapping current meter and CTD data) and
     dataframe containing all available current meter and CTD data regardless of whether they overlap
     in depth and time. If station has not been added here then the function will return nothing
     """
+    raw_data = load_raw_data(data_dir, station, columns)
+    if raw_data is None:
+        return
+    df_all_dt, is_cur = raw_data
 
-    if station == 'E01':
-        # Special case
-        file_list = [data_dir + f'{station.lower()}_cur_data_all.csv',
-                     data_dir + f'{station.lower()}_ctd_data.csv']
+    # Assign each observation to a depth bin once for all downstream functions
+    df_all_dt = add_bin_index(df_all_dt, station)
 
-        # Only keep current meter data before 2007 since 2008 is when CTD data start
-        cur_data_all = pd.read_csv(file_list[0])
-        cur_data_pre2007 = cur_data_all.loc[cur_data_all['Date'].to_numpy() < '2007', :]
-        df_merged = pd.concat((cur_data_pre2007, pd.read_csv(file_list[1])))
+    # Do brief QC on TS ranges
+    df_all_qc = quality_control(df_all_dt)
 
-        # Reset the index in the dataframe
-        df_merged.reset_index(drop=True, inplace=True)
+    # Select the merged dataset from the full one
+    merge_mask = get_merge_mask(station, df_all_qc, is_cur)
+    df_qc = df_all_qc.loc[merge_mask, :].reset_index(drop=True)
 
-        df_all = pd.concat((cur_data_all, pd.read_csv(file_list[1])))
-        df_all.reset_index(drop=True, inplace=True)
+    return df_qc, df_all_qc
 
-    elif station == 'A1':
-        # Special case
-        file_list = [data_dir + f'{station.lower()}_cur_data.csv',
-                     data_dir + f'{station.lower()}_ctd_data.csv']
-        cur_data_all = pd.read_csv(file_list[0])
-        # 2008-04-29 is when the next deployment starts containing the first CTD
-        cur_data_pre20080403 = cur_data_all.loc[cur_data_all['Date'].to_numpy() <= '2008-04-03']
-        df_merged = pd.concat((cur_data_pre20080403, pd.read_csv(file_list[1])))
-        # Reset the index in the dataframe
-        df_merged.reset_index(drop=True, inplace=True)
 
-        df_all = pd.concat((cur_data_all, pd.read_csv(file_list[1])))
-        df_all.reset_index(drop=True, inplace=True)
+def read_daily_means(daily_means_file: str) -> pd.DataFrame:
+    """
+    Read the daily means saved by compute_daily_means()
+    :param daily_means_file: full path of the daily means csv file
+    :return: pandas dataframe containing the daily means, with datetime64 dates in the Datetime column
+    """
+    df_daily_means = pd.read_csv(daily_means_file)
+    # Fix formatting, extract only YYYY-mm-dd, may be separated from HH:MM:SS by ' ' or 'T'
+    df_daily_means['Datetime'] = pd.to_datetime(df_daily_means['Datetime'].str[:10], format='%Y-%m-%d')
+    return df_daily_means
 
-    elif station in ['SCOTT2', 'HAK1', 'SRN1', 'CHAT3', 'JUAN2', 'SCOTT3']:
-        # Don't use any of the current meter data, as it covers the same time and
-        # depths as the CTD data
-        file_list = [data_dir + f'{station.lower()}_cur_data.csv',
-                     data_dir + f'{station.lower()}_ctd_data.csv']
-        df_merged = pd.read_csv(file_list[1])
-
-        df_all = pd.concat((pd.read_csv(file_list[0]), df_merged))
-        df_all.reset_index(drop=True, inplace=True)
-    elif station in ['BP1', 'E03']:
-        # Use all cur and ctd data since they don't overlap
-        file_list = [data_dir + f'{station.lower()}_cur_data.csv',
-                     data_dir + f'{station.lower()}_ctd_data.csv']
-        df_merged = pd.concat((pd.read_csv(file_list[0]), pd.read_csv(file_list[1])))
-        df_merged.reset_index(drop=True, inplace=True)
-
-        df_all = df_merged.copy()
-    else:
-        print('Station', station, 'not supported in get_raw_data() ! Exiting')
+
+def get_cpu_time() -> float:
+    """
+    :return: user and system CPU time in seconds of this process and of its child processes that have finished,
+    e.g. figure rendering workers (child process times are only available on Unix)
+    """
+    return sum(os.times()[:4])
+
+
+def get_peak_rss():
+    """
+    :return: peak resident set size of this process in MB, or None if it can't be measured
+    (on Windows, psutil is needed)
+    """
+    if resource is not None:
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+        return peak_rss / 1024 ** 2 if sys.platform == 'darwin' else peak_rss / 1024
+    elif psutil is not None:
+        return psutil.Process().memory_info().peak_wset / 1024 ** 2
+    return None
+
+
+def get_rss():
+    """
+    :return: current resident set size of this process in MB, or None if it can't be measured
+    (psutil is needed except on Linux)
+    """
+    if psutil is not None:
+        return psutil.Process().memory_info().rss / 1024 ** 2
+    elif os.path.exists('/proc/self/statm'):
+        with open('/proc/self/statm', 'r') as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+    return None
+
+
+class RssSampler:
+    """
+    Sample the resident set size of this process in a background thread while a stage runs, to find the
+    peak memory use of the stage itself rather than of the process so far. Peaks shorter than
+    RSS_SAMPLE_INTERVAL may be missed
+    """
+    def __init__(self):
+        self.start_rss = get_rss()
+        self.peak_rss = self.start_rss
+        self.stop_event = threading.Event()
+        self.thread = None
+        if self.start_rss is not None:
+            self.thread = threading.Thread(target=self.sample, daemon=True)
+            self.thread.start()
+
+    def sample(self):
+        while not self.stop_event.wait(RSS_SAMPLE_INTERVAL):
+            self.peak_rss = max(self.peak_rss, get_rss())
         return
 
-    # Add datetime-format date for plotting ease
-    df_dt = add_datetime(df_merged)
-    df_all_dt = add_datetime(df_all)
+    def stop(self):
+        """
+        Stop sampling, including a last sample at the end of the stage
+        :return:
+        """
+        if self.thread is not None:
+            self.stop_event.set()
+            self.thread.join()
+            self.peak_rss = max(self.peak_rss, get_rss())
+        return
 
-    # Add static instrument depth column
-    df_dt['Depth_static'] = [int(os.path.basename(x).split('_')[3][:4]) for x in df_dt['Filename']]
-    df_all_dt['Depth_static'] = [int(os.path.basename(x).split('_')[3][:4]) for x in df_all_dt['Filename']]
 
-    # Do brief QC on TS ranges
-    df_qc = quality_control(df_dt)
-    df_all_qc = quality_control(df_all_dt)
+def count_rows(output) -> int:
+    """
+    Count the rows of the output of a stage
+    :param output: output of a stage, see StationStages.compute()
+    :return: number of rows of the dataframe in the output, or None if it has none
+    """
+    if isinstance(output, tuple):
+        output = output[0]
+    if isinstance(output, pd.DataFrame):
+        return len(output)
+    return None
 
-    return df_qc, df_all_qc
+
+class RunReport:
+    """
+    Record the wall time, CPU time, rows processed and memory use of each stage of a run_plot() run,
+    to find where the time of a slow run goes and how much memory a station needs.
+    Stages are measured with measure() and the report is saved as a JSON file with save().
+    The memory use of each stage is recorded as:
+    start_rss_mb: resident set size of the process at the start of the stage
+    stage_peak_rss_mb: highest resident set size sampled during the stage, see RssSampler
+    peak_rss_increase_mb: how much the stage raised the peak resident set size of the process, which is
+    0 for stages that use less memory than an earlier one
+    The MB fields are None where they can't be measured
+    """
+    def __init__(self, station: str):
+        """
+        :param station: name of station
+        """
+        self.station = station
+        self.start_time = datetime.datetime.now()
+        self.stages = []
+
+    @contextlib.contextmanager
+    def measure(self, stage: str, **info):
+        """
+        Measure a stage, e.g.
+        with report.measure('daily_means') as record:
+            record['rows'] = len(df)
+        Stages measured inside another stage are recorded separately and are also included in its times
+        :param stage: name of stage
+        :param info: other information to record about the stage, e.g. source='saved'
+        :return: dict of the record of the stage, to add the number of rows processed to
+        """
+        record = {'stage': stage, 'rows': None, **info}
+        start_peak_rss = get_peak_rss()
+        rss_sampler = RssSampler()
+        start_wall_time = time.perf_counter()
+        start_cpu_time = get_cpu_time()
+        try:
+            yield record
+        finally:
+            record['wall_time_s'] = round(time.perf_counter() - start_wall_time, 3)
+            record['cpu_time_s'] = round(get_cpu_time() - start_cpu_time, 3)
+            rss_sampler.stop()
+            end_peak_rss = get_peak_rss()
+            record['start_rss_mb'] = None if rss_sampler.start_rss is None else round(rss_sampler.start_rss, 1)
+            record['stage_peak_rss_mb'] = None if rss_sampler.peak_rss is None else round(rss_sampler.peak_rss, 1)
+            record['peak_rss_increase_mb'] = (None if end_peak_rss is None else
+                                              round(end_peak_rss - start_peak_rss, 1))
+            self.stages.append(record)
+
+    def save(self, report_dir: str) -> str:
+        """
+        Save the report as {station}_run_report_{start time}.json so that reports of earlier runs are kept
+        :param report_dir: directory to save the report in
+        :return: full path of the report file
+        """
+        os.makedirs(report_dir, exist_ok=True)
+        report_file = os.path.join(
+            report_dir, f'{self.station.lower()}_run_report_{self.start_time.strftime("%Y%m%dT%H%M%S")}.json'
+        )
+        report = {
+            'station': self.station,
+            'start_time': self.start_time.isoformat(timespec='seconds'),
+            'total_wall_time_s': round((datetime.datetime.now() - self.start_time).total_seconds(), 3),
+            # Peak over the life of the process, which may include earlier runs
+            'process_peak_rss_mb': get_peak_rss(),
+            'stages': self.stages
+        }
+        with open(report_file, 'w') as f:
+            json.dump(report, f, indent=1)
+        return report_file
+
+
+class StationStages:
+    """
+    Compute the data products of a station as a graph of stages, given in the global variable STAGE_INPUTS:
+    raw -> qc -> binned -> coverage cube, daily means -> climatologies and anomalies.
+    Each stage has a fingerprint of its inputs: the size and modification time of the data files it reads,
+    the fingerprints of the stages it is computed from, and its settings. Stage outputs are saved with their
+    fingerprint and only computed again when the fingerprint changes, or if asked for, so requesting a
+    product only computes the stages upstream of it that are missing or out of date. Outputs are also kept in
+    STAGE_OUTPUTS so that each input is loaded once per process.
+    Where stage outputs are saved:
+    raw, qc, binned: not saved, they are the current meter and CTD observations themselves. qc and binned
+    change the observations in place, so there is only one copy of them in memory
+    coverage_cube, daily_means: the files in the station's data directory, as before
+    climatologies and anomalies: by the climatology cache, see cache_climatology()
+    """
+    def __init__(self, station: str, raw_data_dir: str, avg_data_dir: str, cache_dir: str,
+                 recompute: list = None, report: RunReport = None, columns: list = None):
+        """
+        :param station: name of station
+        :param raw_data_dir: full path to where the csv-format current meter and CTD data are stored
+        :param avg_data_dir: directory of the station's daily means
+        :param cache_dir: directory to save stage outputs and their fingerprints to
+        :param recompute: names of stages to compute again even if their saved outputs are up to date
+        :param report: run report to measure the stages that are computed or loaded in
+        :param columns: only read these columns of the raw data, e.g. DAILY_MEAN_COLUMNS if only the daily means
+        are computed from the observations; all columns are read if None
+        """
+        self.station = station
+        self.raw_data_dir = raw_data_dir
+        self.avg_data_dir = avg_data_dir
+        self.cache_dir = cache_dir
+        self.recompute = set() if recompute is None else set(recompute)
+        self.manifest_file = os.path.join(cache_dir, f'{station.lower()}_stage_manifest.json')
+        self.fingerprints = {}
+        self.report = RunReport(station) if report is None else report
+        self.columns = columns
+
+    def input_files(self, stage: str) -> list:
+        """
+        :param stage: name of stage
+        :return: the files the stage reads besides the outputs of other stages
+        """
+        if stage == 'raw':
+            return get_station_data_files(self.raw_data_dir, self.station)
+        elif stage == 'qc':
+            parent_dir = os.path.dirname(os.getcwd())
+            return [os.path.join(parent_dir, 'QC_ranges', range_file) for range_file in QC_RANGE_FILES.values()]
+        return []
+
+    def settings(self, stage: str):
+        """
+        :param stage: name of stage
+        :return: the settings that the output of the stage depends on
+        """
+        if stage == 'binned':
+            return BIN_INFO[self.station]
+        elif stage in ['daily_clim', 'daily_anom', 'monthly_clim', 'monthly_anom', 'monthly_means']:
+            return [CLIM_YEARS.get(self.station), CLIM_CACHE_VERSION]
+        return None
+
+    def fingerprint(self, stage: str):
+        """
+        Fingerprint the inputs of a stage without computing them
+        :param stage: name of stage
+        :return: hex digest, or None if the raw data are not available to fingerprint
+        """
+        if stage not in self.fingerprints:
+            input_files = self.input_files(stage)
+            upstream = [self.fingerprint(input_stage) for input_stage in STAGE_INPUTS[stage]]
+
+            if (stage == 'raw' and len(input_files) == 0) or None in upstream:
+                self.fingerprints[stage] = None
+            else:
+                file_stats = [(f, os.stat(f).st_size, os.stat(f).st_mtime_ns) for f in input_files]
+                fingerprint_input = [stage, self.station, STAGE_CACHE_VERSION, upstream, file_stats,
+                                     self.settings(stage)]
+                self.fingerprints[stage] = hashlib.sha256(json.dumps(fingerprint_input).encode()).hexdigest()
+        return self.fingerprints[stage]
+
+    def output_file(self, stage: str):
+        """
+        :param stage: name of stage
+        :return: the file the output of the stage is saved to, or None if it's not saved by this class
+        """
+        if stage == 'coverage_cube':
+            return os.path.join(self.avg_data_dir, f'{self.station.lower()}_coverage_cube.npz')
+        elif stage == 'daily_means':
+            return os.path.join(self.avg_data_dir, f'{self.station.lower()}_daily_mean_TS_data.csv')
+        return None
+
+    def load_manifest(self) -> dict:
+        """
+        :return: dict of stage name: fingerprint of the saved stage output
+        """
+        if not os.path.exists(self.manifest_file):
+            return {}
+        with open(self.manifest_file, 'r') as f:
+            return json.load(f)
+
+    def save_fingerprint(self, stage: str):
+        """
+        Record the fingerprint of a stage output that has just been saved
+        :param stage: name of stage
+        :return:
+        """
+        manifest = self.load_manifest()
+        manifest[stage] = self.fingerprint(stage)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(self.manifest_file + '.tmp', 'w') as f:
+            json.dump(manifest, f, indent=1, sort_keys=True)
+        os.replace(self.manifest_file + '.tmp', self.manifest_file)
+        return
+
+    def is_saved(self, stage: str) -> bool:
+        """
+        :param stage: name of stage
+        :return: True if the saved output of the stage is up to date and can be loaded instead of computed
+        """
+        output_file = self.output_file(stage)
+        fingerprint = self.fingerprint(stage)
+        # Saved outputs can't be checked if the raw data aren't available, so use them as they are
+        return (output_file is not None and os.path.exists(output_file) and stage not in self.recompute and
+                (fingerprint is None or self.load_manifest().get(stage) == fingerprint))
+
+    def get(self, stage: str):
+        """
+        Get the output of a stage, computing it and any stages upstream of it if needed
+        :param stage: name of stage
+        :return: output of the stage
+        """
+        key = (self.station, stage, self.fingerprint(stage))
+        if stage in OBSERVATION_STAGES:
+            # Observations read with fewer columns can't be used for more
+            key += (None if self.columns is None else tuple(self.columns),)
+        if key in STAGE_OUTPUTS and stage not in self.recompute:
+            return STAGE_OUTPUTS[key]
+
+        output_file = self.output_file(stage)
+        if self.is_saved(stage):
+            with self.report.measure(stage, source='saved') as record:
+                output = self.load(stage, output_file)
+                record['rows'] = count_rows(output)
+        else:
+            # Get the inputs first so that they are measured as their own stages
+            inputs = [self.get(input_stage) for input_stage in STAGE_INPUTS[stage]]
+            print(f'Computing {stage} stage ...')
+            with self.report.measure(stage, source='computed') as record:
+                output = self.compute(stage, *inputs)
+                # The rows processed are those of the input, or those read for the raw stage
+                record['rows'] = count_rows(inputs[0] if len(inputs) > 0 else output)
+                self.recompute.discard(stage)
+                if output_file is not None:
+                    self.save(stage, output, output_file)
+                    self.save_fingerprint(stage)
+            if stage in ['qc', 'binned']:
+                # The observations of the input stage were changed in place, so they are not its output anymore
+                self.release(STAGE_INPUTS[stage])
+
+        STAGE_OUTPUTS[key] = output
+        return output
+
+    def compute(self, stage: str, *inputs):
+        """
+        Compute the output of a stage. The qc and binned stages change the observations of their input stage
+        in place rather than copying them; the other stages don't change their inputs
+        :param stage: name of stage
+        :param inputs: outputs of the stages in STAGE_INPUTS[stage]
+        :return: output of the stage
+        """
+        if stage == 'raw':
+            return load_raw_data(self.raw_data_dir, self.station, self.columns, report=self.report)
+        elif stage == 'qc':
+            # Do brief QC on TS ranges
+            df_all, is_cur = inputs[0]
+            return quality_control(df_all), is_cur
+        elif stage == 'binned':
+            # Assign each observation to a depth bin once for all downstream functions
+            df_all_qc, is_cur = inputs[0]
+            return add_bin_index(df_all_qc, self.station), is_cur
+        elif stage == 'coverage_cube':
+            return compute_coverage_cube(inputs[0][0], self.station)
+        elif stage == 'daily_means':
+            # Select the merged dataset from the full one
+            df_all_qc, is_cur = inputs[0]
+            df_qc = df_all_qc.loc[get_merge_mask(self.station, df_all_qc, is_cur), :].reset_index(drop=True)
+            # Writes the daily means file
+            compute_daily_means(df_qc, self.avg_data_dir, self.station)
+            return read_daily_means(self.output_file(stage))
+        else:
+            # Climatologies and anomalies, e.g. compute_monthly_clim()
+            return globals()[f'compute_{stage}'](inputs[0], self.station)
+
+    def save(self, stage: str, output, output_file: str):
+        """
+        Save the output of a stage
+        :param stage: name of stage
+        :param output: output of the stage
+        :param output_file: file to save the output to
+        :return:
+        """
+        if stage == 'coverage_cube':
+            save_coverage_cube(output, self.avg_data_dir, self.station)
+        # The daily means file is written by compute_daily_means()
+        return
+
+    def load(self, stage: str, output_file: str):
+        """
+        Load the saved output of a stage
+        :param stage: name of stage
+        :param output_file: file the output was saved to
+        :return: output of the stage
+        """
+        if stage == 'coverage_cube':
+            return load_coverage_cube(self.avg_data_dir, self.station)
+        return read_daily_means(output_file)
+
+    def release(self, stages: list):
+        """
+        Drop the outputs of stages from STAGE_OUTPUTS to free memory, e.g. the large observation
+        dataframes once all products have been computed from them. Saved outputs are kept
+        :param stages: names of stages
+        :return:
+        """
+        for key in [key for key in STAGE_OUTPUTS if key[0] == self.station and key[1] in stages]:
+            del STAGE_OUTPUTS[key]
+        return
 
 
 def run_plot(
@@ -1242,7 +2545,12 @@ def run_plot(
         do_monthly_means: bool = False,
         do_monthly_clim: bool = False,
         do_monthly_anom: bool = False,
-        recompute_daily_means: bool = False
+        recompute_daily_means: bool = False,
+        recompute_coverage_cube: bool = False,
+        use_clim_cache: bool = True,
+        num_workers: int = 1,
+        use_figure_cache: bool = True,
+        save_run_report: bool = True
 ):
     """
     Main function to make plots of temperature, salinity, and oxygen.
@@ -1262,9 +2570,22 @@ def run_plot(
     :param do_monthly_anom: plot monthly mean anomalies
     :param do_monthly_clim: plot monthly mean climatologies
     :param do_monthly_means: plot monthly mean data
-    :param recompute_daily_means: override to compute daily means if the data already exist in a file
-    :return:
+    :param recompute_daily_means: override to compute daily means even if the daily means file is up to date
+    with the raw data
+    :param recompute_coverage_cube: override to count the observations for the monthly and annual availability
+    plots even if the counts file is up to date with the raw data
+    :param use_clim_cache: save climatologies, monthly means and anomalies in raw_data_dir/clim_cache/ and
+    reuse them in later runs if the daily means have not changed
+    :param num_workers: number of processes to render the daily mean, climatology and anomaly figures with
+    :param use_figure_cache: only re-render the daily mean, climatology and anomaly figures whose inputs changed
+    since they were last rendered, according to figures/figure_cache_manifest.json
+    :param save_run_report: save the wall time, CPU time, rows processed and peak memory of each stage of the run
+    to raw_data_dir/run_reports/ as JSON, see RunReport
+    :return: the run report
     """
+    global CLIM_CACHE_DIR
+    CLIM_CACHE_DIR = os.path.join(raw_data_dir, 'clim_cache') if use_clim_cache else None
+
     old_dir = os.getcwd()
     new_dir = os.path.join(os.path.dirname(old_dir), station.lower())
 
@@ -1275,103 +2596,114 @@ def run_plot(
     # Flag for plotting cast SST data on top of daily mean 35m E01 data
     add_cast_sst = True if station == 'E01' else False
 
+    # The daily mean, climatology and anomaly figures are independent, so collect them
+    # and render them all together at the end
+    figure_jobs = []
+
+    report = RunReport(station)
+
     if do_instrument_depths:
-        if use_wget_csv_file:
-            wget_csv_file = raw_data_dir.replace(
-                'csv_data\\', f'wget_file_download_list_{station.lower()}.csv'
-            )
-            plot_instrument_depths(figures_dir, station, wget_csv_file=wget_csv_file)
-        else:
-            shell_data_dir = raw_data_dir.replace('csv_data', 'ios_shell_data')
-            plot_instrument_depths(figures_dir, station, shell_data_dir=shell_data_dir)
+        with report.measure('plot_instrument_depths'):
+            if use_wget_csv_file:
+                wget_csv_file = raw_data_dir.replace(
+                    'csv_data\\', f'wget_file_download_list_{station.lower()}.csv'
+                )
+                plot_instrument_depths(figures_dir, station, wget_csv_file=wget_csv_file)
+            else:
+                shell_data_dir = raw_data_dir.replace('csv_data', 'ios_shell_data')
+                plot_instrument_depths(figures_dir, station, shell_data_dir=shell_data_dir)
+
+    # Compute the data products from the stage graph, so that the raw data are only loaded if a
+    # product that depends on them is missing or out of date, and then only once
+    recompute = []
+    if recompute_daily_means:
+        recompute.append('daily_means')
+    if recompute_coverage_cube:
+        recompute.append('coverage_cube')
+    stages = StationStages(station, raw_data_dir, avg_data_dir, os.path.join(raw_data_dir, 'stage_cache'),
+                           recompute, report)
+    # Only read the columns the daily means need, unless the observations are plotted or counted
+    # for the coverage cube too, which need the oxygen data as well
+    if not (do_raw_by_inst or ((do_monthly_avail or do_annual_avail) and not stages.is_saved('coverage_cube'))):
+        stages.columns = DAILY_MEAN_COLUMNS
+
+    if do_raw_by_inst:
+        print('Plotting raw data by instrument ...')
+        df_all_qc, is_cur = stages.get('binned')
+        with report.measure('plot_raw_by_inst', rows=len(df_all_qc)):
+            plot_raw_TS_by_inst(df_all_qc, figures_dir, station)
 
-    if any([do_monthly_avail, do_annual_avail, do_raw_by_inst]):
-        # Get the raw data
-        df_qc, df_all_qc = get_raw_data(raw_data_dir, station)
+    if do_monthly_avail or do_annual_avail:
+        coverage_cube = stages.get('coverage_cube')
 
         if do_monthly_avail:
             print('Plotting monthly data availability ...')
-            for var in VARS:
-                plot_monthly_samp_freq(df_all_qc, var, figures_dir, station)
+            with report.measure('plot_monthly_avail'):
+                for var in VARS:
+                    plot_monthly_samp_freq(coverage_cube, var, figures_dir, station)
 
         if do_annual_avail:
             print('Plotting annual data availability ...')
-            for var in VARS:
-                plot_annual_samp_freq(df_all_qc, var, figures_dir, station)
+            with report.measure('plot_annual_avail'):
+                for var in VARS:
+                    plot_annual_samp_freq(coverage_cube, var, figures_dir, station)
 
-        if do_raw_by_inst:
-            print('Plotting raw data by instrument ...')
-            plot_raw_TS_by_inst(df_all_qc, figures_dir, station)
-
-    if do_daily_means:
-        print('Plotting daily mean data ...')
-        daily_means_file = os.path.join(avg_data_dir, f'{station.lower()}_daily_mean_TS_data.csv')
-
-        if not os.path.exists(daily_means_file) or recompute_daily_means:
-            # Get the raw data
-            df_qc, df_all_qc = get_raw_data(raw_data_dir, station)
-            # Compute daily means from raw data
-            unique_datetimes, daily_means_T, daily_means_S = compute_daily_means(
-                df_qc, avg_data_dir, station
-            )
-        else:
-            df_daily_means = pd.read_csv(daily_means_file)
+    if any([do_daily_means, do_daily_clim, do_daily_anom, do_monthly_means, do_monthly_clim, do_monthly_anom]):
+        df_daily_means = stages.get('daily_means')
 
-            # Fix formatting - convert from string/object to datetime.datetime
-            unique_datetimes = df_daily_means.loc[:, 'Datetime'].to_numpy()
-            unique_datetimes = [
-                datetime.datetime.fromisoformat(x.split(' ')[0]) for x in unique_datetimes
-            ]
+        if do_daily_means:
+            print('Plotting daily mean data ...')
             T_columns = [f'Temperature_{d}m' for d in BIN_INFO[station]['bin_depths']]
             S_columns = [f'Salinity_{d}m' for d in BIN_INFO[station]['bin_depths']]
             daily_means_T = df_daily_means.loc[:, T_columns].to_numpy().T
             daily_means_S = df_daily_means.loc[:, S_columns].to_numpy().T
 
-        plot_daily_means(unique_datetimes, daily_means_T, daily_means_S, figures_dir, station,
-                         add_cast_sst)
-
-    if any([do_daily_clim, do_daily_anom, do_monthly_means, do_monthly_clim, do_monthly_anom]):
-        # Make daily means file if not already existing
-        daily_means_file = os.path.join(avg_data_dir, f'{station.lower()}_daily_mean_TS_data.csv')
-
-        if not os.path.exists(daily_means_file) or recompute_daily_means:
-            # Get the raw data
-            df_dt, df_all_dt = get_raw_data(raw_data_dir, station)
-            # Compute daily means from raw data
-            unique_datetimes, daily_means_T, daily_means_S = compute_daily_means(
-                df_dt, avg_data_dir, station
-            )
-        df_daily_means = pd.read_csv(daily_means_file)
-        # Fix formatting, extract only YYYY-mm-dd, may be separated from HH:MM:SS by ' ' or 'T'
-        df_daily_means.loc[:, 'Datetime'] = [
-            datetime.datetime.fromisoformat(x[:10]) for x in
-            df_daily_means['Datetime']
-        ]
+            figure_jobs += daily_means_figure_jobs(df_daily_means['Datetime'], daily_means_T, daily_means_S,
+                                                   figures_dir, station, add_cast_sst)
 
+        # The climatologies, monthly means and anomalies are computed while collecting their figure jobs,
+        # unless they are in the climatology cache
         if do_daily_clim:
             print('Plotting daily T and S climatologies ...')
-            plot_daily_clim(df_daily_means, figures_dir, station)
+            with report.measure('daily_clim', rows=len(df_daily_means)):
+                figure_jobs += daily_clim_figure_jobs(df_daily_means, figures_dir, station)
 
         if do_daily_anom:
             print('Plotting daily T and S anomalies ...')
-            plot_daily_anom(df_daily_means, figures_dir, station)
+            with report.measure('daily_anom', rows=len(df_daily_means)):
+                figure_jobs += daily_anom_figure_jobs(df_daily_means, figures_dir, station)
 
         if do_monthly_means:
             print('Plotting monthly mean T and S data ...')
-            plot_monthly_means(df_daily_means, figures_dir, station)
+            with report.measure('monthly_means', rows=len(df_daily_means)):
+                figure_jobs += monthly_means_figure_jobs(df_daily_means, figures_dir, station)
 
         if do_monthly_clim:
             print('Plotting monthly T and S climatologies ...')
-            plot_monthly_clim(df_daily_means, figures_dir, station)
+            with report.measure('monthly_clim', rows=len(df_daily_means)):
+                figure_jobs += monthly_clim_figure_jobs(df_daily_means, figures_dir, station)
 
         if do_monthly_anom:
             print('Plotting monthly mean T and S anomalies ...')
-            plot_monthly_anom(df_daily_means, figures_dir, station)
+            with report.measure('monthly_anom', rows=len(df_daily_means)):
+                figure_jobs += monthly_anom_figure_jobs(df_daily_means, figures_dir, station)
+
+    if len(figure_jobs) > 0:
+        print(f'Rendering {len(figure_jobs)} figures ...')
+        with report.measure('render_figures', figures=len(figure_jobs)) as record:
+            record['figures_rendered'] = len(render_figures(figure_jobs, num_workers, use_figure_cache))
+
+    # Free the observation dataframes; products computed from them are kept
+    stages.release(['raw', 'qc', 'binned'])
+
+    if save_run_report:
+        report_file = report.save(os.path.join(raw_data_dir, RUN_REPORT_DIR_NAME))
+        print('Saved run report to', report_file)
 
     # Reset the current directory
     os.chdir(old_dir)
 
-    return
+    return report
 
 
 def test():
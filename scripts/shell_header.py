@@ -0,0 +1,115 @@
+import datetime
+
+"""
+Read the metadata of IOS Shell-format files from their headers only, without parsing the data records
+like ios_shell.ShellFile.fromfile() does, so that scanning many files only reads the first few kB of each
+"""
+
+# Header sections that are read by default
+HEADER_SECTIONS = ['FILE', 'LOCATION', 'INSTRUMENT']
+
+# Line that ends the header; the data records follow it
+END_OF_HEADER = '*END OF HEADER'
+
+
+def read_shell_header(filename: str, sections: list = None) -> dict:
+    """
+    Read the key-value lines of header sections of an IOS Shell file, e.g. "    STATION   : E01" in
+    *LOCATION. Reading stops once all the sections have been read, or at the end of the header.
+    Tables and other $ blocks within the sections are skipped
+    :param filename: full path to the IOS Shell file
+    :param sections: names of the sections to read, without the *; defaults to HEADER_SECTIONS
+    :return: dict of section name: dict of key: value as strings, for the sections found in the file
+    """
+    if sections is None:
+        sections = HEADER_SECTIONS
+
+    header = {}
+    section = None
+    in_block = False
+    # Older files aren't utf-8
+    with open(filename, 'r', encoding='latin-1') as f:
+        for line in f:
+            line = line.rstrip()
+            if line.startswith('*'):
+                if section in header and all(x in header for x in sections):
+                    # The last section needed has ended
+                    break
+                if line.startswith(END_OF_HEADER):
+                    break
+                name = line[1:].strip()
+                section = name if name in sections else None
+                if section is not None:
+                    header[section] = {}
+                in_block = False
+            elif section is not None:
+                stripped = line.strip()
+                if stripped.startswith('$END'):
+                    in_block = False
+                elif stripped.startswith('$'):
+                    in_block = True
+                elif not in_block and ':' in stripped:
+                    key, value = stripped.split(':', 1)
+                    # Drop trailing comments, e.g. "! (deg min)"
+                    header[section][key.strip()] = value.split('!')[0].strip()
+    return header
+
+
+def parse_float(value: str):
+    """
+    :param value: header value, e.g. "97" or "97.5 m"
+    :return: the first number in the value, or None if it doesn't start with one
+    """
+    try:
+        return float(value.split()[0])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+def parse_degrees(value: str):
+    """
+    Convert a latitude or longitude in degrees and decimal minutes, e.g. "49  17.00400 N", to decimal degrees
+    :param value: header value
+    :return: decimal degrees, negative for S and W, or None if the value can't be parsed
+    """
+    try:
+        degrees, minutes, hemisphere = value.split()[:3]
+        decimal_degrees = float(degrees) + float(minutes) / 60
+    except (AttributeError, ValueError):
+        return None
+    return -decimal_degrees if hemisphere.upper() in ['S', 'W'] else decimal_degrees
+
+
+def parse_time(value: str):
+    """
+    Parse a header time, e.g. "UTC 2019/06/11 20:00:00.000", ignoring the time zone
+    :param value: header value
+    :return: datetime.datetime, or None if the value can't be parsed
+    """
+    try:
+        date, time = value.split()[-2:]
+        return datetime.datetime.strptime(f'{date} {time[:8]}', '%Y/%m/%d %H:%M:%S')
+    except (AttributeError, ValueError):
+        return None
+
+
+def get_shell_metadata(filename: str) -> dict:
+    """
+    Get the metadata of an IOS Shell file from its *FILE, *LOCATION and *INSTRUMENT header sections
+    :param filename: full path to the IOS Shell file
+    :return: dict of station, latitude, longitude, water_depth, instrument_depth, start_time and end_time,
+    with None for any that are missing from the header
+    """
+    header = read_shell_header(filename)
+    file_info = header.get('FILE', {})
+    location = header.get('LOCATION', {})
+    instrument = header.get('INSTRUMENT', {})
+    return {
+        'station': location.get('STATION'),
+        'latitude': parse_degrees(location.get('LATITUDE')),
+        'longitude': parse_degrees(location.get('LONGITUDE')),
+        'water_depth': parse_float(location.get('WATER DEPTH')),
+        'instrument_depth': parse_float(instrument.get('DEPTH')),
+        'start_time': parse_time(file_info.get('START TIME')),
+        'end_time': parse_time(file_info.get('END TIME'))
+    }
@@ -0,0 +1,146 @@
+import os
+import numpy as np
+import pandas as pd
+from plot_moored_data import BIN_INFO
+
+"""
+Generate synthetic current meter and CTD data that look like the converted IOS shell files of a station,
+so that the processing functions can be run and timed without the real data, see benchmark_compute.py
+"""
+
+# Columns of the observations parsed from an IOS shell file, see convert_cur_ctd_from_shell.DF_VARS
+SHELL_VARS = ['Record_Number', 'Date', 'Time', 'Temperature', 'Salinity', 'Depth',
+              'Oxygen:Dissolved:SBE']
+
+# Pad values used in IOS shell files for missing data, by variable
+PAD_VALUES = {'Temperature': [32.767, -99.], 'Salinity': [2.233, -99.], 'Oxygen:Dissolved:SBE': [-99.]}
+
+# Depths in m of instruments that fall outside of all the bins of a station, e.g., A1 613m and E01 50m
+EXTRA_DEPTHS = {'E01': [50], 'A1': [613]}
+
+
+def format_times(times: pd.DatetimeIndex, date_format: str) -> tuple:
+    """
+    Format observation times as date and time strings, formatting each unique day and time of day only once
+    :param times: observation times
+    :param date_format: strftime format of the dates
+    :return: array of date strings, array of time strings in HH:MM:SS format
+    """
+    days = times.normalize()
+    day_codes, unique_days = pd.factorize(days)
+    time_codes, unique_times = pd.factorize(times - days)
+    dates = unique_days.strftime(date_format).to_numpy()[day_codes]
+    times_of_day = (pd.Timestamp(0) + unique_times).strftime('%H:%M:%S').to_numpy()[time_codes]
+    return dates, times_of_day
+
+
+def make_deployments(station: str, start_year: int = 1990, end_year: int = 2020, depths: list = None,
+                     cur_interval: int = 60, ctd_interval: int = 15, ctd_start_year: int = None,
+                     gap_fraction: float = 0.1, pad_fraction: float = 0.001, seed: int = 0) -> list:
+    """
+    Make synthetic observations of yearly instrument deployments at each depth of a station.
+    Current meters are deployed before ctd_start_year and CTDs after, with gaps between deployments, missed
+    deployments, and pad values like those in IOS shell files
+    :param station: name of station, for the file names and default depths
+    :param start_year: first year of data
+    :param end_year: last year of data
+    :param depths: instrument depths in m; defaults to the station's bin depths plus any instruments outside of
+    the bins in the global variable EXTRA_DEPTHS
+    :param cur_interval: sampling interval of the current meters in minutes
+    :param ctd_interval: sampling interval of the CTDs in minutes
+    :param ctd_start_year: year the CTDs replace the current meters; defaults to halfway through the years
+    :param gap_fraction: fraction of deployments that are missed, leaving a gap of a year at that depth
+    :param pad_fraction: fraction of values of each variable replaced by a pad value
+    :param seed: seed of the random number generator
+    :return: list of (file name, dataframe of observations in the format returned by ios_shell before
+    conversion, with the columns in SHELL_VARS)
+    """
+    rng = np.random.default_rng(seed)
+    if depths is None:
+        depths = BIN_INFO[station]['bin_depths'] + EXTRA_DEPTHS.get(station, [])
+    if ctd_start_year is None:
+        ctd_start_year = (start_year + end_year + 1) // 2
+
+    deployments = []
+    for year in range(start_year, end_year + 1):
+        for depth in depths:
+            if rng.random() < gap_fraction:
+                continue
+
+            is_cur = year < ctd_start_year
+            interval = cur_interval if is_cur else ctd_interval
+            # Deployments start in spring and last most of a year, leaving gaps of days to weeks between them
+            start = pd.Timestamp(year, 4, 1) + pd.Timedelta(days=int(rng.integers(0, 30)),
+                                                            minutes=int(rng.integers(0, interval)))
+            num_obs = int(pd.Timedelta(days=int(rng.integers(300, 360))) / pd.Timedelta(minutes=interval))
+            times = start + pd.to_timedelta(np.arange(num_obs) * interval, unit='min')
+
+            # Seasonal cycle that is weaker with depth, and salinity that increases with depth
+            phase = 2 * np.pi * (times.dayofyear.to_numpy() - 240) / 365.25
+            temperature = (8 + 4 * np.exp(-depth / 50) * np.cos(phase) - depth / 200 +
+                           rng.normal(0, 0.3, num_obs))
+            salinity = 31.5 + np.log1p(depth) / 2 + rng.normal(0, 0.1, num_obs)
+
+            # Older files have dates in YYYY/mm/dd format
+            dates, times_of_day = format_times(times, '%Y/%m/%d' if year < 2000 else '%Y-%m-%d')
+
+            obs_df = pd.DataFrame({
+                'Record_Number': np.arange(1, num_obs + 1, dtype=float),
+                'Date': dates,
+                'Time': times_of_day,
+                'Temperature': temperature,
+                'Salinity': salinity,
+                # Current meters have a static depth, CTDs a depth derived from pressure
+                'Depth': np.repeat(float(depth), num_obs) if is_cur else depth + rng.normal(0, 1, num_obs),
+                # No Oxygen in current meter files
+                'Oxygen:Dissolved:SBE': np.repeat(np.nan, num_obs) if is_cur else rng.normal(150, 30, num_obs)
+            })
+
+            for var, pads in PAD_VALUES.items():
+                is_pad = rng.random(num_obs) < pad_fraction
+                obs_df.loc[is_pad, var] = rng.choice(pads, is_pad.sum())
+
+            end = times[-1]
+            filename = f'{station}_{start:%Y%m%d}_{end:%Y%m%d}_{depth:04d}m_L2.{"CUR" if is_cur else "ctd"}'
+            deployments.append((filename, obs_df))
+    return deployments
+
+
+def make_station_data(station: str, **kwargs) -> tuple:
+    """
+    Make synthetic current meter and CTD data of a station in the format of the files written by
+    convert_cur_ctd_from_shell.do_conversion(), with pad values replaced by nan
+    :param station: name of station
+    :param kwargs: keyword arguments for make_deployments(), e.g. start_year and end_year
+    :return: dataframe of current meter data, dataframe of CTD data
+    """
+    inst_data = {'cur': [], 'ctd': []}
+    for filename, obs_df in make_deployments(station, **kwargs):
+        for var, pads in PAD_VALUES.items():
+            obs_df.loc[np.isin(obs_df[var].to_numpy(), pads), var] = np.nan
+        obs_df['Filename'] = filename
+        inst_data[filename.split('.')[-1].lower()].append(obs_df)
+
+    columns = SHELL_VARS + ['Filename']
+    return tuple(
+        pd.concat(inst_data[inst], ignore_index=True) if len(inst_data[inst]) > 0 else pd.DataFrame(columns=columns)
+        for inst in ['cur', 'ctd']
+    )
+
+
+def write_station_data(data_dir: str, station: str, **kwargs):
+    """
+    Write synthetic current meter and CTD data of a station to csv files named like those read by
+    plot_moored_data.load_raw_data(), so that run_plot() can be run on them
+    :param data_dir: directory to write the csv files to
+    :param station: name of station
+    :param kwargs: keyword arguments for make_deployments(), e.g. start_year and end_year
+    :return:
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    cur_data, ctd_data = make_station_data(station, **kwargs)
+    # Special case: E01 includes the current meter file converted from netCDF
+    cur_file = f'{station.lower()}_cur_data_all.csv' if station == 'E01' else f'{station.lower()}_cur_data.csv'
+    cur_data.to_csv(os.path.join(data_dir, cur_file), index=False)
+    ctd_data.to_csv(os.path.join(data_dir, f'{station.lower()}_ctd_data.csv'), index=False)
+    return
@@ -1,15 +1,212 @@
-import wget
+import os
+import json
+import time
+import http.client
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
 import numpy as np
-from tqdm import trange
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from tqdm import tqdm
 # from Samantha Huntington
 
+# Name of the file in the download directory that records the size of each downloaded file,
+# so that files already downloaded are skipped
+MANIFEST_NAME = 'download_manifest.json'
 
-def get_files(station: str):
-    """wget download for waterproperties files"""
+# Suffix of files being downloaded; a partial file is resumed from where it stopped
+PART_SUFFIX = '.part'
+
+# Size of the blocks that downloads are written in, in bytes
+CHUNK_SIZE = 1024 * 1024
+
+
+def load_manifest(manifest_file: str) -> dict:
+    """
+    Load the download manifest of a directory
+    :param manifest_file: full path to the manifest file
+    :return: dict of file name: dict of url and size of the downloaded file
+    """
+    if not os.path.exists(manifest_file):
+        return {}
+    with open(manifest_file, 'r') as f:
+        return json.load(f)
+
+
+def save_manifest(manifest: dict, manifest_file: str):
+    """
+    Save the download manifest, replacing the old one only once written
+    :param manifest: dict of file name: dict of url and size of the downloaded file
+    :param manifest_file: full path to the manifest file
+    :return:
+    """
+    with open(manifest_file + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(manifest_file + '.tmp', manifest_file)
+    return
+
+
+def get_remote_size(url: str, timeout: float):
+    """
+    Get the size of a remote file without downloading it
+    :param url: url of the file
+    :param timeout: seconds to wait for the server
+    :return: size in bytes, or None if the server doesn't report it
+    """
+    with urllib.request.urlopen(urllib.request.Request(url, method='HEAD'), timeout=timeout) as response:
+        size = response.headers.get('Content-Length')
+    return None if size is None else int(size)
+
+
+def download_file(url: str, output_file: str, retries: int = 3, timeout: float = 60) -> int:
+    """
+    Download a file, writing it to output_file + PART_SUFFIX first and moving it into place once complete.
+    If a partial file is left from an earlier attempt or run, the download is resumed from the end of it
+    with an HTTP range request, or started again if the server doesn't support ranges
+    :param url: url of the file
+    :param output_file: full path to save the file to
+    :param retries: number of times to try again after a failed attempt, waiting longer after each one
+    :param timeout: seconds to wait for the server
+    :return: size of the downloaded file in bytes
+    """
+    part_file = output_file + PART_SUFFIX
+    for attempt in range(retries + 1):
+        try:
+            start = os.path.getsize(part_file) if os.path.exists(part_file) else 0
+            request = urllib.request.Request(url)
+            if start > 0:
+                request.add_header('Range', f'bytes={start}-')
+
+            try:
+                response = urllib.request.urlopen(request, timeout=timeout)
+            except urllib.error.HTTPError as e:
+                if e.code == 416:
+                    # The partial file is not a prefix of the remote file, so start again
+                    os.remove(part_file)
+                    continue
+                raise
+
+            with response:
+                # 206 means the server is sending the rest of the file, otherwise it sends all of it
+                is_resumed = start > 0 and response.status == 206
+                length = response.headers.get('Content-Length')
+                expected_size = None if length is None else int(length) + (start if is_resumed else 0)
+                with open(part_file, 'ab' if is_resumed else 'wb') as f:
+                    while True:
+                        chunk = response.read(CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        f.write(chunk)
+
+            size = os.path.getsize(part_file)
+            if expected_size is not None and size != expected_size:
+                raise IOError(f'Incomplete download of {url}: {size} of {expected_size} bytes')
+            os.replace(part_file, output_file)
+            return size
+        except (urllib.error.URLError, http.client.HTTPException, OSError) as e:
+            # Don't retry requests the server rejected, e.g. missing files
+            if attempt == retries or (isinstance(e, urllib.error.HTTPError) and e.code < 500):
+                raise
+            time.sleep(2 ** attempt)
+    raise IOError(f'Could not download {url} after {retries + 1} attempts')
 
+
+def start_downloads(urls: list, output_dir: str, executor: ThreadPoolExecutor, retries: int = 3,
+                    timeout: float = 60) -> dict:
+    """
+    Submit downloads to a thread pool and return without waiting for them, so that the files can be used as
+    they land, e.g. by convert_cur_ctd_from_shell.download_and_convert(). Files recorded in the download
+    manifest of output_dir with the same size as the file on disk are skipped, as are files already on disk
+    with the same size as the remote file, e.g. from downloads made before the manifest. Partial files are
+    resumed. The manifest is saved after each file so that an interrupted run can be continued by running it again
+    :param urls: urls of the files to download
+    :param output_dir: directory to save the files to
+    :param executor: pool of threads to download with; its number of workers is the number of connections
+    :param retries: number of times to try each file again after a failed attempt
+    :param timeout: seconds to wait for the server
+    :return: dict of full path of each file: future of (size in bytes, True if it was skipped)
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_file = os.path.join(output_dir, MANIFEST_NAME)
+    manifest = load_manifest(manifest_file)
+    manifest_lock = threading.Lock()
+
+    def is_downloaded(url: str, output_file: str) -> bool:
+        name = os.path.basename(output_file)
+        if not os.path.exists(output_file):
+            return False
+        with manifest_lock:
+            entry = manifest.get(name)
+        if entry is not None:
+            return entry['url'] == url and entry['size'] == os.path.getsize(output_file)
+        # Downloaded before there was a manifest, so check the size against the server's
+        try:
+            return get_remote_size(url, timeout) == os.path.getsize(output_file)
+        except (OSError, http.client.HTTPException):
+            # Download it again if the server can't tell, e.g. it times out or drops the connection.
+            # URLError is an OSError
+            return False
+
+    def download(url: str, output_file: str) -> tuple:
+        skipped = is_downloaded(url, output_file)
+        size = os.path.getsize(output_file) if skipped else download_file(url, output_file, retries, timeout)
+        with manifest_lock:
+            manifest[os.path.basename(output_file)] = {'url': url, 'size': size}
+            save_manifest(manifest, manifest_file)
+        return size, skipped
+
+    downloads = {}
+    for url in urls:
+        output_file = os.path.join(output_dir, os.path.basename(urllib.parse.urlparse(url).path))
+        downloads[output_file] = executor.submit(download, url, output_file)
+    return downloads
+
+
+def print_download_summary(downloads: dict) -> list:
+    """
+    Print how many files were downloaded and skipped, and the files that failed
+    :param downloads: finished downloads returned by start_downloads()
+    :return: list of (full path of file, error message) of the files that could not be downloaded
+    """
+    failed = [(f, str(future.exception())) for f, future in downloads.items() if future.exception() is not None]
+    num_skipped = sum(future.result()[1] for future in downloads.values() if future.exception() is None)
+    print(f'Downloaded {len(downloads) - num_skipped - len(failed)} files, skipped {num_skipped} files already present')
+    for output_file, error in failed:
+        print('Failed to download', os.path.basename(output_file), ':', error)
+    return failed
+
+
+def download_files(urls: list, output_dir: str, num_workers: int = 8, retries: int = 3, timeout: float = 60) -> list:
+    """
+    Download files with up to num_workers connections at once, see start_downloads()
+    :param urls: urls of the files to download
+    :param output_dir: directory to save the files to
+    :param num_workers: maximum number of files to download at once
+    :param retries: number of times to try each file again after a failed attempt
+    :param timeout: seconds to wait for the server
+    :return: list of (full path of file, error message) of the files that could not be downloaded
+    """
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        downloads = start_downloads(urls, output_dir, executor, retries, timeout)
+        for _ in tqdm(as_completed(downloads.values()), total=len(downloads)):
+            pass
+    return print_download_summary(downloads)
+
+
+def get_download_list(station: str) -> tuple:
+    """
+    Get the urls in the Water Properties download list of a station and the directory to download them to
+    :param station: name of station
+    :return: list of urls, full path of the download directory
+    """
     path = f"E:\\charles\\mooring_data_page\\{station.lower()}\\"
     address = np.genfromtxt(path + f"wget_file_download_list_{station.lower()}.csv", dtype=str)
+    return ['https://' + x for x in np.atleast_1d(address)], path + 'ios_shell_data\\'
 
-    for i in trange(address.size):
-        wget.download('https://' + address[i], out=path + 'ios_shell_data\\')
-    return
+
+def get_files(station: str, num_workers: int = 8):
+    """wget download for waterproperties files"""
+
+    urls, output_dir = get_download_list(station)
+    return download_files(urls, output_dir, num_workers)
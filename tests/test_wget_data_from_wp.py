@@ -0,0 +1,224 @@
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import unittest
+import urllib.error
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'scripts'))
+import wget_data_from_wp as wget
+
+"""
+Run download_file() and download_files() against a local stand-in for the Water Properties server
+that serves HTTP range requests, e.g.:
+python -m unittest discover tests
+"""
+
+# Files served by the stand-in server, by url path
+FILES = {
+    '/E01_20190801_20200718_0035m_L1.cur': bytes(range(256)) * 40,
+    '/E01_20100502_20100807_0035m.ctd': b'*END OF HEADER\n' + b'12.3 32.1 35.0\n' * 500
+}
+
+
+class RangeRequestHandler(BaseHTTPRequestHandler):
+    """
+    Serve FILES with support for "Range: bytes=start-" requests, like the Water Properties server.
+    The server attributes set by the tests change its behaviour: ignore_range to always send the whole
+    file, drop_after to close the connection after that many bytes of the first response, and head_error
+    to answer HEAD requests with 'hang', waiting until the test ends, or 'drop', closing the connection
+    """
+    def log_message(self, format, *args):
+        return
+
+    def do_HEAD(self):
+        if self.server.head_error == 'hang':
+            self.server.release.wait()
+            self.close_connection = True
+            return
+        if self.server.head_error == 'drop':
+            self.close_connection = True
+            return
+        self.send_file(head_only=True)
+
+    def do_GET(self):
+        self.send_file()
+
+    def send_file(self, head_only: bool = False):
+        server = self.server
+        with server.lock:
+            server.requests.append((self.command, self.path, self.headers.get('Range')))
+        content = FILES.get(self.path)
+        if content is None:
+            self.send_error(404)
+            return
+
+        start = 0
+        range_header = self.headers.get('Range')
+        if range_header is not None and not server.ignore_range:
+            start = int(range_header.split('=')[1].rstrip('-'))
+            if start >= len(content):
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{len(content)}')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{len(content) - 1}/{len(content)}')
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(content) - start))
+        self.end_headers()
+        if head_only:
+            return
+
+        body = content[start:]
+        with server.lock:
+            drop_after = server.drop_after
+            server.drop_after = None
+        if drop_after is not None:
+            # Send part of the body and close the connection, like a dropped download
+            self.wfile.write(body[:drop_after])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+
+class TestDownloads(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), RangeRequestHandler)
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        self.server.ignore_range = False
+        self.server.drop_after = None
+        self.server.head_error = None
+        self.server.release = threading.Event()
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.base_url = f'http://127.0.0.1:{self.server.server_address[1]}'
+        self.output_dir = tempfile.mkdtemp()
+        # Don't wait between attempts
+        self.sleep = mock.patch.object(wget.time, 'sleep').start()
+
+    def tearDown(self):
+        mock.patch.stopall()
+        self.server.release.set()
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.output_dir)
+
+    def get_requests(self, command: str = 'GET') -> list:
+        return [request for request in self.server.requests if request[0] == command]
+
+    def output_file(self, path: str) -> str:
+        return os.path.join(self.output_dir, path.lstrip('/'))
+
+    def read(self, path: str) -> bytes:
+        with open(self.output_file(path), 'rb') as f:
+            return f.read()
+
+    def write_part(self, path: str, content: bytes):
+        with open(self.output_file(path) + wget.PART_SUFFIX, 'wb') as f:
+            f.write(content)
+
+    def test_download(self):
+        path = '/E01_20190801_20200718_0035m_L1.cur'
+        size = wget.download_file(self.base_url + path, self.output_file(path))
+        self.assertEqual(size, len(FILES[path]))
+        self.assertEqual(self.read(path), FILES[path])
+        self.assertFalse(os.path.exists(self.output_file(path) + wget.PART_SUFFIX))
+
+    def test_resume_partial_file(self):
+        path = '/E01_20190801_20200718_0035m_L1.cur'
+        self.write_part(path, FILES[path][:3000])
+        wget.download_file(self.base_url + path, self.output_file(path))
+        self.assertEqual(self.read(path), FILES[path])
+        self.assertEqual(self.get_requests(), [('GET', path, 'bytes=3000-')])
+
+    def test_resume_after_dropped_connection(self):
+        path = '/E01_20190801_20200718_0035m_L1.cur'
+        self.server.drop_after = 4000
+        wget.download_file(self.base_url + path, self.output_file(path), retries=2)
+        self.assertEqual(self.read(path), FILES[path])
+        # The second attempt continues from where the first one stopped, after backing off
+        self.assertEqual(self.get_requests(), [('GET', path, None), ('GET', path, 'bytes=4000-')])
+        self.sleep.assert_called_once_with(1)
+
+    def test_restart_when_server_ignores_range(self):
+        path = '/E01_20190801_20200718_0035m_L1.cur'
+        self.server.ignore_range = True
+        self.write_part(path, FILES[path][:3000])
+        wget.download_file(self.base_url + path, self.output_file(path))
+        # The whole file is sent, so it is written from the start rather than appended
+        self.assertEqual(self.read(path), FILES[path])
+
+    def test_restart_when_range_not_satisfiable(self):
+        path = '/E01_20100502_20100807_0035m.ctd'
+        # A partial file longer than the remote file, e.g. from a different version of it
+        self.write_part(path, b'x' * (len(FILES[path]) + 10))
+        wget.download_file(self.base_url + path, self.output_file(path))
+        self.assertEqual(self.read(path), FILES[path])
+        self.assertEqual(self.get_requests(),
+                         [('GET', path, f'bytes={len(FILES[path]) + 10}-'), ('GET', path, None)])
+
+    def test_no_retry_for_missing_file(self):
+        path = '/missing.cur'
+        with self.assertRaises(urllib.error.HTTPError) as context:
+            wget.download_file(self.base_url + path, self.output_file(path), retries=3)
+        self.assertEqual(context.exception.code, 404)
+        self.assertEqual(len(self.get_requests()), 1)
+        self.sleep.assert_not_called()
+
+    def test_skip_files_already_downloaded(self):
+        urls = [self.base_url + path for path in FILES] + [self.base_url + '/missing.cur']
+        failed = wget.download_files(urls, self.output_dir, num_workers=2)
+        self.assertEqual([os.path.basename(f) for f, _ in failed], ['missing.cur'])
+        for path in FILES:
+            self.assertEqual(self.read(path), FILES[path])
+        manifest = wget.load_manifest(os.path.join(self.output_dir, wget.MANIFEST_NAME))
+        self.assertEqual(sorted(manifest), sorted(path.lstrip('/') for path in FILES))
+
+        # Running again only requests the file that failed
+        num_requests = len(self.get_requests())
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            downloads = wget.start_downloads(urls, self.output_dir, executor)
+        for path in FILES:
+            self.assertEqual(downloads[self.output_file(path)].result(), (len(FILES[path]), True))
+        self.assertEqual(len(self.get_requests()) - num_requests, 1)
+
+    def test_skip_files_downloaded_before_manifest(self):
+        path = '/E01_20100502_20100807_0035m.ctd'
+        with open(self.output_file(path), 'wb') as f:
+            f.write(FILES[path])
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            downloads = wget.start_downloads([self.base_url + path], self.output_dir, executor)
+        self.assertEqual(downloads[self.output_file(path)].result(), (len(FILES[path]), True))
+        # The size was checked with a HEAD request instead of downloading the file again
+        self.assertEqual(len(self.get_requests('HEAD')), 1)
+        self.assertEqual(len(self.get_requests()), 0)
+
+    def check_head_error_downloads_again(self, head_error: str):
+        path = '/E01_20100502_20100807_0035m.ctd'
+        with open(self.output_file(path), 'wb') as f:
+            f.write(FILES[path])
+        self.server.head_error = head_error
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            downloads = wget.start_downloads([self.base_url + path], self.output_dir, executor, timeout=0.5)
+        # The size couldn't be checked, so the file is downloaded again instead of failing
+        self.assertEqual(downloads[self.output_file(path)].result(), (len(FILES[path]), False))
+        self.assertEqual(self.read(path), FILES[path])
+        self.assertEqual(self.get_requests(), [('GET', path, None)])
+
+    def test_download_again_when_size_check_times_out(self):
+        self.check_head_error_downloads_again('hang')
+
+    def test_download_again_when_size_check_disconnects(self):
+        self.check_head_error_downloads_again('drop')
+
+
+if __name__ == '__main__':
+    unittest.main()